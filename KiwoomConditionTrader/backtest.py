@@ -0,0 +1,487 @@
+import argparse
+import collections
+import csv
+import itertools
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from KiwoomConditionTrader.exit_rules import ExitRuleEngine
+from KiwoomConditionTrader.position_book import Position
+from KiwoomConditionTrader.settings import *
+from KiwoomConditionTrader.tick_recorder import EVENT_TICK, EVENT_CONDITION_INSERT, EVENT_CONDITION_DELETE, \
+    TickRecordingReader
+from KiwoomConditionTrader.trader_threads import build_exit_rules, calculate_order_amount, calculate_earning_rate, \
+    is_out_of_limits
+from Util.debugger import *
+
+EVENT_KINDS = {'tick': EVENT_TICK, 'insert': EVENT_CONDITION_INSERT, 'delete': EVENT_CONDITION_DELETE}
+
+# profit_limit/loss_limit 은 PROFIT_LIMIT/LOSS_LIMIT 과 같은 % 단위(손실하한은 음수)
+# condition_exit_limits 는 CONDITION_EXIT_LIMITS 와 같은 {조건식이름: (수익상한, 손실하한)}
+# fill_delay 는 주문 후 체결까지 걸리는 시간(초), 0 이면 주문 시점의 현재가로 바로 체결
+# fee_rate 는 매수/매도 금액에 각각 붙는 수수료+세금 비율
+# trailing_stop_percent ~ take_profit_tiers 는 [청산규칙] 과 같은 값, 하나라도 있으면 실매매와 같이 ExitRuleEngine 으로 매도
+BacktestParameters = collections.namedtuple(
+    'BacktestParameters', ['profit_limit', 'loss_limit', 'buy_price', 'condition_exit_limits', 'fill_delay',
+                           'fee_rate', 'trailing_stop_percent', 'trailing_stop_activation_percent',
+                           'time_stop_seconds', 'take_profit_tiers'])
+
+
+def default_parameters(**kwargs):
+    parameters = dict(profit_limit=PROFIT_LIMIT,
+                      loss_limit=LOSS_LIMIT,
+                      buy_price=BUY_PRICE,
+                      condition_exit_limits=CONDITION_EXIT_LIMITS,
+                      fill_delay=0.0,
+                      fee_rate=0.0,
+                      trailing_stop_percent=TRAILING_STOP_PERCENT,
+                      trailing_stop_activation_percent=TRAILING_STOP_ACTIVATION_PERCENT,
+                      time_stop_seconds=TIME_STOP_SECONDS,
+                      take_profit_tiers=TAKE_PROFIT_TIERS)
+    parameters.update(kwargs)
+    return BacktestParameters(**parameters)
+
+
+def has_stateful_exit_rules(parameters):
+    return bool(parameters.trailing_stop_percent or parameters.time_stop_seconds or parameters.take_profit_tiers)
+
+
+class BacktestEvents(object):
+    """
+    시간순으로 정렬된 조건식 편입/이탈, 체결가(tick) 이벤트의 column 모음
+    종목코드와 조건식 이름은 id 로 바꿔서 들고 있고, stock_codes / condition_names 로 다시 찾음
+    """
+
+    def __init__(self, timestamps, kinds, code_ids, prices, condition_ids, stock_codes, condition_names):
+        order = np.argsort(timestamps, kind='stable')
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)[order]
+        self.kinds = np.asarray(kinds, dtype=np.int8)[order]
+        self.code_ids = np.asarray(code_ids, dtype=np.int32)[order]
+        self.prices = np.asarray(prices, dtype=np.float64)[order]
+        self.condition_ids = np.asarray(condition_ids, dtype=np.int32)[order]
+        self.stock_codes = list(stock_codes)
+        self.condition_names = list(condition_names)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """(timestamp, kind, stock_code, price, condition_name) 행들로 만듦, kind 는 EVENT_* 값"""
+        stock_code_ids = dict()
+        condition_name_ids = dict()
+        timestamps, kinds, code_ids, prices, condition_ids = list(), list(), list(), list(), list()
+        for timestamp, kind, stock_code, price, condition_name in rows:
+            timestamps.append(timestamp)
+            kinds.append(kind)
+            code_ids.append(stock_code_ids.setdefault(stock_code, len(stock_code_ids)))
+            prices.append(price or 0)
+            condition_ids.append(condition_name_ids.setdefault(condition_name, len(condition_name_ids))
+                                 if condition_name else -1)
+        return cls(timestamps, kinds, code_ids, prices, condition_ids, stock_code_ids, condition_name_ids)
+
+    @classmethod
+    def read_csv(cls, path):
+        """
+        timestamp,event,stock_code,price,condition_name 헤더의 csv 를 읽음
+        event 는 tick / insert / delete, tick 은 price 를, insert/delete 는 condition_name 을 채움
+        """
+        def rows():
+            with open(path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    yield (float(row['timestamp']), EVENT_KINDS[row['event']], row['stock_code'],
+                           float(row['price'] or 0), row['condition_name'] or None)
+        return cls.from_rows(rows())
+
+    @classmethod
+    def read_recordings(cls, paths):
+        """TickRecorder 기록 파일(여러 날짜 가능)을 읽음, 조건식 id 는 파일마다 다르므로 이름으로 다시 맞춤"""
+        readers = [TickRecordingReader(path) for path in paths]
+        condition_names = list(dict.fromkeys(condition_name for reader in readers
+                                             for condition_name in reader.condition_names))
+        condition_name_ids = {condition_name: i for i, condition_name in enumerate(condition_names)}
+
+        condition_ids = list()
+        for reader in readers:
+            # 파일의 condition_id -> 전체 condition_id, 마지막 칸은 tick 의 -1 을 그대로 -1 로 보냄
+            id_map = np.array([condition_name_ids[condition_name] for condition_name in reader.condition_names]
+                              + [-1], dtype=np.int32)
+            condition_ids.append(id_map[reader.condition_ids])
+
+        stock_codes, code_ids = np.unique(np.concatenate([reader.stock_codes for reader in readers]),
+                                          return_inverse=True)
+        return cls(np.concatenate([reader.timestamps for reader in readers]),
+                   np.concatenate([reader.kinds for reader in readers]),
+                   code_ids,
+                   np.concatenate([reader.prices for reader in readers]),
+                   np.concatenate(condition_ids),
+                   [stock_code.decode('ascii') for stock_code in stock_codes],
+                   condition_names)
+
+
+def generate_events(symbols=300, seconds=6.5 * 3600, ticks_per_second=100, condition_hit_rate=0.001,
+                    condition_names=None, initial_price=10000, volatility=0.002, seed=0):
+    """SimulatedExchange 와 같은 방식(종목별 random walk, 무작위 편입/이탈)의 이벤트를 numpy 로 한번에 만듦"""
+    rng = np.random.default_rng(seed)
+    condition_names = condition_names or CONDITION_LIST
+    tick_count = int(seconds * ticks_per_second)
+
+    timestamps = np.sort(rng.uniform(0, seconds, tick_count))
+    code_ids = rng.integers(0, symbols, tick_count).astype(np.int32)
+    returns = 1 + rng.normal(0, volatility, tick_count)
+    prices = np.empty(tick_count)
+    initial_prices = (initial_price * rng.uniform(0.5, 1.5, symbols)).round()
+    for code_id in range(symbols):
+        index = np.flatnonzero(code_ids == code_id)
+        prices[index] = np.maximum(1, (initial_prices[code_id] * np.cumprod(returns[index])).round())
+
+    # 편입/이탈은 종목별로 번갈아 일어나도록 상태를 보면서 만듦
+    hit_index = np.flatnonzero(rng.random(tick_count) < condition_hit_rate)
+    hit_code_ids = rng.integers(0, symbols, len(hit_index))
+    hit_condition_ids = rng.integers(0, len(condition_names), len(hit_index))
+    inserted = dict()
+    hit_kinds = np.empty(len(hit_index), dtype=np.int8)
+    for i, (code_id, condition_id) in enumerate(zip(hit_code_ids.tolist(), hit_condition_ids.tolist())):
+        if code_id in inserted:
+            hit_kinds[i] = EVENT_CONDITION_DELETE
+            hit_condition_ids[i] = inserted.pop(code_id)
+        else:
+            hit_kinds[i] = EVENT_CONDITION_INSERT
+            inserted[code_id] = condition_id
+
+    return BacktestEvents(np.concatenate([timestamps, timestamps[hit_index]]),
+                          np.concatenate([np.full(tick_count, EVENT_TICK, dtype=np.int8), hit_kinds]),
+                          np.concatenate([code_ids, hit_code_ids]),
+                          np.concatenate([prices, np.zeros(len(hit_index))]),
+                          np.concatenate([np.full(tick_count, -1, dtype=np.int32), hit_condition_ids]),
+                          ['{:06d}'.format(x) for x in range(1, symbols + 1)],
+                          condition_names)
+
+
+class BacktestEngine(object):
+    """
+    기록된 이벤트를 시뮬레이션 시계(이벤트 timestamp)로 처리하면서 실매매와 같은 규칙으로 매수/매도
+    1. 매수 : KiwoomCatchConditionOrder 와 같이 조건식에 편입된 종목을 한번만 매수하고, 이탈해야 다시 매수할 수 있음
+       현재가가 아직 없으면 첫 tick 까지 기다리고, 수량은 calculate_order_amount 로 계산
+    2. 매도 : tick 마다 해당 종목의 보유 주문을 청산 규칙의 BandExit 과 같은 기준
+       (calculate_earning_rate, is_out_of_limits)으로 비교, 수익상한/손실하한은 조건식별 설정을 따름
+       추적손절/보유시간/분할익절 파라미터가 있으면 실매매와 같은 build_exit_rules 규칙을 ExitRuleEngine 으로
+       이벤트 timestamp 기준으로 비교하고, 규칙이 정한 수량만큼(분할익절은 일부) 매도
+    3. 시장가 주문은 fill_delay 가 지난 뒤의 첫 tick 가격으로 체결
+    """
+
+    def __init__(self, events, parameters):
+        self.events = events
+        self.parameters = parameters
+
+        self.exit_limits = [parameters.condition_exit_limits.get(condition_name,
+                                                                 (parameters.profit_limit, parameters.loss_limit))
+                            for condition_name in events.condition_names]
+        self.default_exit_limits = (parameters.profit_limit, parameters.loss_limit)
+
+        self.exit_rule_engine = None
+        if has_stateful_exit_rules(parameters):
+            exit_limits = dict(zip(events.condition_names, self.exit_limits))
+            self.exit_rule_engine = ExitRuleEngine(lambda condition_name: build_exit_rules(
+                *exit_limits.get(condition_name, self.default_exit_limits),
+                trailing_stop_percent=parameters.trailing_stop_percent,
+                trailing_stop_activation_percent=parameters.trailing_stop_activation_percent,
+                time_stop_seconds=parameters.time_stop_seconds,
+                take_profit_tiers=parameters.take_profit_tiers))
+
+    def run(self):
+        parameters = self.parameters
+        buy_price = parameters.buy_price
+        fill_delay = parameters.fill_delay
+        fee_rate = parameters.fee_rate
+        exit_limits = self.exit_limits
+        default_exit_limits = self.default_exit_limits
+        exit_rule_engine = self.exit_rule_engine
+        condition_names = self.events.condition_names
+
+        code_count = len(self.events.stock_codes)
+        last_prices = [0.0] * code_count
+        condition_counts = [0] * code_count
+        # 조건식 편입 후 처리(매수 or 수량 0 으로 건너뜀)한 종목, 이탈하면 삭제
+        meet_real_conditions_history = set()
+        # 현재가를 몰라서 첫 tick 을 기다리는 편입 종목 {code_id: condition_id}
+        waiting_entries = dict()
+        # 종목별 보유 주문 [매수시각, 매수가, 수량, condition_id, 수익상한, 손실하한, 매도주문 중 여부]
+        positions = collections.defaultdict(list)
+        # 종목별 체결 대기 주문 [체결가능시각, 'buy'/'sell', 주문시각, 수량, condition_id, 매도할 보유 주문]
+        open_orders = collections.defaultdict(list)
+        # exit_rule_engine 을 쓸 때의 보유 주문 {매수 번호: Position}, stock_code 자리에 code_id 를 넣음
+        rule_positions = dict()
+        rule_condition_ids = dict()
+        position_numbers = itertools.count()
+
+        trades = list()
+        buy_count = 0
+
+        def submit(code_id, timestamp, side, amount, condition_id, position=None):
+            open_orders[code_id].append([timestamp + fill_delay, side, timestamp, amount, condition_id, position])
+
+        def fill(code_id, order, timestamp, price):
+            _, side, ordered_at, amount, condition_id, position = order
+            if exit_rule_engine is not None:
+                fill_rule_position(code_id, side, amount, condition_id, position, timestamp, price)
+            elif side == 'buy':
+                profit_limit, loss_limit = exit_limits[condition_id] if condition_id >= 0 else default_exit_limits
+                positions[code_id].append([timestamp, price, amount, condition_id, profit_limit, loss_limit, False])
+            else:
+                positions[code_id].remove(position)
+                bought_at, bought_price, amount, condition_id = position[:4]
+                fee = (bought_price + price) * amount * fee_rate
+                trades.append((code_id, condition_id, bought_at, bought_price, timestamp, price, amount,
+                               (price - bought_price) * amount - fee))
+
+        def fill_rule_position(code_id, side, amount, condition_id, position, timestamp, price):
+            if side == 'buy':
+                position = Position(next(position_numbers), code_id, amount, price,
+                                    condition_name=condition_names[condition_id] if condition_id >= 0 else None,
+                                    bought_at=timestamp)
+                rule_positions[position.buy_order_number] = position
+                rule_condition_ids[position.buy_order_number] = condition_id
+                exit_rule_engine.position_added(position)
+                return
+
+            fee = (position.price + price) * amount * fee_rate
+            trades.append((code_id, condition_id, position.bought_at, position.price, timestamp, price, amount,
+                           (price - position.price) * amount - fee))
+            # 분할익절처럼 일부만 매도했으면 남은 수량으로 다시 매도 대상
+            position.sell_order_number = None
+            position.amount -= amount
+            if position.amount > 0:
+                exit_rule_engine.position_updated(position)
+            else:
+                del rule_positions[position.buy_order_number]
+                del rule_condition_ids[position.buy_order_number]
+                exit_rule_engine.position_removed(position)
+
+        def exit_by_rules(code_id, timestamp, price):
+            for buy_order_number, _, amount in exit_rule_engine.on_price(code_id, price, timestamp):
+                position = rule_positions[buy_order_number]
+                position.sell_order_number = 'backtest'
+                exit_rule_engine.position_updated(position)
+                submit(code_id, timestamp, 'sell', amount, rule_condition_ids[buy_order_number], position)
+                if not fill_delay:
+                    fill(code_id, open_orders[code_id].pop(), timestamp, price)
+
+        def enter(code_id, timestamp, condition_id):
+            nonlocal buy_count
+            current_price = last_prices[code_id]
+            if not current_price:
+                waiting_entries[code_id] = condition_id
+                return
+            meet_real_conditions_history.add(code_id)
+            order_amount = calculate_order_amount(buy_price, current_price)
+            if order_amount == 0:
+                return
+            buy_count += 1
+            submit(code_id, timestamp, 'buy', order_amount, condition_id)
+            if not fill_delay:
+                fill(code_id, open_orders[code_id].pop(), timestamp, current_price)
+
+        events = self.events
+        for timestamp, kind, code_id, price, condition_id in zip(events.timestamps.tolist(), events.kinds.tolist(),
+                                                                 events.code_ids.tolist(), events.prices.tolist(),
+                                                                 events.condition_ids.tolist()):
+            if kind == EVENT_TICK:
+                last_prices[code_id] = price
+
+                orders = open_orders.get(code_id)
+                if orders:
+                    for order in [order for order in orders if order[0] <= timestamp]:
+                        orders.remove(order)
+                        fill(code_id, order, timestamp, price)
+
+                if code_id in waiting_entries:
+                    enter(code_id, timestamp, waiting_entries.pop(code_id))
+
+                if exit_rule_engine is not None:
+                    exit_by_rules(code_id, timestamp, price)
+                    continue
+
+                code_positions = positions.get(code_id)
+                if not code_positions:
+                    continue
+                for position in list(code_positions):
+                    if position[6] or not position[1]:
+                        continue
+                    if is_out_of_limits(calculate_earning_rate(price, position[1]), position[4], position[5]):
+                        position[6] = True
+                        submit(code_id, timestamp, 'sell', position[2], position[3], position)
+                        if not fill_delay:
+                            fill(code_id, open_orders[code_id].pop(), timestamp, price)
+
+            elif kind == EVENT_CONDITION_INSERT:
+                condition_counts[code_id] += 1
+                if code_id not in meet_real_conditions_history and code_id not in waiting_entries:
+                    enter(code_id, timestamp, condition_id)
+
+            elif kind == EVENT_CONDITION_DELETE:
+                condition_counts[code_id] = max(0, condition_counts[code_id] - 1)
+                if condition_counts[code_id] == 0:
+                    meet_real_conditions_history.discard(code_id)
+                    waiting_entries.pop(code_id, None)
+
+        unrealized_pnl = sum((last_prices[code_id] - position[1]) * position[2]
+                             for code_id, code_positions in positions.items() for position in code_positions)
+        unrealized_pnl += sum((last_prices[position.stock_code] - position.price) * position.amount
+                              for position in rule_positions.values())
+        return BacktestResult(self.events, self.parameters, trades, buy_count, unrealized_pnl,
+                              sum(len(code_positions) for code_positions in positions.values())
+                              + len(rule_positions))
+
+
+class BacktestResult(object):
+    def __init__(self, events, parameters, trades, buy_count, unrealized_pnl, open_position_count):
+        self.events = events
+        self.parameters = parameters
+        self.trades = trades
+        self.buy_count = buy_count
+        self.unrealized_pnl = unrealized_pnl
+        self.open_position_count = open_position_count
+
+    def summary(self):
+        pnls = np.array([trade[-1] for trade in self.trades], dtype=np.float64)
+        cumulative = np.cumsum(pnls)
+        drawdown = float(np.max(np.maximum.accumulate(np.concatenate([[0], cumulative]))[1:] - cumulative)) \
+            if len(pnls) else 0.0
+        realized_pnl = float(pnls.sum())
+        return dict(profit_limit=self.parameters.profit_limit,
+                    loss_limit=self.parameters.loss_limit,
+                    buy_price=self.parameters.buy_price,
+                    trailing_stop_percent=self.parameters.trailing_stop_percent,
+                    time_stop_seconds=self.parameters.time_stop_seconds,
+                    buy_count=self.buy_count,
+                    trade_count=len(self.trades),
+                    win_rate=float((pnls > 0).mean()) if len(pnls) else 0.0,
+                    realized_pnl=realized_pnl,
+                    unrealized_pnl=self.unrealized_pnl,
+                    total_pnl=realized_pnl + self.unrealized_pnl,
+                    max_drawdown=drawdown,
+                    open_position_count=self.open_position_count)
+
+    def write_trades_csv(self, path):
+        stock_codes = self.events.stock_codes
+        condition_names = self.events.condition_names
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stock_code', 'condition_name', 'bought_at', 'buy_price', 'sold_at', 'sell_price',
+                             'amount', 'pnl'])
+            for code_id, condition_id, bought_at, buy_price, sold_at, sell_price, amount, pnl in self.trades:
+                writer.writerow([stock_codes[code_id], condition_names[condition_id] if condition_id >= 0 else '',
+                                 bought_at, buy_price, sold_at, sell_price, amount, pnl])
+
+
+def run_backtest(events, parameters):
+    return BacktestEngine(events, parameters).run()
+
+
+# 병렬 sweep 에서 worker 프로세스마다 이벤트를 한번만 받아두고 파라미터만 넘겨받음
+worker_events = None
+
+
+def init_sweep_worker(events):
+    global worker_events
+    worker_events = events
+
+
+def run_sweep_task(parameters):
+    return run_backtest(worker_events, parameters).summary()
+
+
+def parameter_grid(profit_limits, loss_limits, buy_prices=None, trailing_stops=None, time_stops=None, **kwargs):
+    """
+    수익상한 x 손실하한 x 매수금액 x 추적손절 x 보유시간 조합마다 BacktestParameters, 손실하한은 음수로 넘김
+    매수금액/추적손절/보유시간을 주지 않으면 Settings.ini 값, 추적손절/보유시간 0 은 사용하지 않음
+    """
+    grid = list()
+    for profit_limit, loss_limit, buy_price, trailing_stop, time_stop in itertools.product(
+            profit_limits, loss_limits, buy_prices or [None], trailing_stops or [None], time_stops or [None]):
+        parameters = dict(kwargs, profit_limit=profit_limit, loss_limit=loss_limit)
+        if buy_price is not None:
+            parameters['buy_price'] = buy_price
+        if trailing_stop is not None:
+            parameters['trailing_stop_percent'] = trailing_stop
+        if time_stop is not None:
+            parameters['time_stop_seconds'] = time_stop
+        grid.append(default_parameters(**parameters))
+    return grid
+
+
+def run_sweep(events, parameters_list, processes=None):
+    """파라미터 조합들을 여러 프로세스에서 나누어 backtest, 입력 순서대로 summary 리스트를 돌려줌"""
+    if processes == 1:
+        return [run_backtest(events, parameters).summary() for parameters in parameters_list]
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_sweep_worker, initargs=(events,)) as executor:
+        return list(executor.map(run_sweep_task, parameters_list))
+
+
+def parse_floats(value):
+    return [float(x) for x in value.split(',')] if value else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='기록된 조건식/체결가 이벤트로 매수/매도 규칙 backtest')
+    parser.add_argument('--events', help='timestamp,event,stock_code,price,condition_name csv')
+    parser.add_argument('--recordings', nargs='+', help='TickRecorder 기록 파일, --events 와 둘 다 없으면 모의 이벤트 생성')
+    parser.add_argument('--symbols', type=int, default=300)
+    parser.add_argument('--seconds', type=float, default=6.5 * 3600)
+    parser.add_argument('--ticks-per-second', type=float, default=100)
+    parser.add_argument('--condition-hit-rate', type=float, default=0.001)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profit-limits', help='쉼표로 구분한 수익상한(%%) 목록, 없으면 Settings.ini 값')
+    parser.add_argument('--loss-limits', help='쉼표로 구분한 손실하한(%%) 목록(양수로 입력), 없으면 Settings.ini 값')
+    parser.add_argument('--buy-prices', help='쉼표로 구분한 매수금액 목록, 없으면 Settings.ini 값')
+    parser.add_argument('--trailing-stops', help='쉼표로 구분한 추적손절(%%) 목록, 0 은 사용하지 않음, 없으면 Settings.ini 값')
+    parser.add_argument('--time-stops', help='쉼표로 구분한 보유시간(초) 목록, 0 은 사용하지 않음, 없으면 Settings.ini 값')
+    parser.add_argument('--fill-delay', type=float, default=0.0)
+    parser.add_argument('--fee-rate', type=float, default=0.0)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--trades-csv', help='파라미터가 하나일 때 거래 내역을 저장할 csv')
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    if args.events:
+        backtest_events = BacktestEvents.read_csv(args.events)
+    elif args.recordings:
+        backtest_events = BacktestEvents.read_recordings(args.recordings)
+    else:
+        backtest_events = generate_events(symbols=args.symbols, seconds=args.seconds,
+                                          ticks_per_second=args.ticks_per_second,
+                                          condition_hit_rate=args.condition_hit_rate, seed=args.seed)
+    debugger.info('이벤트 {}개 준비 {:.2f}초', len(backtest_events), time.perf_counter() - started_at)
+
+    profit_limits = parse_floats(args.profit_limits) or [PROFIT_LIMIT]
+    loss_limits = [-abs(x) for x in parse_floats(args.loss_limits) or [LOSS_LIMIT]]
+    grid = parameter_grid(profit_limits, loss_limits, parse_floats(args.buy_prices),
+                          parse_floats(args.trailing_stops), parse_floats(args.time_stops),
+                          fill_delay=args.fill_delay, fee_rate=args.fee_rate)
+    if any(has_stateful_exit_rules(parameters) for parameters in grid):
+        debugger.info('추적손절/보유시간/분할익절 청산 규칙을 실매매와 같이 ExitRuleEngine 으로 적용합니다')
+
+    started_at = time.perf_counter()
+    if len(grid) == 1:
+        result = run_backtest(backtest_events, grid[0])
+        summaries = [result.summary()]
+        if args.trades_csv:
+            result.write_trades_csv(args.trades_csv)
+    else:
+        summaries = run_sweep(backtest_events, grid, processes=args.processes or os.cpu_count())
+    elapsed = time.perf_counter() - started_at
+
+    debugger.info('backtest {}개 조합, {:.2f}초 ({:.0f} events/sec)', len(grid), elapsed,
+                  len(backtest_events) * len(grid) / elapsed)
+    for summary in sorted(summaries, key=lambda x: x['total_pnl'], reverse=True):
+        debugger.info('수익상한 {0[profit_limit]}% 손실하한 {0[loss_limit]}% 매수금액 {0[buy_price]:.0f} '
+                      '추적손절 {0[trailing_stop_percent]}% 보유시간 {0[time_stop_seconds]}초 : '
+                      '매수 {0[buy_count]}회, 매도 {0[trade_count]}회, 승률 {0[win_rate]:.1%}, '
+                      '실현손익 {0[realized_pnl]:.0f}, 평가손익 {0[unrealized_pnl]:.0f}, 최대낙폭 {0[max_drawdown]:.0f}',
+                      summary)
@@ -0,0 +1,446 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from KiwoomConditionTrader.command_scheduler import PriorityCommandQueue
+from KiwoomConditionTrader.database_connection import StockDatabase
+from KiwoomConditionTrader.exit_rules import BandExit, ExitRuleEngine, TieredTakeProfit, TimeStop, TrailingStop
+from KiwoomConditionTrader.metrics import metrics
+from KiwoomConditionTrader.position_book import Position
+from KiwoomConditionTrader.settings import *
+from KiwoomConditionTrader.simulated_exchange import SimulatedExchange
+from KiwoomConditionTrader.trade_ledger import export_ledger
+from KiwoomConditionTrader.trader_threads import COMMAND_CLASSES, COMMAND_CLASS_ORDER, Commands, CommunicateThread, \
+    ExitEvaluator, HeadlessConditionTrader, calculate_earning_rate, create_command_client, is_out_of_limits
+from Util.debugger import *
+
+# 결과 하나는 {이름: dict(value=값, unit=단위, better='higher' 또는 'lower', slack=허용 오차)} 로 저장
+# 비교할 때 baseline 보다 tolerance 비율 + slack 이상 나빠지면 regression
+HIGHER = 'higher'
+LOWER = 'lower'
+
+# --verbose 가 아니면 로그 레벨을 WARNING 으로 올리는 컴포넌트
+QUIET_COMPONENTS = ('buy', 'sell', 'command', 'condition', 'metrics')
+
+
+def result(value, unit, better, slack=0):
+    return dict(value=value, unit=unit, better=better, slack=slack)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def bench_command_dispatch(commands=20000):
+    """
+    CommunicateThread.serve_commands 가 초당 처리하는 명령 수
+    요청 제한(TokenBucket) 없이 GET_REAL_CURRENT_PRICE 를 한꺼번에 넣고 모두 끝날 때까지 걸린 시간으로 계산
+    """
+    exchange = SimulatedExchange(seed=0)
+    exchange.register_real_current_price(exchange.stock_codes, '5000')
+    command_q = PriorityCommandQueue(COMMAND_CLASSES, COMMAND_CLASS_ORDER)
+    command_client = create_command_client(command_q)
+    communicate_thread = CommunicateThread(command_q, exchange, debugger.getChild('command'))
+    communicate_thread.start()
+
+    started_at = time.perf_counter()
+    futures = [command_client.request(Commands.GET_REAL_CURRENT_PRICE,
+                                      stock_code=exchange.stock_codes[i % len(exchange.stock_codes)])
+               for i in range(commands)]
+    command_client.wait_all(futures)
+    elapsed = time.perf_counter() - started_at
+    communicate_thread.stop()
+
+    return dict(command_dispatch_per_second=result(commands / elapsed, 'commands/s', HIGHER))
+
+
+def bench_database(rows=5000):
+    """StockDatabase 의 매수 저장, 매도주문번호 저장, 삭제 초당 처리 수와 장부 전체 읽기 시간"""
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = StockDatabase(os.path.join(tmp_dir, 'benchmark.db'))
+        order_numbers = ['{:07d}'.format(x) for x in range(rows)]
+
+        def measure(name, write):
+            started_at = time.perf_counter()
+            for order_number in order_numbers:
+                write(order_number)
+            database.flush()
+            results[name] = result(rows / (time.perf_counter() - started_at), 'rows/s', HIGHER)
+
+        measure('database_insert_per_second',
+                lambda x: database.add_stock_order_history(x, '005930', 10, 70000.0, '조건식'))
+        measure('database_update_per_second',
+                lambda x: database.add_sell_order_history(x, 'S' + x))
+
+        started_at = time.perf_counter()
+        loaded = database.get_all_stock_order_history()
+        results['database_load_seconds'] = result(time.perf_counter() - started_at, 's', LOWER, slack=0.001)
+        if len(loaded) != rows:
+            raise RuntimeError('장부에서 {}건을 읽어야 하는데 {}건을 읽었습니다'.format(rows, len(loaded)))
+
+        measure('database_delete_per_second',
+                lambda x: database.remove_stock_order_history('S' + x))
+        database.close()
+    return results
+
+
+def bench_ledger(days=120, trades_per_day=2000):
+    """
+    days 거래일, 하루 trades_per_day 건의 closed_trades 에서 일별 손익/종목별 조회 시간과 csv 내보내기 초당 처리 수
+    ledger 는 add_closed_trade 로 미리 채움 (약 4개월, 24만 건)
+    """
+    results = dict()
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = StockDatabase(os.path.join(tmp_dir, 'benchmark.db'))
+        start = datetime.datetime(2024, 1, 2, 10).timestamp()
+        stock_codes = ['{:06d}'.format(x) for x in range(500)]
+        for day in range(days):
+            sold_at = start + day * 86400
+            for i in range(trades_per_day):
+                entry_price = rng.uniform(5000, 50000)
+                database.add_closed_trade('{:07d}'.format(i), 'B{:07d}'.format(i), rng.choice(stock_codes),
+                                          '조건식{}'.format(i % 3), 10, entry_price,
+                                          entry_price * rng.uniform(0.99, 1.01), sold_at - 60, sold_at)
+        database.flush()
+        trade_count = days * trades_per_day
+
+        started_at = time.perf_counter()
+        daily_pnl = database.get_daily_pnl(by_condition=True)
+        results['ledger_daily_pnl_seconds'] = result(time.perf_counter() - started_at, 's', LOWER, slack=0.01)
+        reported_count = sum(row[2] for row in daily_pnl)
+        if reported_count != trade_count:
+            raise RuntimeError('일별 손익에 {}건이 집계되어야 하는데 {}건이 집계되었습니다'.format(trade_count, reported_count))
+
+        started_at = time.perf_counter()
+        database.get_closed_trades_by_stock_code(stock_codes[0])
+        results['ledger_symbol_query_seconds'] = result(time.perf_counter() - started_at, 's', LOWER, slack=0.01)
+
+        started_at = time.perf_counter()
+        exported = export_ledger(database, os.path.join(tmp_dir, 'ledger.csv'))
+        results['ledger_export_rows_per_second'] = result(exported / (time.perf_counter() - started_at), 'rows/s',
+                                                          HIGHER)
+        database.close()
+    return results
+
+
+def bench_exit_evaluation(position_counts=(100, 1000, 10000), repeat=200):
+    """
+    보유 주문 수별로 현재가 스냅샷 하나의 손익률 비교에 걸리는 시간(마이크로초)
+    numpy 가 있으면 ExitEvaluator.evaluate, 없으면 KiwoomCheckRealCurrentPrice 와 같이 주문마다 is_out_of_limits 로 비교
+    """
+    results = dict()
+    rng = random.Random(0)
+    for position_count in position_counts:
+        stock_codes = ['{:06d}'.format(x) for x in range(min(position_count, 2000))]
+        positions = [('{:07d}'.format(i), stock_codes[i % len(stock_codes)], rng.uniform(5000, 50000))
+                     for i in range(position_count)]
+        # 모두 손익률 범위 안의 현재가라서 매도 대상 없이 전체를 계산함
+        current_prices = {stock_code: 0 for stock_code in stock_codes}
+        for _, stock_code, price in positions:
+            current_prices[stock_code] = price
+        profit_limit, loss_limit = get_exit_limits()
+
+        if ExitEvaluator is not None:
+            exit_evaluator = ExitEvaluator(get_exit_limits)
+            for buy_order_number, stock_code, price in positions:
+                exit_evaluator.add(buy_order_number, stock_code, price, 10, profit_limit, loss_limit)
+
+            def evaluate():
+                exit_evaluator.evaluate(current_prices)
+        else:
+            def evaluate():
+                for _, stock_code, price in positions:
+                    is_out_of_limits(calculate_earning_rate(current_prices[stock_code], price),
+                                     profit_limit, loss_limit)
+
+        evaluate()
+        started_at = time.perf_counter()
+        for _ in range(repeat):
+            evaluate()
+        elapsed = (time.perf_counter() - started_at) / repeat
+        results['exit_evaluation_{}_positions_us'.format(position_count)] = result(elapsed * 1e6, 'us', LOWER,
+                                                                                   slack=5)
+    return results
+
+
+def bench_exit_rules(position_counts=(100, 1000, 10000), ticks=100000):
+    """
+    보유 주문 수별로 ExitRuleEngine 이 초당 처리하는 체결가 이벤트 수
+    밴드, 추적손절, 보유시간, 분할익절 규칙을 모두 적용하고, 체결가는 종목 2000개에 고르게 들어옴
+    """
+    results = dict()
+    rng = random.Random(0)
+    for position_count in position_counts:
+        stock_codes = ['{:06d}'.format(x) for x in range(min(position_count, 2000))]
+        exit_rule_engine = ExitRuleEngine(lambda condition_name: [
+            BandExit(PROFIT_LIMIT, LOSS_LIMIT, take_profit=False), TrailingStop(1, 0.5), TimeStop(3600),
+            TieredTakeProfit([(1, 0.5), (2, 0.5)])])
+        now = time.time()
+        for i in range(position_count):
+            exit_rule_engine.position_added(Position('{:07d}'.format(i), stock_codes[i % len(stock_codes)], 10,
+                                                     rng.uniform(5000, 50000), bought_at=now))
+        # 매수가 부근의 현재가라서 매도 대상 없이 모든 규칙을 비교함
+        prices = {stock_code: state_list[0].entry_price
+                  for stock_code, state_list in exit_rule_engine.states_by_stock_code.items()}
+        events = [(stock_code, prices[stock_code]) for stock_code in stock_codes]
+
+        started_at = time.perf_counter()
+        for i in range(ticks):
+            stock_code, current_price = events[i % len(events)]
+            exit_rule_engine.on_price(stock_code, current_price, now)
+        elapsed = time.perf_counter() - started_at
+        results['exit_rules_{}_positions_ticks_per_second'.format(position_count)] = result(ticks / elapsed,
+                                                                                           'ticks/s', HIGHER)
+    return results
+
+
+class LatencyRecordingExchange(SimulatedExchange):
+    """매수 주문이 broker 에 도착한 시각을 종목별로 기록하는 모의 거래소"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.ordered_at = dict()
+
+    def buy_stock(self, account_num, stock_code, qty, trade_type):
+        self.ordered_at.setdefault(stock_code, time.monotonic())
+        return super().buy_stock(account_num, stock_code, qty, trade_type)
+
+
+def bench_signal_to_order(signals=40, interval=0.25):
+    """
+    조건식 편입 이벤트부터 매수 주문이 broker 에 도착할 때까지 걸린 시간, 모의 거래소로 매수/매도 스레드 전체를 실행
+    interval 은 편입 이벤트 간격(초)으로, 주문/TR 요청 제한에 걸리지 않도록 초당 요청 제한보다 느리게 보냄
+    매도 주문이 매수 주문의 요청 제한을 함께 쓰지 않도록 현재가는 움직이지 않게 함
+    """
+    exchange = LatencyRecordingExchange(stock_codes=['{:06d}'.format(x) for x in range(1, signals + 1)],
+                                        seed=0, ticks_per_second=1000, condition_hit_rate=0, volatility=0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        trader = HeadlessConditionTrader(exchange, StockDatabase(os.path.join(tmp_dir, 'benchmark.db')), debugger,
+                                         metrics_export_path=None)
+        exchange.start()
+        trader.start()
+        # 시작할 때의 조건식 조회, 장부 확인이 끝난 뒤부터 측정
+        time.sleep(1)
+
+        signaled_at = dict()
+        for stock_code in exchange.stock_codes:
+            signaled_at[stock_code] = time.monotonic()
+            for listener in exchange.condition_listeners:
+                listener(stock_code, 'I', CONDITION_LIST[0])
+            time.sleep(interval)
+        time.sleep(1)
+
+        trader.stop()
+        exchange.stop()
+        trader.database.close()
+
+    latencies = [exchange.ordered_at[stock_code] - signaled_at[stock_code]
+                 for stock_code in signaled_at if stock_code in exchange.ordered_at]
+    return dict(signal_to_order_p50_ms=result(percentile(latencies, 0.5) * 1000, 'ms', LOWER, slack=1),
+                signal_to_order_p99_ms=result(percentile(latencies, 0.99) * 1000, 'ms', LOWER, slack=2),
+                signal_to_order_missed=result(signals - len(latencies), 'signals', LOWER))
+
+
+BENCHMARKS = {
+    'dispatch': bench_command_dispatch,
+    'database': bench_database,
+    'exit': bench_exit_evaluation,
+    'exit_rules': bench_exit_rules,
+    'ledger': bench_ledger,
+    'latency': bench_signal_to_order,
+}
+
+
+class SoakSampler(threading.Thread):
+    """
+    sample_seconds 마다 tracemalloc 메모리, 스레드 수, 큐 길이, 추적 중인 주문 수를 기록
+    처음 warmup_seconds 는 cache/histogram 이 채워지는 구간이라 증가량 계산에서 뺌
+    """
+
+    def __init__(self, trader, sample_seconds=10, warmup_seconds=60):
+        super().__init__(daemon=True)
+        self.trader = trader
+        self.sample_seconds = sample_seconds
+        self.warmup_seconds = warmup_seconds
+
+        self.stopped = threading.Event()
+        self.samples = list()
+        self.warmup_snapshot = None
+        self.started_at = None
+
+    def stop(self):
+        self.stopped.set()
+
+    def sample(self):
+        current, _ = tracemalloc.get_traced_memory()
+        self.samples.append(dict(elapsed=time.monotonic() - self.started_at,
+                                 memory=current,
+                                 threads=threading.active_count(),
+                                 command_q=self.trader.command_q.qsize(),
+                                 condition_hits=self.trader.condition_tracker.hit_q.qsize(),
+                                 tracked_orders=len(self.trader.order_tracker.orders),
+                                 positions=len(self.trader.position_book)))
+
+    def run(self):
+        self.started_at = time.monotonic()
+        while not self.stopped.wait(self.sample_seconds):
+            if self.warmup_snapshot is None and time.monotonic() - self.started_at >= self.warmup_seconds:
+                self.warmup_snapshot = tracemalloc.take_snapshot()
+            self.sample()
+        self.sample()
+
+    def measured_samples(self):
+        samples = [sample for sample in self.samples if sample['elapsed'] >= self.warmup_seconds]
+        return samples or self.samples[-1:]
+
+
+def memory_slope(samples):
+    """warmup 이후 메모리의 최소제곱 기울기(bytes/hour)"""
+    if len(samples) < 2:
+        return 0.0
+    xs = [sample['elapsed'] for sample in samples]
+    ys = [sample['memory'] for sample in samples]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+    denominator = sum((x - x_mean) ** 2 for x in xs)
+    if not denominator:
+        return 0.0
+    return sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys)) / denominator * 3600
+
+
+def run_soak(seconds, sample_seconds=10, warmup_seconds=60, ticks_per_second=2000, condition_hit_rate=0.0005,
+             symbols=300, seed=0):
+    """
+    모의 거래소로 seconds 동안 매매 파이프라인 전체를 돌리면서 메모리, 스레드, 큐가 계속 늘어나는지 확인
+    끝나면 warmup 이후 메모리가 가장 많이 늘어난 곳(tracemalloc)을 debugger 에 남김
+    """
+    tracemalloc.start()
+    exchange = SimulatedExchange(stock_codes=['{:06d}'.format(x) for x in range(1, symbols + 1)], seed=seed,
+                                 ticks_per_second=ticks_per_second, condition_hit_rate=condition_hit_rate)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        trader = HeadlessConditionTrader(exchange, StockDatabase(os.path.join(tmp_dir, 'soak.db')), debugger,
+                                         metrics_export_path=None)
+        sampler = SoakSampler(trader, sample_seconds=sample_seconds, warmup_seconds=min(warmup_seconds, seconds / 2))
+        exchange.start()
+        trader.start()
+        sampler.start()
+        time.sleep(seconds)
+        sampler.stop()
+        sampler.join()
+        trader.stop()
+        exchange.stop()
+        trader.database.close()
+
+    if sampler.warmup_snapshot is not None:
+        top_stats = tracemalloc.take_snapshot().compare_to(sampler.warmup_snapshot, 'lineno')
+        for stat in top_stats[:10]:
+            debugger.warning('soak 메모리 증가 : {}', stat)
+    tracemalloc.stop()
+
+    samples = sampler.measured_samples()
+    first, last = samples[0], samples[-1]
+    return dict(soak_memory_growth_bytes=result(last['memory'] - first['memory'], 'bytes', LOWER, slack=1024 * 1024),
+                soak_memory_slope_bytes_per_hour=result(memory_slope(samples), 'bytes/h', LOWER, slack=1024 * 1024),
+                soak_thread_growth=result(max(sample['threads'] for sample in samples) - first['threads'],
+                                          'threads', LOWER),
+                soak_command_q_max=result(max(sample['command_q'] for sample in samples), 'commands', LOWER,
+                                          slack=10),
+                soak_condition_hits_max=result(max(sample['condition_hits'] for sample in samples), 'hits', LOWER,
+                                               slack=10),
+                soak_tracked_orders_growth=result(last['tracked_orders'] - first['tracked_orders'], 'orders', LOWER,
+                                                  slack=50),
+                soak_ticks=result(exchange.tick_count, 'ticks', HIGHER))
+
+
+def compare_results(baseline, results, tolerance=0.2):
+    """baseline 에 있는 결과 중 tolerance 비율 + slack 이상 나빠진 결과를 (이름, baseline 값, 이번 값) 리스트로 돌려줌"""
+    regressions = list()
+    for name, current in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        slack = base.get('slack', 0)
+        if base['better'] == HIGHER:
+            regressed = current['value'] < base['value'] * (1 - tolerance) - slack
+        else:
+            regressed = current['value'] > base['value'] * (1 + tolerance) + slack
+        if regressed:
+            regressions.append((name, base['value'], current['value']))
+    return regressions
+
+
+def save_results(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(dict(created_at=datetime.datetime.now().isoformat(timespec='seconds'),
+                       python=platform.python_version(),
+                       machine=platform.platform(),
+                       cpu_count=os.cpu_count(),
+                       results=results), f, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='매매 파이프라인 benchmark 와 장시간 soak test, 결과를 baseline 과 비교')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    bench_parser = subparsers.add_parser('bench', help='명령 처리량, DB, 손익률 비교, 편입부터 주문까지 지연시간 측정')
+    bench_parser.add_argument('--only', help='쉼표로 구분한 benchmark 이름 ({})'.format(', '.join(BENCHMARKS)))
+    soak_parser = subparsers.add_parser('soak', help='모의 거래소로 장시간 실행하면서 메모리/스레드/큐 증가 확인')
+    soak_parser.add_argument('--hours', type=float, default=2)
+    soak_parser.add_argument('--seconds', type=float, help='주면 --hours 대신 사용')
+    soak_parser.add_argument('--sample-seconds', type=float, default=10)
+    soak_parser.add_argument('--warmup-seconds', type=float, default=60)
+    soak_parser.add_argument('--ticks-per-second', type=int, default=2000)
+    soak_parser.add_argument('--condition-hit-rate', type=float, default=0.0005)
+    for subparser in (bench_parser, soak_parser):
+        subparser.add_argument('--save', help='결과를 저장할 baseline json')
+        subparser.add_argument('--compare', help='비교할 baseline json, regression 이 있으면 exit code 1 '
+                                                    '(bench 기준 : KiwoomConditionTrader/benchmark_baseline.json)')
+        subparser.add_argument('--tolerance', type=float, default=0.2, help='허용할 성능 저하 비율')
+        subparser.add_argument('--verbose', action='store_true', help='매수/매도 로그도 남김')
+    args = parser.parse_args()
+
+    # 매수/매도 로그를 남기는 시간이 측정에 섞이지 않도록 기본은 컴포넌트 로그를 WARNING 이상만 남김
+    levels = dict(LOG_LEVELS) if args.verbose else dict.fromkeys(QUIET_COMPONENTS, 'WARNING')
+    configure_debugger(json_log=LOG_JSON, levels=levels)
+    metrics.reset()
+
+    if args.mode == 'bench':
+        names = [x.strip() for x in args.only.split(',')] if args.only else list(BENCHMARKS)
+        benchmark_results = dict()
+        for name in names:
+            benchmark_results.update(BENCHMARKS[name]())
+    else:
+        benchmark_results = run_soak(args.seconds if args.seconds is not None else args.hours * 3600,
+                                     sample_seconds=args.sample_seconds,
+                                     warmup_seconds=args.warmup_seconds,
+                                     ticks_per_second=args.ticks_per_second,
+                                     condition_hit_rate=args.condition_hit_rate)
+
+    for name, value in sorted(benchmark_results.items()):
+        debugger.info('{:45s} {:>14.2f} {}', name, value['value'], value['unit'])
+
+    if args.save:
+        save_results(args.save, benchmark_results)
+
+    if args.compare:
+        regressions = compare_results(load_results(args.compare), benchmark_results, args.tolerance)
+        for name, base_value, value in regressions:
+            debugger.error('{} : baseline {:.2f} 에서 {:.2f} 로 나빠졌습니다', name, base_value, value)
+        if regressions:
+            raise SystemExit(1)
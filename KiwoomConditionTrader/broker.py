@@ -0,0 +1,102 @@
+# 여러 종목 현재가 조회(관심종목정보요청, OPTKWFID) 한번에 조회할 수 있는 최대 종목 수
+CURRENT_PRICES_PER_REQUEST = 100
+# 화면번호 하나에 실시간 등록할 수 있는 최대 종목 수
+REAL_STOCK_CODES_PER_SCREEN = 100
+
+
+class Broker(object):
+    """
+    CommunicateThread 가 Commands 를 처리할 때 사용하는 증권사 인터페이스
+    실거래는 KiwoomBroker(키움 OCX), 헤드리스 부하 테스트는 SimulatedExchange 가 구현함
+    """
+
+    @property
+    def is_connected(self):
+        raise NotImplementedError
+
+    def register_conditions(self, condition_list):
+        raise NotImplementedError
+
+    def register_real_current_price(self, stock_code_list, screen_number):
+        """screen_number 화면에 stock_code_list 종목을 실시간 현재가 등록에 추가함, 이미 등록된 종목은 유지"""
+        raise NotImplementedError
+
+    def unregister_real_current_price(self, stock_code_list, screen_number):
+        """screen_number 화면에서 stock_code_list 종목의 실시간 현재가 등록을 해지함"""
+        raise NotImplementedError
+
+    def add_real_price_listener(self, listener):
+        """
+        실시간 현재가 등록된 종목의 체결가 이벤트마다 listener(stock_code, current_price) 호출
+        listener 는 이벤트 스레드에서 불리므로 블로킹하면 안됨
+        """
+        raise NotImplementedError
+
+    def add_chejan_listener(self, listener):
+        """
+        주문 체결 이벤트마다 listener(order_number, stock_code, amount, filled, filled_price) 호출
+        filled 는 누적 체결량, filled_price 는 이번 체결의 체결가, listener 는 블로킹하면 안됨
+        """
+        raise NotImplementedError
+
+    def add_condition_listener(self, listener):
+        """
+        조건식 편입/이탈 이벤트마다 listener(stock_code, event_type, condition_name) 호출
+        event_type 은 키움 OnReceiveRealCondition 과 같이 편입 'I', 이탈 'D', listener 는 블로킹하면 안됨
+        """
+        raise NotImplementedError
+
+    def get_conditions(self, condition_list=None):
+        """
+        등록한 조건식에 편입되어 있는 종목코드 list
+        condition_list 를 주면 그 조건식들에 편입된 종목만 돌려줌 (게이트웨이가 샤드별 조건식의 종목을 나눌 때 사용)
+        """
+        raise NotImplementedError
+
+    def get_current_price(self, stock_code):
+        raise NotImplementedError
+
+    def get_current_prices(self, stock_code_list):
+        """
+        여러 종목의 현재가를 {종목코드: 현재가} 로 한번에 돌려줌, 중복 종목코드는 한번만 조회
+        CURRENT_PRICES_PER_REQUEST 종목마다 TR 한번으로 조회하는 것을 기준으로 요청 제한을 계산하므로 가능하면 재정의함
+        기본 구현은 종목마다 get_current_price 를 부르고, 현재가를 받지 못한 종목은 결과에 포함하지 않음
+        """
+        current_prices = dict()
+        for stock_code in dict.fromkeys(stock_code_list):
+            current_price = self.get_current_price(stock_code)
+            if current_price:
+                current_prices[stock_code] = current_price
+        return current_prices
+
+    def get_real_current_price(self, stock_code):
+        raise NotImplementedError
+
+    def get_real_current_prices(self, stock_code_list):
+        """
+        여러 종목의 실시간 현재가를 {종목코드: 현재가} 로 한번에 돌려줌, 중복 종목코드는 한번만 조회
+        현재가를 받지 못한 종목은 결과에 포함하지 않음
+        """
+        current_prices = dict()
+        for stock_code in dict.fromkeys(stock_code_list):
+            current_price = self.get_real_current_price(stock_code)
+            if current_price:
+                current_prices[stock_code] = current_price
+        return current_prices
+
+    def get_order_history(self, order_number):
+        raise NotImplementedError
+
+    def get_open_orders(self, account_num):
+        """account_num 계좌의 아직 전량 체결되지 않은 주문번호 list, 재시작할 때 DB 에 남은 주문과 맞추는 데 사용"""
+        raise NotImplementedError
+
+    def get_holdings(self, account_num):
+        """account_num 계좌의 {종목코드: 보유수량}, 보유수량이 0 인 종목은 포함하지 않음"""
+        raise NotImplementedError
+
+    def buy_stock(self, account_num, stock_code, qty, trade_type):
+        raise NotImplementedError
+
+    def sell_stock(self, account_num, stock_code, qty, trade_type):
+        raise NotImplementedError
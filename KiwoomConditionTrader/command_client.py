@@ -0,0 +1,141 @@
+import asyncio
+import itertools
+import threading
+import time
+
+from concurrent.futures import Future, TimeoutError, as_completed, wait
+
+
+class CommandClient(object):
+    """
+    command_q 에 (Future, data) 를 넣고 Future 로 결과를 돌려받는 요청 API
+    1. 요청마다 request_id(correlation id) 를 data 에 붙이고, 끝나지 않은 요청은 pending 에서 id 로 찾아 취소할 수 있음
+    2. 명령별 timeout(timeouts) 이 지나면 data['deadline'] 을 보고 Communicate Thread 가 처리하지 않고 TimeoutError 로 끝냄
+    3. request() 는 바로 Future 를 돌려주므로 여러 요청을 한꺼번에 보내고 wait_all() 로 함께 기다릴 수 있음
+    """
+
+    def __init__(self, command_q, timeouts=None, default_timeout=20):
+        self.command_q = command_q
+        self.timeouts = timeouts or dict()
+        self.default_timeout = default_timeout
+
+        self.request_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.pending = dict()
+
+    def timeout_for(self, command, timeout=None):
+        if timeout is not None:
+            return timeout
+        return self.timeouts.get(command, self.default_timeout)
+
+    def request(self, command, timeout=None, **kwargs):
+        timeout = self.timeout_for(command, timeout)
+        request_id = next(self.request_ids)
+
+        requested_at = time.monotonic()
+        future = Future()
+        future.request_id = request_id
+        future.timeout = timeout
+        future.deadline = requested_at + timeout if timeout is not None else None
+        data = dict(kwargs,
+                    command=command,
+                    request_id=request_id,
+                    requested_at=requested_at,
+                    deadline=future.deadline)
+
+        with self.lock:
+            self.pending[request_id] = future
+        future.add_done_callback(self.forget)
+        self.command_q.put((future, data))
+        return future
+
+    def forget(self, future):
+        with self.lock:
+            self.pending.pop(future.request_id, None)
+
+    def call(self, command, timeout=None, default=None, **kwargs):
+        """요청을 보내고 결과를 기다림, 시간 초과나 에러면 default 를 돌려줌"""
+        future = self.request(command, timeout=timeout, **kwargs)
+        return self.result(future, default)
+
+    def remaining(self, future):
+        if future.deadline is None:
+            return None
+        return max(0, future.deadline - time.monotonic())
+
+    def result(self, future, default=None):
+        try:
+            return future.result(self.remaining(future))
+        except TimeoutError:
+            future.cancel()
+            return default
+        except Exception:
+            return default
+
+    def wait_all(self, futures, default=None):
+        """여러 요청을 함께 기다린 뒤 요청 순서대로 결과 리스트를 돌려줌"""
+        futures = list(futures)
+        if not futures:
+            return list()
+        deadlines = [future.deadline for future in futures]
+        wait(futures, timeout=None if None in deadlines else max(0, max(deadlines) - time.monotonic()))
+        return [self.result(future, default) if future.done() else self.cancel_result(future, default)
+                for future in futures]
+
+    def iter_completed(self, futures, default=None):
+        """여러 요청을 끝나는 순서대로 (future, 결과) 로 돌려줌, 마지막 deadline 까지 끝나지 않은 요청은 취소하고 default"""
+        futures = list(futures)
+        if not futures:
+            return
+        deadlines = [future.deadline for future in futures]
+        timeout = None if None in deadlines else max(0, max(deadlines) - time.monotonic())
+        done = set()
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                done.add(future)
+                yield future, self.result(future, default)
+        except TimeoutError:
+            for future in futures:
+                if future not in done:
+                    yield future, self.cancel_result(future, default)
+
+    def cancel_result(self, future, default=None):
+        future.cancel()
+        return default
+
+    def cancel(self, request_id):
+        with self.lock:
+            future = self.pending.get(request_id)
+        return future.cancel() if future is not None else False
+
+    def cancel_all(self):
+        with self.lock:
+            futures = list(self.pending.values())
+        for future in futures:
+            future.cancel()
+
+
+class AsyncCommandClient(object):
+    """
+    CommandClient 의 asyncio 용 facade, 코루틴 안에서 await 로 요청 결과를 기다림
+    시간 초과나 task 취소가 되면 command_q 에 남아있는 요청도 함께 취소되고, task 취소(CancelledError)는 그대로 전파됨
+    """
+
+    def __init__(self, command_client):
+        self.command_client = command_client
+
+    async def request(self, command, timeout=None, **kwargs):
+        future = self.command_client.request(command, timeout=timeout, **kwargs)
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.command_client.remaining(future))
+
+    async def call(self, command, timeout=None, default=None, **kwargs):
+        try:
+            return await self.request(command, timeout=timeout, **kwargs)
+        except asyncio.TimeoutError:
+            return default
+        except Exception:
+            return default
+
+    async def gather(self, *requests):
+        """(command, kwargs) 여러 개를 동시에 요청하고 결과를 순서대로 돌려줌, 실패한 요청은 None"""
+        return await asyncio.gather(*[self.call(command, **kwargs) for command, kwargs in requests])
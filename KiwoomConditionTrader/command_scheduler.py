@@ -0,0 +1,112 @@
+import collections
+import queue
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    초당 rate 개씩 토큰이 채워지고 최대 capacity 개까지 쌓이는 토큰 버킷, 키움 TR/주문 초당 요청 제한에 사용
+    여러 번의 요청을 하나로 묶은 명령은 토큰을 한번에 여러 개 쓰고, 모자라는 만큼은 다음 토큰이 채워질 때까지 기다리게 함
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.clock = clock
+
+        self.tokens = self.capacity
+        self.updated_at = clock()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_consume(self, now=None, tokens=1):
+        self.refill(self.clock() if now is None else now)
+        if self.tokens >= 1:
+            # 토큰이 하나라도 있으면 내보내고, 모자라는 토큰은 음수로 남겨서 이후 요청이 기다리게 함
+            self.tokens -= tokens
+            return True
+        return False
+
+    def wait_time(self, now=None):
+        """토큰 하나가 생길 때까지 남은 시간(초)"""
+        self.refill(self.clock() if now is None else now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class PriorityCommandQueue(object):
+    """
+    command_q 로 쓰는 우선순위 스케줄러, queue.Queue 와 같이 put((callback_queue, data)) / get(block, timeout) 으로 사용
+    1. data['command'] 를 command_classes 로 분류하고, class_order 앞쪽 분류부터 꺼냄 (분류 안에서는 FIFO)
+    2. rate_limits 에 있는 명령은 해당 TokenBucket 에 토큰이 있을 때만 꺼내고,
+       토큰이 없으면 그 동안 다음 분류의 명령을 먼저 처리함
+    3. 여러 종목을 한번에 조회하는 명령은 data['rate_cost'] 개(실제 TR 요청 수)만큼 토큰을 사용
+    """
+
+    def __init__(self, command_classes, class_order, rate_limits=None, buckets=None, default_class=None):
+        self.command_classes = command_classes
+        self.class_order = list(class_order)
+        self.rate_limits = rate_limits or dict()
+        self.buckets = buckets or dict()
+        self.default_class = default_class or self.class_order[-1]
+
+        self.queues = {command_class: collections.deque() for command_class in self.class_order}
+        self.condition = threading.Condition()
+
+    def command_class(self, data):
+        return self.command_classes.get(data['command'], self.default_class)
+
+    def put(self, item, block=True, timeout=None):
+        _, data = item
+        with self.condition:
+            self.queues[self.command_class(data)].append(item)
+            self.condition.notify()
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                wait = None
+                for command_class in self.class_order:
+                    command_queue = self.queues[command_class]
+                    if not command_queue:
+                        continue
+
+                    _, data = command_queue[0]
+                    bucket = self.buckets.get(self.rate_limits.get(data['command']))
+                    if bucket is None or bucket.try_consume(now, data.get('rate_cost', 1)):
+                        return command_queue.popleft()
+
+                    bucket_wait = bucket.wait_time(now)
+                    wait = bucket_wait if wait is None else min(wait, bucket_wait)
+
+                if not block:
+                    raise queue.Empty
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise queue.Empty
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.condition.wait(wait)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        with self.condition:
+            return sum(len(command_queue) for command_queue in self.queues.values())
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def qsize_by_class(self):
+        with self.condition:
+            return {command_class: len(self.queues[command_class]) for command_class in self.class_order}
@@ -0,0 +1,125 @@
+import queue
+import threading
+import time
+
+from KiwoomConditionTrader.metrics import metrics
+
+
+class ConditionHit(object):
+    """조건식에 새로 편입된 종목 하나, received_at 은 편입 이벤트를 받은 시각(time.monotonic)"""
+
+    __slots__ = ('stock_code', 'condition_name', 'received_at')
+
+    def __init__(self, stock_code, condition_name, received_at):
+        self.stock_code = stock_code
+        self.condition_name = condition_name
+        self.received_at = received_at
+
+    def __repr__(self):
+        return 'ConditionHit({!r}, {!r}, {!r})'.format(self.stock_code, self.condition_name, self.received_at)
+
+
+class ConditionTracker(object):
+    """
+    조건식 편입/이탈 이벤트(broker condition listener)로 조건식별 편입 종목 set 을 유지하고, 새 편입 종목을 매수 스레드에 넘김
+    1. 어느 조건식에도 없던 종목이 편입되면 ConditionHit 을 hit_q 에 넣음, 모든 조건식에서 이탈하기 전까지 다시 넣지 않음
+    2. hit_q 는 크기가 정해져 있어서 가득 차면 새 편입은 버리고 편입도 되돌리므로, 다음 sync 나 재편입 때 다시 들어옴
+    3. sync() 는 GET_CONDITIONS 로 받은 종목 중 hit 을 넘기지 않은 종목(등록 시점에 이미 편입된 종목 등)만 추가함
+    """
+
+    def __init__(self, debugger, max_hits=1000, clock=time.monotonic):
+        self.debugger = debugger
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self.hit_q = queue.Queue(maxsize=max_hits)
+        # {조건식이름: 편입 종목 set}, sync 로 들어온 종목은 조건식 이름이 None
+        self.condition_stock_codes = dict()
+        # {종목코드: 편입된 조건식 이름 set}
+        self.stock_conditions = dict()
+        # 편입 후 hit 을 넘긴 종목, 모든 조건식에서 이탈하면 삭제되어 다시 편입되면 다시 매수함
+        self.meet_real_conditions_history = set()
+
+    def on_condition(self, stock_code, event_type, condition_name):
+        """broker condition listener, 키움 이벤트 스레드에서 불리므로 set 갱신과 hit_q 에 넣기만 함"""
+        if event_type == 'I':
+            self.insert(stock_code, condition_name, self.clock())
+        else:
+            self.delete(stock_code, condition_name)
+
+    def insert(self, stock_code, condition_name, received_at):
+        with self.lock:
+            self.condition_stock_codes.setdefault(condition_name, set()).add(stock_code)
+            self.stock_conditions.setdefault(stock_code, set()).add(condition_name)
+            if stock_code in self.meet_real_conditions_history:
+                return
+            self.meet_real_conditions_history.add(stock_code)
+
+        try:
+            self.hit_q.put_nowait(ConditionHit(stock_code, condition_name, received_at))
+        except queue.Full:
+            # 편입 자체를 되돌려야 다음 sync 때 모르는 종목으로 보고 다시 넣음
+            with self.lock:
+                self.meet_real_conditions_history.discard(stock_code)
+                self.condition_stock_codes.get(condition_name, set()).discard(stock_code)
+                conditions = self.stock_conditions.get(stock_code)
+                if conditions is not None:
+                    conditions.discard(condition_name)
+                    if not conditions:
+                        del self.stock_conditions[stock_code]
+            metrics.inc('trader_condition_hits_dropped_total')
+            self.debugger.warning('{} : 조건식 편입 대기열이 가득 차서 편입 이벤트를 버립니다', stock_code)
+
+    def delete(self, stock_code, condition_name):
+        with self.lock:
+            self.condition_stock_codes.get(condition_name, set()).discard(stock_code)
+            conditions = self.stock_conditions.get(stock_code)
+            if conditions is None:
+                return
+            conditions.discard(condition_name)
+            # sync 로 들어온 종목은 어느 조건식인지 모르므로 이탈 이벤트가 오면 함께 삭제
+            if None in conditions:
+                conditions.discard(None)
+                self.condition_stock_codes.get(None, set()).discard(stock_code)
+            if conditions:
+                return
+            del self.stock_conditions[stock_code]
+            self.meet_real_conditions_history.discard(stock_code)
+        self.debugger.info('{} : 해당 종목이 조건식에서 이탈했습니다', stock_code)
+
+    def sync(self, stock_codes):
+        """
+        GET_CONDITIONS 결과 중 아직 hit 을 넘기지 않은 종목을 편입으로 추가, 이탈은 이벤트로만 반영함
+        편입은 되어있지만 hit 을 버린 종목(다른 조건식 편입과 겹쳐서 되돌리지 못한 경우)도 여기서 다시 넘김
+        """
+        now = self.clock()
+        with self.lock:
+            new_stock_codes = [stock_code for stock_code in stock_codes
+                               if stock_code not in self.meet_real_conditions_history]
+        for stock_code in new_stock_codes:
+            self.insert(stock_code, None, now)
+        return new_stock_codes
+
+    def get_hit(self, timeout=None):
+        try:
+            return self.hit_q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_hits_nowait(self, max_hits=None):
+        """지금 쌓여있는 편입 종목을 최대 max_hits 개까지 한번에 꺼냄"""
+        hits = list()
+        while max_hits is None or len(hits) < max_hits:
+            try:
+                hits.append(self.hit_q.get_nowait())
+            except queue.Empty:
+                break
+        return hits
+
+    def is_in_condition(self, stock_code):
+        with self.lock:
+            return stock_code in self.stock_conditions
+
+    def stock_codes(self, condition_name):
+        with self.lock:
+            return set(self.condition_stock_codes.get(condition_name, set()))
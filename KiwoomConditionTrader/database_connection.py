@@ -1,11 +1,45 @@
+import atexit
+import datetime
 import sqlite3
+import threading
+import queue
+import time
+
+from concurrent.futures import Future
+from KiwoomConditionTrader.metrics import metrics
+from Util.debugger import *
+
+
+# closed_trades 를 읽을 때의 column 순서
+CLOSED_TRADE_COLUMNS = ("trade_date, sell_order_number, buy_order_number, stock_code, condition_name, amount, "
+                        "entry_price, exit_price, bought_at, sold_at, realized_pnl")
+
+
+def trade_date_of(timestamp):
+    """time.time() 값의 (로컬 시각) 날짜를 YYYYMMDD 정수로"""
+    return int(datetime.datetime.fromtimestamp(timestamp).strftime('%Y%m%d'))
 
 
 class StockDatabase(object):
-    def __init__(self):
-        self.conn = sqlite3.connect("stock_order_history.db", check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("""
+    """
+    1. 쓰기(INSERT/UPDATE/DELETE)는 큐에 넣기만 하고, 연결을 혼자 가진 writer 스레드가 모아서 한번에 commit 함
+       첫 쓰기 이후 flush_interval 초 안에 들어온 쓰기(최대 max_batch 개)를 한 트랜잭션으로 묶음
+    2. 읽기는 스레드마다 따로 연결을 만들어 사용, WAL 모드라 writer 와 동시에 읽을 수 있음
+    3. 쓰기 메서드는 commit 이 끝나면 완료되는 Future 를 돌려주고, flush() 는 그때까지 큐에 들어온 쓰기를 모두 기다림
+    4. 매도 체결은 장부에서 지워도 closed_trades ledger 에 남아서 종목별/일별 손익을 조회할 수 있음
+    """
+
+    def __init__(self, path="stock_order_history.db", flush_interval=0.05, max_batch=100):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self.local = threading.local()
+        self.write_q = queue.Queue()
+
+        conn = self.connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
         CREATE TABLE IF NOT EXISTS condition_stocks (
         buy_order_number VARCHAR PRIMARY KEY,
         stock_code VARCHAR,
@@ -13,46 +47,298 @@ class StockDatabase(object):
         price FLOAT,
         sell_order_number text)
         """)
+        conn.execute("CREATE INDEX IF NOT EXISTS condition_stocks_sell_order_number "
+                     "ON condition_stocks(sell_order_number)")
+
+        # 조건식별 손익률을 쓰기 위해 추가된 column, 이전 버전 DB 에는 없으므로 추가해 줌
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(condition_stocks)")]
+        if 'condition_name' not in columns:
+            conn.execute("ALTER TABLE condition_stocks ADD COLUMN condition_name text")
+        # 보유시간 청산 규칙에 쓰는 매수 체결 시각(time.time), 이전 버전 DB 의 주문은 NULL
+        if 'bought_at' not in columns:
+            conn.execute("ALTER TABLE condition_stocks ADD COLUMN bought_at REAL")
+        # 매도주문의 주문 수량, 재시작 후 일부 수량만 매도하는 주문을 주문 수량으로 추적하기 위해 저장
+        # 이전 버전 DB 의 매도주문은 NULL 이고 보유 수량 전량을 매도하는 주문으로 봄
+        if 'sell_amount' not in columns:
+            conn.execute("ALTER TABLE condition_stocks ADD COLUMN sell_amount INT")
+        # 매수 체결 수량, 분할익절로 amount 가 줄어도 그대로 두어 재시작 후 분할익절 단계를 이어서 계산함
+        if 'bought_amount' not in columns:
+            conn.execute("ALTER TABLE condition_stocks ADD COLUMN bought_amount INT")
+
+        # 주문번호는 받았지만 아직 전량 체결되지 않은 매수주문, 재시작하면 증권사 주문내역과 맞춰서 복원
+        # 매도주문은 condition_stocks 의 sell_order_number 로 남아있음
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS pending_buy_orders (
+        order_number VARCHAR PRIMARY KEY,
+        stock_code VARCHAR,
+        amount INT,
+        condition_name text)
+        """)
+
+        # 매도 체결된 거래 기록, 장부(condition_stocks)에서 삭제된 뒤에도 남는 append-only ledger
+        # SQLite 에는 partition 이 없으므로 매도 체결일(trade_date, YYYYMMDD)을 index 앞쪽 column 으로 두어 날짜 범위로 나눠 읽음
+        # 키움 주문번호는 날마다 새로 매겨지므로 (trade_date, sell_order_number) 로 같은 체결을 중복 기록하지 않음
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS closed_trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        trade_date INT NOT NULL,
+        sell_order_number VARCHAR NOT NULL,
+        buy_order_number VARCHAR,
+        stock_code VARCHAR,
+        condition_name text,
+        amount INT,
+        entry_price FLOAT,
+        exit_price FLOAT,
+        bought_at REAL,
+        sold_at REAL,
+        realized_pnl FLOAT,
+        UNIQUE(trade_date, sell_order_number))
+        """)
+        # 일별 손익 report 는 이 index 만 읽고 끝남 (covering index)
+        conn.execute("CREATE INDEX IF NOT EXISTS closed_trades_trade_date "
+                     "ON closed_trades(trade_date, condition_name, realized_pnl)")
+        conn.execute("CREATE INDEX IF NOT EXISTS closed_trades_stock_code "
+                     "ON closed_trades(stock_code, trade_date)")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS closed_trades_no_update BEFORE UPDATE ON closed_trades "
+                     "BEGIN SELECT RAISE(ABORT, 'closed_trades is append-only'); END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS closed_trades_no_delete BEFORE DELETE ON closed_trades "
+                     "BEGIN SELECT RAISE(ABORT, 'closed_trades is append-only'); END")
+        conn.commit()
+        conn.close()
+
+        self.writer_thread = threading.Thread(target=self.run_writer, daemon=True)
+        self.writer_thread.start()
+        # 종료할 때 아직 commit 되지 않은 쓰기를 마저 반영
+        atexit.register(self.close)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        # WAL 에서는 NORMAL 로도 commit 된 내용이 깨지지 않고, 매 commit 마다 fsync 하지 않음
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @property
+    def reader(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self.connect()
+        return conn
 
-    def add_stock_order_history(self, buy_order_number, stock_code, amount, price):
-        self.cursor.execute("INSERT INTO condition_stocks(buy_order_number, stock_code, amount, price) VALUES(?,?,?,?)",
-                            (buy_order_number,
-                             stock_code,
-                             amount,
-                             price))
-        self.conn.commit()
+    def write(self, sql, parameters=()):
+        future = Future()
+        self.write_q.put((future, sql, parameters))
+        return future
 
-    def add_sell_order_history(self, buy_order_number, sell_order_number):
-        self.cursor.execute("UPDATE condition_stocks SET sell_order_number=? WHERE buy_order_number=?",
-                            (sell_order_number,
-                             buy_order_number))
-        self.conn.commit()
+    def flush(self, timeout=None):
+        future = Future()
+        self.write_q.put((future, None, None))
+        return future.result(timeout)
+
+    def close(self):
+        if self.writer_thread.is_alive():
+            self.write_q.put(None)
+            self.writer_thread.join()
+
+    def run_writer(self):
+        conn = self.connect()
+        while True:
+            item = self.write_q.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            closing = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.write_q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+                # flush 요청이 들어오면 기다리지 않고 바로 commit
+                if item[1] is None:
+                    break
+
+            self.execute_batch(conn, batch)
+            if closing:
+                break
+        conn.close()
+
+    def execute_batch(self, conn, batch):
+        results = list()
+        for future, sql, parameters in batch:
+            if sql is None:
+                results.append((future, None))
+                continue
+            try:
+                results.append((future, conn.execute(sql, parameters).rowcount))
+            except Exception as e:
+                debugger.exception('DB 쓰기 실패 - {}, error - {}', parameters, e)
+                future.set_exception(e)
+
+        started_at = time.monotonic()
+        try:
+            conn.commit()
+            metrics.observe_since('trader_db_commit_seconds', started_at)
+        except Exception as e:
+            debugger.exception('DB commit 실패, error - {}', e)
+            conn.rollback()
+            for future, _ in results:
+                future.set_exception(e)
+            return
+
+        for future, result in results:
+            future.set_result(result)
+
+    def add_stock_order_history(self, buy_order_number, stock_code, amount, price, condition_name=None,
+                                bought_at=None):
+        return self.write("INSERT INTO condition_stocks(buy_order_number, stock_code, amount, price, condition_name, "
+                          "bought_at, bought_amount) VALUES(?,?,?,?,?,?,?)",
+                          (buy_order_number,
+                           stock_code,
+                           amount,
+                           price,
+                           condition_name,
+                           bought_at,
+                           amount))
+
+    def add_sell_order_history(self, buy_order_number, sell_order_number, sell_amount=None):
+        return self.write("UPDATE condition_stocks SET sell_order_number=?, sell_amount=? WHERE buy_order_number=?",
+                          (sell_order_number,
+                           sell_amount,
+                           buy_order_number))
 
     def remove_stock_order_history(self, sell_order_number):
-        self.cursor.execute("DELETE FROM condition_stocks WHERE sell_order_number=?", (sell_order_number,))
-        self.conn.commit()
+        return self.write("DELETE FROM condition_stocks WHERE sell_order_number=?", (sell_order_number,))
+
+    def remove_stock_order_history_by_buy_order_number(self, buy_order_number):
+        return self.write("DELETE FROM condition_stocks WHERE buy_order_number=?", (buy_order_number,))
+
+    def reopen_stock_order_history(self, buy_order_number, amount):
+        """체결되지 않고 끝난 매도주문을 지우고 남은 수량으로 다시 매도할 수 있게 함"""
+        return self.write("UPDATE condition_stocks SET sell_order_number=NULL, sell_amount=NULL, amount=? "
+                          "WHERE buy_order_number=?",
+                          (amount,
+                           buy_order_number))
+
+    def add_pending_buy_order(self, order_number, stock_code, amount, condition_name=None):
+        return self.write("INSERT OR REPLACE INTO pending_buy_orders(order_number, stock_code, amount, condition_name) "
+                          "VALUES(?,?,?,?)",
+                          (order_number,
+                           stock_code,
+                           amount,
+                           condition_name))
+
+    def remove_pending_buy_order(self, order_number):
+        return self.write("DELETE FROM pending_buy_orders WHERE order_number=?", (order_number,))
+
+    def get_all_pending_buy_orders(self):
+        return self.reader.execute("""
+        SELECT order_number,
+               stock_code,
+               amount,
+               condition_name
+        FROM pending_buy_orders
+             """).fetchall()
+
+    def add_closed_trade(self, sell_order_number, buy_order_number, stock_code, condition_name, amount,
+                         entry_price, exit_price, bought_at, sold_at):
+        """매도 체결 하나를 ledger 에 추가, 일부만 매도한 체결도 매도한 수량만큼 따로 기록"""
+        return self.write("INSERT OR IGNORE INTO closed_trades(trade_date, sell_order_number, buy_order_number, "
+                          "stock_code, condition_name, amount, entry_price, exit_price, bought_at, sold_at, "
+                          "realized_pnl) VALUES(?,?,?,?,?,?,?,?,?,?,?)",
+                          (trade_date_of(sold_at),
+                           sell_order_number,
+                           buy_order_number,
+                           stock_code,
+                           condition_name,
+                           amount,
+                           entry_price,
+                           exit_price,
+                           bought_at,
+                           sold_at,
+                           (exit_price - entry_price) * amount))
+
+    def get_daily_pnl(self, start_date=None, end_date=None, by_condition=False):
+        """
+        trade_date 가 start_date ~ end_date(YYYYMMDD, 포함) 인 거래의 일별 손익
+        return : [(trade_date, 조건식 이름 또는 None, 거래 수, 이익 거래 수, 실현손익)]
+        """
+        condition_column = "condition_name" if by_condition else "NULL"
+        return self.reader.execute("""
+        SELECT trade_date,
+               {0},
+               COUNT(*),
+               SUM(realized_pnl > 0),
+               SUM(realized_pnl)
+        FROM closed_trades
+        WHERE trade_date BETWEEN ? AND ?
+        GROUP BY trade_date, {0}
+        ORDER BY trade_date, {0}
+             """.format(condition_column), (start_date or 0, end_date or 99999999)).fetchall()
+
+    def get_closed_trades_by_stock_code(self, stock_code, start_date=None, end_date=None):
+        return self.reader.execute("""
+        SELECT {}
+        FROM closed_trades
+        WHERE stock_code=? AND trade_date BETWEEN ? AND ?
+        ORDER BY trade_date, id
+             """.format(CLOSED_TRADE_COLUMNS), (stock_code, start_date or 0, end_date or 99999999)).fetchall()
+
+    def iter_closed_trades(self, start_date=None, end_date=None, batch_size=10000):
+        """
+        ledger 를 batch_size 개씩 읽어서 row list 로 돌려주는 generator, 전체를 메모리에 올리지 않고 export 할 때 사용
+        다른 스레드의 읽기와 섞이지 않도록 연결을 따로 만듦
+        """
+        conn = self.connect()
+        try:
+            cursor = conn.execute("""
+            SELECT {}
+            FROM closed_trades
+            WHERE trade_date BETWEEN ? AND ?
+            ORDER BY trade_date, id
+                 """.format(CLOSED_TRADE_COLUMNS), (start_date or 0, end_date or 99999999))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
 
     def get_all_stock_order_history(self):
-        self.cursor.execute("""
+        return self.reader.execute("""
         SELECT buy_order_number,
                stock_code,
                amount,
                price,
-               sell_order_number
+               sell_order_number,
+               condition_name,
+               bought_at,
+               sell_amount,
+               bought_amount
         FROM condition_stocks
-             """)
-        return self.cursor.fetchall()
+             """).fetchall()
 
     def get_stock_order_history(self, buy_order_number):
-        self.cursor.execute("""
-        SELECT 
+        return self.reader.execute("""
+        SELECT
         buy_order_number,
-        stock_code, 
-        amount, 
-        price, 
-        sell_order_number  
-        FROM condition_stocks WHERE buy_order_number=?""", (buy_order_number,))
-        return self.cursor.fetchall()
+        stock_code,
+        amount,
+        price,
+        sell_order_number,
+        condition_name,
+        bought_at,
+        sell_amount,
+        bought_amount
+        FROM condition_stocks WHERE buy_order_number=?""", (buy_order_number,)).fetchall()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,163 @@
+import threading
+
+import numpy as np
+
+
+class ExitEvaluator(object):
+    """
+    보유 주문별 매수가, 수량, 수익상한/손실하한을 연속된 numpy 배열로 들고 있다가
+    현재가 스냅샷 하나로 모든 주문의 손익률과 매도 여부를 한번에 계산
+    1. PositionBook listener 로 등록하면 주문이 추가/변경/삭제될 때마다 배열에 바로 반영됨
+    2. 매도주문 중인 주문(sell_order_number 가 있는 주문)은 active 가 False 가 되어 계산에서 빠짐
+    3. 삭제는 마지막 slot 을 빈 자리로 옮겨서 배열을 항상 앞쪽부터 채워진 상태로 유지
+    4. 종목코드 id 는 그 종목의 주문 수를 세다가 마지막 주문이 삭제되면 반납해서 다음 새 종목이 다시 씀,
+       현재가 배열 크기가 지금까지 보유했던 종목 수가 아니라 동시에 보유했던 최대 종목 수만큼만 커짐
+    """
+
+    def __init__(self, get_exit_limits, capacity=256):
+        self.get_exit_limits = get_exit_limits
+
+        self.lock = threading.Lock()
+        self.size = 0
+        self.buy_order_numbers = list()
+        self.slots = dict()
+        # {종목코드: 종목코드 id}, id 별 종목코드와 주문 수, 반납된 id
+        self.stock_code_ids = dict()
+        self.code_stock_codes = list()
+        self.code_ref_counts = list()
+        self.free_code_ids = list()
+
+        self.code_ids = np.empty(capacity, dtype=np.int32)
+        self.prices = np.empty(capacity, dtype=np.float64)
+        self.amounts = np.empty(capacity, dtype=np.int64)
+        self.profit_limits = np.empty(capacity, dtype=np.float64)
+        self.loss_limits = np.empty(capacity, dtype=np.float64)
+        self.active = np.empty(capacity, dtype=np.bool_)
+
+    def __len__(self):
+        return self.size
+
+    def grow(self):
+        capacity = len(self.prices) * 2
+        for name in ('code_ids', 'prices', 'amounts', 'profit_limits', 'loss_limits', 'active'):
+            array = getattr(self, name)
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            setattr(self, name, grown)
+
+    def acquire_code_id(self, stock_code):
+        code_id = self.stock_code_ids.get(stock_code)
+        if code_id is None:
+            if self.free_code_ids:
+                code_id = self.free_code_ids.pop()
+                self.code_stock_codes[code_id] = stock_code
+            else:
+                code_id = len(self.code_ref_counts)
+                self.code_stock_codes.append(stock_code)
+                self.code_ref_counts.append(0)
+            self.stock_code_ids[stock_code] = code_id
+        self.code_ref_counts[code_id] += 1
+        return code_id
+
+    def release_code_id(self, code_id):
+        self.code_ref_counts[code_id] -= 1
+        if self.code_ref_counts[code_id]:
+            return
+        del self.stock_code_ids[self.code_stock_codes[code_id]]
+        self.code_stock_codes[code_id] = None
+        self.free_code_ids.append(code_id)
+
+    def add(self, buy_order_number, stock_code, price, amount, profit_limit, loss_limit, active=True):
+        with self.lock:
+            if buy_order_number in self.slots:
+                slot = self.slots[buy_order_number]
+                # 같은 종목이면 id 가 반납되지 않도록 먼저 새로 받고 이전 것을 반납
+                previous_code_id = int(self.code_ids[slot])
+                self.code_ids[slot] = self.acquire_code_id(stock_code)
+                self.release_code_id(previous_code_id)
+            else:
+                if self.size == len(self.prices):
+                    self.grow()
+                slot = self.size
+                self.size += 1
+                self.slots[buy_order_number] = slot
+                self.buy_order_numbers.append(buy_order_number)
+                self.code_ids[slot] = self.acquire_code_id(stock_code)
+
+            self.prices[slot] = price
+            self.amounts[slot] = amount
+            self.profit_limits[slot] = profit_limit
+            self.loss_limits[slot] = loss_limit
+            self.active[slot] = active
+
+    def set_active(self, buy_order_number, active):
+        with self.lock:
+            slot = self.slots.get(buy_order_number)
+            if slot is not None:
+                self.active[slot] = active
+
+    def remove(self, buy_order_number):
+        with self.lock:
+            slot = self.slots.pop(buy_order_number, None)
+            if slot is None:
+                return
+            self.release_code_id(int(self.code_ids[slot]))
+
+            last = self.size - 1
+            if slot != last:
+                for array in (self.code_ids, self.prices, self.amounts, self.profit_limits, self.loss_limits,
+                              self.active):
+                    array[slot] = array[last]
+                moved_buy_order_number = self.buy_order_numbers[last]
+                self.buy_order_numbers[slot] = moved_buy_order_number
+                self.slots[moved_buy_order_number] = slot
+            self.buy_order_numbers.pop()
+            self.size = last
+
+    def position_added(self, position):
+        profit_limit, loss_limit = self.get_exit_limits(position.condition_name)
+        self.add(position.buy_order_number, position.stock_code, position.price, position.amount,
+                 profit_limit, loss_limit, active=not position.sell_order_number)
+
+    def position_updated(self, position):
+        # 매도주문이 체결되지 않고 끝나면(PositionBook.reopen) 수량도 바뀌므로 row 전체를 다시 씀
+        self.position_added(position)
+
+    def position_removed(self, position):
+        self.remove(position.buy_order_number)
+
+    def position_prices(self, current_prices):
+        """{종목코드: 현재가} 를 주문 순서의 현재가 배열로 변환, 현재가가 없는 주문은 nan"""
+        code_prices = np.full(len(self.code_ref_counts), np.nan)
+        for stock_code, current_price in current_prices.items():
+            code_id = self.stock_code_ids.get(stock_code)
+            if code_id is not None and current_price:
+                code_prices[code_id] = current_price
+        return code_prices[self.code_ids[:self.size]]
+
+    def evaluate(self, current_prices):
+        """
+        현재가 스냅샷으로 모든 주문의 손익률을 계산하고, 손실하한과 수익상한 사이를 벗어난 주문을 돌려줌
+        return : (매도할 매수주문번호 리스트, 해당 주문들의 손익률 배열)
+        """
+        with self.lock:
+            size = self.size
+            position_prices = self.position_prices(current_prices)
+            prices = self.prices[:size]
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                earning_rates = ((position_prices / prices) - 1) * 100
+
+            evaluable = self.active[:size] & (prices > 0) & ~np.isnan(position_prices)
+            holding = (self.loss_limits[:size] < earning_rates) & (earning_rates < self.profit_limits[:size])
+            sell_slots = np.flatnonzero(evaluable & ~holding)
+
+            return [self.buy_order_numbers[slot] for slot in sell_slots], earning_rates[sell_slots]
+
+    def unrealized_profit(self, current_prices):
+        """현재가 스냅샷 기준 전체 평가손익, 현재가가 없는 주문은 제외"""
+        with self.lock:
+            size = self.size
+            position_prices = self.position_prices(current_prices)
+            profits = (position_prices - self.prices[:size]) * self.amounts[:size]
+            return float(np.nansum(profits))
@@ -0,0 +1,210 @@
+import threading
+import time
+
+
+class ExitState(object):
+    """
+    보유 주문 하나의 청산 규칙 상태, 체결가가 들어올 때마다 O(1) 로 갱신
+    high 는 매수 후 고점, tier 는 다음 분할익절 단계, checks 는 compile 된 규칙 함수 list
+    """
+
+    __slots__ = ('buy_order_number', 'stock_code', 'entry_price', 'entry_time', 'amount', 'original_amount', 'high',
+                 'last_price', 'active', 'tier', 'checks')
+
+    def __init__(self, buy_order_number, stock_code, entry_price, entry_time, amount, original_amount=None):
+        self.buy_order_number = buy_order_number
+        self.stock_code = stock_code
+        self.entry_price = entry_price
+        self.entry_time = entry_time
+        self.amount = amount
+        self.original_amount = original_amount if original_amount is not None else amount
+        self.high = entry_price
+        self.last_price = None
+        self.active = True
+        self.tier = 0
+        self.checks = ()
+
+    def __repr__(self):
+        return 'ExitState({!r}, {!r}, entry={!r}, high={!r}, amount={!r})'.format(
+            self.buy_order_number, self.stock_code, self.entry_price, self.high, self.amount)
+
+
+# 규칙은 compile(state) 로 주문 하나의 기준 가격을 미리 계산한 check(price, now) 함수를 돌려줌
+# check 는 매도할 때만 (매도 사유, 매도 수량) 을 돌려주고, 손익률 계산 없이 가격 비교만 함
+class BandExit(object):
+    """고정 수익상한/손실하한(%), is_out_of_limits 와 같은 기준, take_profit 이 False 면 손실하한만 사용"""
+
+    stateful = False
+
+    def __init__(self, profit_limit, loss_limit, take_profit=True):
+        self.profit_limit = profit_limit
+        self.loss_limit = loss_limit
+        self.take_profit = take_profit
+
+    def compile(self, state):
+        stop_price = state.entry_price * (1 + self.loss_limit / 100)
+        if not self.take_profit:
+            def check(price, now):
+                if price <= stop_price:
+                    return '손실하한 미만', state.amount
+            return check
+
+        take_price = state.entry_price * (1 + self.profit_limit / 100)
+
+        def check(price, now):
+            if price <= stop_price:
+                return '손실하한 미만', state.amount
+            if price >= take_price:
+                return '수익상한 초과', state.amount
+        return check
+
+
+class TrailingStop(object):
+    """고점이 매수가 대비 activation_percent 이상 오른 뒤, 고점 대비 trail_percent 이상 떨어지면 전량 매도"""
+
+    stateful = True
+
+    def __init__(self, trail_percent, activation_percent=0):
+        self.trail_percent = trail_percent
+        self.activation_percent = activation_percent
+
+    def compile(self, state):
+        activation_price = state.entry_price * (1 + self.activation_percent / 100)
+        keep = 1 - self.trail_percent / 100
+        reason = '고점 대비 {}% 하락'.format(self.trail_percent)
+
+        def check(price, now):
+            high = state.high
+            if high >= activation_price and price <= high * keep:
+                return reason, state.amount
+        return check
+
+
+class TimeStop(object):
+    """매수 체결 후 seconds 초가 지나면 전량 매도"""
+
+    stateful = True
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def compile(self, state):
+        deadline = state.entry_time + self.seconds
+        reason = '보유시간 {:.0f}초 초과'.format(self.seconds)
+
+        def check(price, now):
+            if now >= deadline:
+                return reason, state.amount
+        return check
+
+
+class TieredTakeProfit(object):
+    """
+    tiers 는 (수익률(%), 매수 수량 대비 매도 비율) list, 수익률 순서대로 단계마다 해당 비율만큼 나누어 매도
+    마지막 단계는 남은 수량을 모두 매도, 단계는 남은 수량(매도 체결된 수량)으로 정하므로 매도주문이 실패하면 같은 단계를 다시 시도함
+    """
+
+    stateful = True
+
+    def __init__(self, tiers):
+        self.tiers = sorted(tiers)
+
+    def compile(self, state):
+        tier_prices = [state.entry_price * (1 + rate / 100) for rate, _ in self.tiers]
+        # 단계별 누적 매도 수량
+        cumulative_amounts = list()
+        fraction = 0
+        for _, tier_fraction in self.tiers:
+            fraction += tier_fraction
+            cumulative_amounts.append(min(state.original_amount, int(round(state.original_amount * fraction))))
+        last_tier = len(self.tiers) - 1
+
+        def check(price, now):
+            sold = state.original_amount - state.amount
+            tier = state.tier
+            while tier < last_tier and cumulative_amounts[tier] <= sold:
+                tier += 1
+            state.tier = tier
+
+            if price < tier_prices[tier]:
+                return None
+            if tier == last_tier:
+                return '분할익절 {}단계'.format(tier + 1), state.amount
+            return '분할익절 {}단계'.format(tier + 1), cumulative_amounts[tier] - sold
+        return check
+
+
+class ExitRuleEngine(object):
+    """
+    보유 주문마다 청산 규칙을 한번만 compile 해 두고, 체결가가 들어오면 해당 종목의 주문들만 O(1) 로 갱신하고 비교
+    1. PositionBook listener 로 등록하면 주문이 추가/변경/삭제될 때 상태를 만들거나 지움
+       create_rules(condition_name) 는 주문의 조건식에 맞는 규칙 list 를 돌려줌
+    2. 매도주문 중인 주문은 고점만 갱신하고 비교하지 않음
+    3. 매도주문이 일부만 체결되어 수량이 줄어도(PositionBook.reopen) 고점과 분할익절 단계는 유지
+    4. 보유시간은 clock(time.time) 기준이므로 장부의 매수 시각(bought_at)으로 재시작 후에도 이어짐
+       분할익절 단계도 장부의 매수 수량(bought_amount)과 남은 수량으로 계산하므로 재시작 후 이미 매도한 단계를 다시 매도하지 않음
+       고점은 저장하지 않으므로 재시작하면 매수가부터 다시 기록함
+    """
+
+    def __init__(self, create_rules, clock=time.time):
+        self.create_rules = create_rules
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self.states = dict()
+        self.states_by_stock_code = dict()
+
+    def __len__(self):
+        return len(self.states)
+
+    def position_added(self, position):
+        with self.lock:
+            state = self.states.get(position.buy_order_number)
+            if state is None:
+                state = ExitState(position.buy_order_number, position.stock_code, position.price,
+                                  position.bought_at or self.clock(), position.amount, position.bought_amount)
+                # 매수가가 0 이면 손익률을 계산할 수 없으므로 비교하지 않음
+                if position.price > 0:
+                    state.checks = tuple(rule.compile(state) for rule in self.create_rules(position.condition_name))
+                self.states[position.buy_order_number] = state
+                self.states_by_stock_code.setdefault(position.stock_code, list()).append(state)
+            else:
+                state.amount = position.amount
+            state.active = not position.sell_order_number
+
+    def position_updated(self, position):
+        self.position_added(position)
+
+    def position_removed(self, position):
+        with self.lock:
+            state = self.states.pop(position.buy_order_number, None)
+            if state is None:
+                return
+            states = self.states_by_stock_code[state.stock_code]
+            states.remove(state)
+            if not states:
+                del self.states_by_stock_code[state.stock_code]
+
+    def on_price(self, stock_code, current_price, now=None):
+        """
+        stock_code 의 현재가로 해당 종목 주문들의 상태를 갱신하고 매도할 주문을 돌려줌
+        return : [(매수주문번호, 매도 사유, 매도 수량)]
+        """
+        if not current_price:
+            return list()
+        now = self.clock() if now is None else now
+
+        sells = list()
+        with self.lock:
+            for state in self.states_by_stock_code.get(stock_code, ()):
+                state.last_price = current_price
+                if current_price > state.high:
+                    state.high = current_price
+                if not state.active:
+                    continue
+                for check in state.checks:
+                    sell = check(current_price, now)
+                    if sell is not None:
+                        sells.append((state.buy_order_number, sell[0], sell[1]))
+                        break
+        return sells
@@ -0,0 +1,477 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+from KiwoomConditionTrader.database_connection import StockDatabase
+from KiwoomConditionTrader.metrics import MetricsReporter, metrics
+from KiwoomConditionTrader.real_registration import RealRegistrationManager
+from KiwoomConditionTrader.settings import *
+from KiwoomConditionTrader.trader_threads import Commands, CommunicateThread, HeadlessConditionTrader, \
+    create_command_queue
+from Util.debugger import *
+
+# 한번에 묶어서 보내는 최대 메시지 수
+MAX_MESSAGES_PER_SEND = 1000
+
+
+def send_batches(connection, send_q):
+    """
+    send_q 에 쌓인 메시지를 최대 MAX_MESSAGES_PER_SEND 개씩 list 로 묶어 connection 으로 보냄
+    tick 이 몰려도 메시지마다 pickle/send 하지 않고 쌓인 만큼 한번에 보냄, None 을 받으면 남은 메시지를 보내고 끝냄
+    """
+    stopping = False
+    while not stopping:
+        message = send_q.get()
+        if message is None:
+            break
+
+        batch = [message]
+        while len(batch) < MAX_MESSAGES_PER_SEND:
+            try:
+                message = send_q.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                stopping = True
+                break
+            batch.append(message)
+
+        try:
+            connection.send(batch)
+        except (OSError, EOFError):
+            break
+
+
+def picklable_exception(exception):
+    # 키움 모듈의 예외처럼 worker 프로세스에서 import 할 수 없는 예외는 메시지만 남김
+    if exception is None or type(exception).__module__ == 'builtins':
+        return exception
+    return RuntimeError('{} : {}'.format(type(exception).__name__, exception))
+
+
+class WorkerConnection(object):
+    """게이트웨이에 연결된 worker 하나, 보낼 메시지는 send_q 에 넣기만 하고 sender 스레드가 모아서 보냄"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.name = None
+        self.condition_names = set()
+        self.condition_list = list()
+        # worker 가 실시간 등록한 종목, 이 종목들의 체결가만 보냄
+        self.stock_codes = set()
+        # {request_id: command_q 에 넣은 Future}, worker 가 취소하면 함께 취소
+        self.requests = dict()
+
+        self.send_q = queue.SimpleQueue()
+        self.sender_thread = threading.Thread(target=send_batches, args=(connection, self.send_q), daemon=True)
+
+    def send(self, message):
+        self.send_q.put(message)
+
+
+class BrokerGateway(object):
+    """
+    broker(키움 OCX)를 가진 프로세스에서 여러 worker 프로세스의 요청을 command_q 로 처리하고 결과와 이벤트를 돌려주는 서버
+    1. worker 는 GatewayClient 로 연결해서 이름과 맡은 조건식을 알리고, CommandClient 의 요청 data 를 그대로 보냄
+       모든 worker 의 요청이 command_q 하나로 모이므로 명령 우선순위와 키움 초당 요청 제한이 함께 적용됨
+    2. 실시간 체결가는 그 종목을 등록한 worker 에게만, 조건식 편입/이탈은 그 조건식을 맡은 worker 에게만 보내고,
+       체결 이벤트는 주문번호로 구분하므로 모든 worker 에게 보냄
+    3. 실시간 등록과 조건식 등록은 worker 별로 기록해 두고 전체 합으로 broker 에 등록함
+       같은 종목을 여러 worker 가 등록해도 한번만 등록하고, 모든 worker 가 해지하거나 연결이 끊기면 해지함
+    4. GET_CONDITIONS 는 worker 가 맡은 조건식 이름을 붙여서 조회하므로, 등록 전부터 편입되어 있던 종목도 그 조건식의 worker 가 받음
+    """
+
+    def __init__(self, broker, command_q, debugger, address=('localhost', 0), authkey=None):
+        self.broker = broker
+        self.command_q = command_q
+        self.debugger = debugger
+        # spawn 으로 띄운 worker 프로세스는 부모 프로세스의 authkey 를 물려받음
+        self.listener = Listener(address, authkey=authkey or multiprocessing.current_process().authkey)
+        self.address = self.listener.address
+
+        self.lock = threading.Lock()
+        # 이벤트 스레드가 lock 없이 읽도록 worker 가 연결되거나 끊길 때 새 list 로 바꿈
+        self.workers = list()
+        self.real_registration = RealRegistrationManager()
+        self.condition_list = list()
+
+        self.stopped = threading.Event()
+        self.accept_thread = threading.Thread(target=self.accept_workers, daemon=True)
+
+        broker.add_real_price_listener(self.on_real_price)
+        broker.add_chejan_listener(self.on_chejan)
+        broker.add_condition_listener(self.on_condition)
+
+    def start(self):
+        self.accept_thread.start()
+
+    def stop(self):
+        """worker 들에게 종료를 알림, worker 는 매수/매도 스레드를 멈추고 연결을 끊음"""
+        self.stopped.set()
+        for worker in self.workers:
+            worker.send(('close',))
+        self.listener.close()
+
+    def accept_workers(self):
+        while not self.stopped.is_set():
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                if not self.stopped.is_set():
+                    self.debugger.exception('worker 연결 실패, error - {}', e)
+                continue
+
+            worker = WorkerConnection(connection)
+            worker.sender_thread.start()
+            threading.Thread(target=self.serve_worker, args=(worker,), daemon=True).start()
+
+    def serve_worker(self, worker):
+        while True:
+            try:
+                messages = worker.connection.recv()
+            except (OSError, EOFError):
+                break
+
+            for message in messages:
+                if message[0] == 'request':
+                    self.handle_request(worker, message[1])
+                elif message[0] == 'cancel':
+                    future = worker.requests.get(message[1])
+                    if future is not None:
+                        future.cancel()
+                elif message[0] == 'hello':
+                    self.add_worker(worker, message[1], message[2])
+
+        self.remove_worker(worker)
+
+    def add_worker(self, worker, name, condition_names):
+        worker.name = name
+        worker.condition_names = set(condition_names)
+        with self.lock:
+            self.workers = self.workers + [worker]
+        self.debugger.info('{} : worker 가 연결되었습니다, 조건식 - {}', name, sorted(worker.condition_names))
+
+    def remove_worker(self, worker):
+        with self.lock:
+            self.workers = [x for x in self.workers if x is not worker]
+        for future in list(worker.requests.values()):
+            future.cancel()
+        worker.send(None)
+        worker.sender_thread.join(5)
+        worker.connection.close()
+        self.debugger.info('{} : worker 연결이 끊겼습니다', worker.name)
+
+        # 끊긴 worker 만 등록한 종목은 해지
+        with self.lock:
+            self.sync_real_registration()
+
+    def handle_request(self, worker, data):
+        command = data['command']
+        if command in (Commands.REGISTER_REAL_CURRENT_PRICE, Commands.UNREGISTER_REAL_CURRENT_PRICE,
+                       Commands.REGISTER_CONDITION):
+            exception = None
+            try:
+                with self.lock:
+                    if command == Commands.REGISTER_REAL_CURRENT_PRICE:
+                        worker.stock_codes.update(data['stock_code_list'])
+                        self.sync_real_registration()
+                    elif command == Commands.UNREGISTER_REAL_CURRENT_PRICE:
+                        worker.stock_codes.difference_update(data['stock_code_list'])
+                        self.sync_real_registration()
+                    else:
+                        worker.condition_list = list(data['condition_list'])
+                        self.sync_conditions()
+            except Exception as e:
+                self.debugger.exception('{} : {} failed, error - {}', worker.name, command, e)
+                exception = e
+            worker.send(('result', data['request_id'], picklable_exception(exception), None))
+            return
+
+        if command == Commands.GET_CONDITIONS:
+            data = dict(data, condition_list=sorted(worker.condition_names))
+
+        request_id = data['request_id']
+        future = Future()
+        worker.requests[request_id] = future
+        future.add_done_callback(lambda done: self.on_requested(worker, data, done))
+        self.command_q.put((future, data))
+
+    def on_requested(self, worker, data, future):
+        worker.requests.pop(data['request_id'], None)
+        # worker 가 취소한 요청은 worker 쪽 Future 도 이미 취소되어 있음
+        if future.cancelled():
+            return
+
+        exception = future.exception()
+        result = None if exception is not None else future.result()
+        worker.send(('result', data['request_id'], picklable_exception(exception), result))
+
+    def request(self, command, **kwargs):
+        """게이트웨이가 직접 보내는 요청, 결과는 기다리지 않고 실패하면 로그만 남김"""
+        future = Future()
+        future.add_done_callback(self.on_gateway_requested)
+        self.command_q.put((future, dict(kwargs, command=command, requested_at=time.monotonic())))
+        return future
+
+    def on_gateway_requested(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self.debugger.error('게이트웨이 요청 실패, error - {}', future.exception())
+
+    def sync_real_registration(self):
+        # lock 을 잡은 상태에서 부름
+        stock_codes = set().union(*[worker.stock_codes for worker in self.workers])
+        register, unregister = self.real_registration.sync(stock_codes)
+        for screen_number, stock_code_list in unregister.items():
+            self.request(Commands.UNREGISTER_REAL_CURRENT_PRICE, stock_code_list=stock_code_list,
+                         screen_number=screen_number)
+        for screen_number, stock_code_list in register.items():
+            self.request(Commands.REGISTER_REAL_CURRENT_PRICE, stock_code_list=stock_code_list,
+                         screen_number=screen_number)
+
+    def sync_conditions(self):
+        # lock 을 잡은 상태에서 부름, 등록할 조건식이 늘었을 때만 전체 조건식을 다시 등록
+        condition_list = list(self.condition_list)
+        for worker in self.workers:
+            condition_list.extend(x for x in worker.condition_list if x not in condition_list)
+        if condition_list != self.condition_list:
+            self.condition_list = condition_list
+            self.request(Commands.REGISTER_CONDITION, condition_list=condition_list)
+
+    def on_real_price(self, stock_code, current_price):
+        for worker in self.workers:
+            if stock_code in worker.stock_codes:
+                worker.send(('real_price', stock_code, current_price))
+
+    def on_chejan(self, order_number, stock_code, amount, filled, filled_price):
+        message = ('chejan', order_number, stock_code, amount, filled, filled_price)
+        for worker in self.workers:
+            worker.send(message)
+
+    def on_condition(self, stock_code, event_type, condition_name):
+        message = ('condition', stock_code, event_type, condition_name)
+        for worker in self.workers:
+            if condition_name in worker.condition_names:
+                worker.send(message)
+
+
+class GatewayClient(object):
+    """
+    worker 프로세스에서 BrokerGateway 에 연결해서 command_q 와 broker 이벤트 역할을 함
+    1. CommandClient 의 command_q 자리에 들어가서 put((Future, data)) 한 요청을 게이트웨이로 보내고, 결과를 받으면 Future 를 완료시킴
+       요청한 쪽에서 Future 를 취소하면 게이트웨이 command_q 에 남아있는 요청도 취소함
+    2. add_*_listener 로 등록한 listener 는 게이트웨이가 보낸 이벤트를 받는 스레드에서 불림
+    3. 게이트웨이가 종료를 알리거나 연결이 끊기면 closed 가 set 되고, 끝나지 않은 요청은 ConnectionError 로 끝남
+    """
+
+    def __init__(self, address, name, condition_names, authkey=None):
+        self.connection = Client(address, authkey=authkey or multiprocessing.current_process().authkey)
+        self.name = name
+
+        self.lock = threading.Lock()
+        # {request_id: 결과를 기다리는 Future}
+        self.pending = dict()
+        self.real_price_listeners = list()
+        self.chejan_listeners = list()
+        self.condition_listeners = list()
+
+        self.closed = threading.Event()
+        self.send_q = queue.SimpleQueue()
+        self.sender_thread = threading.Thread(target=send_batches, args=(self.connection, self.send_q), daemon=True)
+        self.receiver_thread = threading.Thread(target=self.receive, daemon=True)
+        self.send_q.put(('hello', name, list(condition_names)))
+
+    def start(self):
+        """listener 를 모두 등록한 뒤 시작해야 연결 직후의 이벤트를 놓치지 않음"""
+        self.sender_thread.start()
+        self.receiver_thread.start()
+
+    def add_real_price_listener(self, listener):
+        self.real_price_listeners.append(listener)
+
+    def add_chejan_listener(self, listener):
+        self.chejan_listeners.append(listener)
+
+    def add_condition_listener(self, listener):
+        self.condition_listeners.append(listener)
+
+    def put(self, item, block=True, timeout=None):
+        future, data = item
+        with self.lock:
+            if self.closed.is_set():
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(ConnectionError('{} : 게이트웨이 연결이 끊겼습니다'.format(self.name)))
+                return
+            self.pending[data['request_id']] = future
+        future.add_done_callback(self.on_done)
+        self.send_q.put(('request', data))
+
+    def on_done(self, future):
+        if not future.cancelled():
+            return
+        with self.lock:
+            if self.pending.pop(future.request_id, None) is None:
+                return
+        self.send_q.put(('cancel', future.request_id))
+
+    def receive(self):
+        while not self.closed.is_set():
+            try:
+                messages = self.connection.recv()
+            except (OSError, EOFError):
+                break
+
+            for message in messages:
+                kind = message[0]
+                if kind == 'real_price':
+                    for listener in self.real_price_listeners:
+                        listener(*message[1:])
+                elif kind == 'chejan':
+                    for listener in self.chejan_listeners:
+                        listener(*message[1:])
+                elif kind == 'condition':
+                    for listener in self.condition_listeners:
+                        listener(*message[1:])
+                elif kind == 'result':
+                    self.set_result(*message[1:])
+                elif kind == 'close':
+                    self.closed.set()
+
+        self.close()
+
+    def set_result(self, request_id, exception, result):
+        with self.lock:
+            future = self.pending.pop(request_id, None)
+        if future is None or not future.set_running_or_notify_cancel():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def close(self):
+        with self.lock:
+            self.closed.set()
+            futures = list(self.pending.values())
+            self.pending.clear()
+        for future in futures:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(ConnectionError('{} : 게이트웨이 연결이 끊겼습니다'.format(self.name)))
+
+        self.send_q.put(None)
+        self.sender_thread.join(5)
+        self.connection.close()
+
+
+def shard_metrics_export_path(name):
+    """프로세스마다 metrics 를 따로 내보내도록 파일 이름 뒤에 샤드 이름을 붙임"""
+    if not METRICS_EXPORT_PATH:
+        return None
+    root, ext = os.path.splitext(METRICS_EXPORT_PATH)
+    return '{}-{}{}'.format(root, name, ext)
+
+
+def run_shard_worker(address, name, account_num, condition_list, database_path, unnamed_positions=False):
+    """
+    worker 프로세스 하나, 샤드(계좌번호, 조건식 list) 하나의 매수/매도 스레드를 실행하고 게이트웨이가 종료를 알리면 끝냄
+    장부는 다른 worker 와 같은 DB 파일을 쓰고, 맡은 조건식으로 매수한 주문만 읽어옴
+    unnamed_positions 면 조건식 이름 없이 저장된 이전 버전의 주문도 맡음
+    """
+    configure_debugger(json_log=LOG_JSON, levels=LOG_LEVELS)
+    client = GatewayClient(address, name, condition_list)
+    position_condition_names = list(condition_list) + ([None] if unnamed_positions else [])
+    trader = HeadlessConditionTrader(client, StockDatabase(database_path), debugger,
+                                     command_q=client,
+                                     account_num=account_num,
+                                     condition_list=condition_list,
+                                     position_condition_names=position_condition_names,
+                                     metrics_export_path=shard_metrics_export_path(name))
+    client.start()
+    trader.start()
+    debugger.info('{} : 계좌번호 {}, 조건식 {} 매매를 시작합니다', name, account_num, condition_list)
+
+    client.closed.wait()
+    trader.stop()
+    trader.database.flush()
+    debugger.info('{} : 매매를 끝냅니다, 장부 {}건', name, len(trader.position_book))
+
+
+def start_shard_workers(address, shards, database_path):
+    """shards({샤드이름: (계좌번호, 조건식 list)}) 마다 worker 프로세스를 띄움, 첫 샤드가 조건식 이름 없는 주문을 맡음"""
+    context = multiprocessing.get_context('spawn')
+    processes = list()
+    for i, (name, (account_num, condition_list)) in enumerate(shards.items()):
+        process = context.Process(target=run_shard_worker, name=name, daemon=True,
+                                  args=(address, name, account_num, condition_list, database_path, i == 0))
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def split_shards(condition_list, shard_count, account_num=ACCOUNT_NUM):
+    """조건식을 shard_count 개의 샤드에 차례로 나눠 넣음, 모든 샤드가 같은 계좌를 사용"""
+    shard_count = max(1, min(shard_count, len(condition_list)))
+    return {'shard{}'.format(i + 1): (account_num, condition_list[i::shard_count]) for i in range(shard_count)}
+
+
+def run_gateway_simulation(seconds, exchange, shards, database_path):
+    command_q = create_command_queue()
+    communicate_thread = CommunicateThread(command_q, exchange, debugger.getChild('command'))
+    gateway = BrokerGateway(exchange, command_q, debugger.getChild('gateway'), address=('localhost', GATEWAY_PORT))
+    metrics_reporter = MetricsReporter(metrics, debugger.getChild('metrics'), interval=METRICS_SUMMARY_SECONDS,
+                                       export_path=shard_metrics_export_path('gateway'), command_q=command_q)
+    communicate_thread.start()
+    metrics_reporter.start()
+    gateway.start()
+    exchange.start()
+
+    workers = start_shard_workers(gateway.address, shards, database_path)
+    time.sleep(seconds)
+    gateway.stop()
+    for worker in workers:
+        worker.join(30)
+    communicate_thread.stop()
+    exchange.stop()
+
+    debugger.info('시뮬레이션 {}초, worker {}개, tick {}개 ({:.0f} ticks/sec)', seconds, len(workers),
+                  exchange.tick_count, exchange.tick_count / seconds)
+    for name, count in sorted(exchange.call_counts.items()):
+        debugger.info('{} : {}회 ({:.1f}/sec)', name, count, count / seconds)
+
+    # 마지막 metrics 를 내보낼 때까지 기다림
+    metrics_reporter.stop()
+
+
+if __name__ == '__main__':
+    # 실매매 프로세스(kiwoom_condition_trader)도 이 모듈을 import 하므로 모의 거래소는 시뮬레이션 실행 때만 불러옴
+    from KiwoomConditionTrader.simulated_exchange import SimulatedExchange
+
+    parser = argparse.ArgumentParser(description='모의 거래소를 가진 게이트웨이 프로세스와 샤드별 worker 프로세스로 매매 파이프라인 실행')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--symbols', type=int, default=100)
+    parser.add_argument('--ticks-per-second', type=int, default=5000)
+    parser.add_argument('--condition-hit-rate', type=float, default=0.001)
+    parser.add_argument('--fill-latency', type=float, default=0.05)
+    parser.add_argument('--shards', type=int, default=2, help='[샤드] 설정이 없거나 --conditions 를 줄 때 나눌 worker 수')
+    parser.add_argument('--conditions', help='쉼표로 구분한 조건식 이름, 주지 않으면 [샤드] 또는 [조건식이름] 설정 사용')
+    args = parser.parse_args()
+    configure_debugger(json_log=LOG_JSON, levels=LOG_LEVELS)
+
+    if args.conditions:
+        shards = split_shards([x.strip() for x in args.conditions.split(',') if x.strip()], args.shards)
+    else:
+        shards = SHARDS or split_shards(CONDITION_LIST, args.shards)
+
+    simulated_exchange = SimulatedExchange(stock_codes=['{:06d}'.format(x) for x in range(1, args.symbols + 1)],
+                                           seed=args.seed,
+                                           ticks_per_second=args.ticks_per_second,
+                                           condition_hit_rate=args.condition_hit_rate,
+                                           fill_latency=args.fill_latency)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run_gateway_simulation(args.seconds, simulated_exchange, shards, os.path.join(tmp_dir, 'simulation.db'))
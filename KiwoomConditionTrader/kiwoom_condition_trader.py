@@ -1,55 +1,39 @@
-import sys
-import configparser
 import threading
-import queue
-import re
-import time
 
-from enum import Enum
 from PyQt5.QAxContainer import QAxWidget
 from PyQt5 import QtWidgets
 from PyQt5 import QtCore
 from StockApis.kiwoom import KiwoomAPIModule
+from KiwoomConditionTrader.broker import Broker, CURRENT_PRICES_PER_REQUEST
+from KiwoomConditionTrader.condition_tracker import ConditionTracker
 from KiwoomConditionTrader.database_connection import StockDatabase
+from KiwoomConditionTrader.gateway import BrokerGateway, shard_metrics_export_path, start_shard_workers
+from KiwoomConditionTrader.order_tracker import OrderTracker
+from KiwoomConditionTrader.position_book import PositionBook
+from KiwoomConditionTrader.price_cache import PriceCache
+from KiwoomConditionTrader.settings import *
+from KiwoomConditionTrader.metrics import MetricsReporter, metrics
+from KiwoomConditionTrader.tick_recorder import TickRecorder
+from KiwoomConditionTrader.trader_threads import Commands, CommandDispatcher, KiwoomCheckRealCurrentPrice, \
+    KiwoomCatchConditionOrder, KiwoomRealPriceSellTrigger, create_command_queue, create_command_client
 from Util.debugger import *
 
-cfg = configparser.ConfigParser()
-cfg.read('Settings.ini')
-
-CONDITION_LIST = [x.strip() for x in cfg['조건식이름']['목록'].split(',')]
-ACCOUNT_NUM = cfg['계좌번호']['번호']
-BUY_PRICE = float(cfg['매매금액']['금액'])
-PROFIT_LIMIT = float(cfg['수익상한']['비율'])
-LOSS_LIMIT = -(float(cfg['손실하한']['비율']))
-
-if LOSS_LIMIT > 0:
-    debugger.exception('손실하한 비율은 음수가 될 수 없습니다')
-    raise Exception('손실하한 비율은 음수가 될 수 없습니다')
-
-# 구매 시 시장가 변수
-MARKET_PRICE = '03'
-
-
-class Commands(Enum):
-    SELL = 'sell'
-    BUY = 'buy'
-    APPLY_CONDITION = 'apply_condition'
-    GET_CURRENT_PRICE = 'get_current_price'
-    GET_REAL_CURRENT_PRICE = 'get_real_current_price'
-    GET_CONDITIONS = 'get_conditions'
-    GET_ORDER_HISTORY = 'get_order_history'
-    REGISTER_CONDITION = 'register_condition'
-    REGISTER_REAL_CURRENT_PRICE = 'register_real_current_price'
-    CANCEL_SELL_STOCK = 'cancel_sell_stock'
-
 
 class KiwoomConditionTrader(QtWidgets.QMainWindow):
     def __init__(self):
         super().__init__()
-        self.command_q = queue.Queue()
+        self.command_q = create_command_queue()
+        self.command_client = create_command_client(self.command_q)
         self.database = StockDatabase()
+        self.position_book = PositionBook(self.database)
+        self.order_tracker = OrderTracker(silent_seconds=ORDER_SILENT_SECONDS)
 
-        self.kiwoom_communicate_thread = KiwoomCommunicateThread(self.command_q, debugger)
+        self.kiwoom_communicate_thread = KiwoomCommunicateThread(self.command_q, debugger.getChild('command'))
+        self.kiwoom_communicate_thread.broker.add_chejan_listener(self.order_tracker.on_chejan)
+        self.condition_tracker = ConditionTracker(debugger.getChild('condition'), max_hits=CONDITION_HIT_QUEUE_SIZE)
+        self.kiwoom_communicate_thread.broker.add_condition_listener(self.condition_tracker.on_condition)
+        self.price_cache = PriceCache(self.command_client, ttl=PRICE_CACHE_TTL_SECONDS, max_size=PRICE_CACHE_SIZE)
+        self.kiwoom_communicate_thread.broker.add_real_price_listener(self.price_cache.on_real_price)
 
         self.run_in_main()
         self.register_conditions()
@@ -57,32 +41,112 @@ class KiwoomConditionTrader(QtWidgets.QMainWindow):
     def run_in_main(self):
         self.kiwoom_communicate_thread.start()
 
-        self.kiwoom_catch_condition_order = KiwoomCatchConditionOrder(self.command_q, self.database, debugger)
+        self.metrics_reporter = MetricsReporter(metrics, debugger.getChild('metrics'), interval=METRICS_SUMMARY_SECONDS,
+                                                export_path=METRICS_EXPORT_PATH, command_q=self.command_q)
+        self.metrics_reporter.start()
+
+        # 실시간 체결가와 조건식 편입/이탈 이벤트를 backtest 용으로 기록
+        if TICK_RECORDING:
+            self.tick_recorder = TickRecorder(TICK_RECORDING_DIRECTORY)
+            self.kiwoom_communicate_thread.broker.add_real_price_listener(self.tick_recorder.record_tick)
+            self.kiwoom_communicate_thread.broker.add_condition_listener(self.tick_recorder.record_condition)
+            self.tick_recorder.start()
+
+        # 복원된 장부의 매도 감시를 매수/조건식 등록과 함께 바로 시작
+        self.kiwoom_check_real_current_price = KiwoomCheckRealCurrentPrice(
+            self.command_client, self.position_book, self.order_tracker, debugger.getChild('sell'),
+            event_driven=REAL_PRICE_EVENT_DRIVEN,
+            real_price_stale_seconds=REAL_PRICE_STALE_SECONDS,
+            price_cache=self.price_cache)
+        self.kiwoom_check_real_current_price.start()
+
+        self.kiwoom_catch_condition_order = KiwoomCatchConditionOrder(
+            self.command_client, self.position_book, self.order_tracker, self.condition_tracker,
+            debugger.getChild('buy'), condition_sync_seconds=CONDITION_SYNC_SECONDS, price_cache=self.price_cache)
         self.kiwoom_catch_condition_order.start()
 
-        self.kiwoom_check_real_current_price = KiwoomCheckRealCurrentPrice(self.command_q, self.database, debugger)
-        self.kiwoom_check_real_current_price.start()
+        # 실시간 체결가 이벤트가 들어오면 polling 을 기다리지 않고 바로 손익률 비교 후 매도
+        if REAL_PRICE_EVENT_DRIVEN:
+            self.kiwoom_real_price_sell_trigger = KiwoomRealPriceSellTrigger(self.kiwoom_check_real_current_price,
+                                                                             debugger.getChild('sell'))
+            self.kiwoom_communicate_thread.broker.add_real_price_listener(
+                self.kiwoom_real_price_sell_trigger.on_real_price)
+            self.kiwoom_real_price_sell_trigger.start()
 
     def register_conditions(self):
-        register_condition_callback_queue = queue.Queue()
-        data = dict(command=Commands.REGISTER_CONDITION,
-                    condition_list=CONDITION_LIST)
-        self.command_q.put((register_condition_callback_queue, data))
+        self.command_client.request(Commands.REGISTER_CONDITION,
+                                    condition_list=CONDITION_LIST)
 
 
-class KiwoomCommunicateThread(QtCore.QThread):
-    def __init__(self, command_q, debugger):
-        super(KiwoomCommunicateThread, self).__init__()
-        self.command_q = command_q
-        self.debugger = debugger
+class KiwoomShardGateway(QtWidgets.QMainWindow):
+    """
+    [샤드] 설정이 있을 때 실행하는 게이트웨이, 키움 OCX 와 Communicate Thread 는 이 프로세스 하나만 가짐
+    샤드마다 worker 프로세스를 띄우고, worker 의 매수/매도 요청과 키움 이벤트를 BrokerGateway 로 주고받음
+    """
+
+    def __init__(self, shards, database_path):
+        super().__init__()
+        self.command_q = create_command_queue()
+        self.kiwoom_communicate_thread = KiwoomCommunicateThread(self.command_q, debugger.getChild('command'))
+        self.broker_gateway = BrokerGateway(self.kiwoom_communicate_thread.broker, self.command_q,
+                                            debugger.getChild('gateway'), address=('localhost', GATEWAY_PORT))
+        self.metrics_reporter = MetricsReporter(metrics, debugger.getChild('metrics'), interval=METRICS_SUMMARY_SECONDS,
+                                                export_path=shard_metrics_export_path('gateway'),
+                                                command_q=self.command_q)
+
+        self.kiwoom_communicate_thread.start()
+        self.metrics_reporter.start()
+
+        if TICK_RECORDING:
+            self.tick_recorder = TickRecorder(TICK_RECORDING_DIRECTORY)
+            self.kiwoom_communicate_thread.broker.add_real_price_listener(self.tick_recorder.record_tick)
+            self.kiwoom_communicate_thread.broker.add_condition_listener(self.tick_recorder.record_condition)
+            self.tick_recorder.start()
+
+        self.broker_gateway.start()
+        self.shard_workers = start_shard_workers(self.broker_gateway.address, shards, os.path.abspath(database_path))
+
+
+# 관심종목정보요청에 사용하는 요청 이름과 화면번호
+CURRENT_PRICES_RQ_NAME = 'current_prices_req'
+CURRENT_PRICES_SCREEN_NUMBER = '4001'
+
+# 재시작할 때 미체결 주문(실시간미체결요청, opt10075)과 잔고(계좌평가잔고내역요청, opw00018)를 조회하는 요청 이름과 읽을 항목
+OPEN_ORDERS_RQ_NAME = 'open_orders_req'
+HOLDINGS_RQ_NAME = 'holdings_req'
+ACCOUNT_SCREEN_NUMBER = '4002'
+ACCOUNT_TR_ITEMS = {
+    OPEN_ORDERS_RQ_NAME: ('주문번호', '미체결수량'),
+    HOLDINGS_RQ_NAME: ('종목번호', '보유수량'),
+}
+
+
+class KiwoomBroker(Broker):
+    """
+    키움 OpenAPI OCX(KHOPENAPI) 를 사용하는 Broker 구현
+    """
 
+    def __init__(self):
         self.kiwoom = QAxWidget("KHOPENAPI.KHOpenAPICtrl.1")
         self.kiwoom.dynamicCall("CommConnect()")
         self.kiwoom_api = KiwoomAPIModule(self.kiwoom)
+        self.real_price_listeners = list()
+        self.chejan_listeners = list()
+        self.condition_listeners = list()
+        # {조건식 이름: 편입 종목코드 set}, 조건식 등록(SendCondition) 결과와 편입/이탈 이벤트로 갱신
+        self.condition_lock = threading.Lock()
+        self.condition_stock_codes = dict()
+        self.condition_tr_continued = set()
+
+        # 관심종목정보요청(OPTKWFID) 응답을 Communicate Thread 에 넘겨주기 위한 event
+        self.current_prices_received = threading.Event()
+        self.current_prices = dict()
+        # 미체결/잔고 조회 응답, 연속조회가 있으면 account_tr_prev_next 가 '2'
+        self.account_tr_received = threading.Event()
+        self.account_tr_rows = list()
+        self.account_tr_prev_next = '0'
         self.connections()
 
-        self.stopped = threading.Event()
-
     def connections(self):
         self.kiwoom.OnReceiveTrData.connect(self.kiwoom_api.receive_tx_data)
         self.kiwoom.OnReceiveChejanData.connect(self.kiwoom_api.receive_chejan_data)
@@ -97,376 +161,221 @@ class KiwoomCommunicateThread(QtCore.QThread):
         self.kiwoom.OnReceiveConditionVer.connect(self.kiwoom_api.receive_condition_ver)
         self.kiwoom.OnReceiveRealCondition.connect(self.kiwoom_api.receive_real_condition)
 
+        # GetCommRealData 는 OnReceiveRealData 이벤트 안에서만 유효하므로 이벤트를 받은 스레드에서 바로 읽음
+        self.kiwoom.OnReceiveRealData.connect(self.receive_real_price)
+        # GetChejanData 도 OnReceiveChejanData 이벤트 안에서만 유효함
+        self.kiwoom.OnReceiveChejanData.connect(self.receive_chejan)
+        self.kiwoom.OnReceiveRealCondition.connect(self.receive_real_condition)
+        self.kiwoom.OnReceiveTrCondition.connect(self.receive_tr_condition)
+        self.kiwoom.OnReceiveTrData.connect(self.receive_current_prices)
+        self.kiwoom.OnReceiveTrData.connect(self.receive_account_tr)
+
+    def receive_real_price(self, stock_code, real_type, real_data):
+        if real_type != '주식체결' or not self.real_price_listeners:
+            return
+
+        # FID 10 : 현재가, 전일 대비 하락이면 '-' 부호가 붙어서 옴
+        current_price = abs(int(self.kiwoom.dynamicCall("GetCommRealData(QString, int)", stock_code, 10)))
+        for listener in self.real_price_listeners:
+            listener(stock_code, current_price)
+
+    def add_real_price_listener(self, listener):
+        self.real_price_listeners.append(listener)
+
+    def receive_chejan(self, gubun, item_cnt, fid_list):
+        # gubun '0' : 주문접수/체결, '1' : 잔고변경
+        if gubun != '0' or not self.chejan_listeners:
+            return
+
+        def get_chejan_data(fid):
+            return self.kiwoom.dynamicCall("GetChejanData(int)", fid).strip()
+
+        # FID 9203 : 주문번호, 9001 : 종목코드(A 접두어), 900 : 주문수량, 911 : 누적 체결량, 910 : 이번 체결가
+        order_number = get_chejan_data(9203)
+        stock_code = get_chejan_data(9001).lstrip('A')
+        amount = int(get_chejan_data(900) or 0)
+        filled = int(get_chejan_data(911) or 0)
+        filled_price = abs(int(get_chejan_data(910) or 0))
+        for listener in self.chejan_listeners:
+            listener(order_number, stock_code, amount, filled, filled_price)
+
+    def add_chejan_listener(self, listener):
+        self.chejan_listeners.append(listener)
+
+    def receive_real_condition(self, stock_code, event_type, condition_name, condition_index):
+        # event_type 'I' : 편입, 'D' : 이탈
+        with self.condition_lock:
+            stock_codes = self.condition_stock_codes.setdefault(condition_name, set())
+            if event_type == 'I':
+                stock_codes.add(stock_code)
+            else:
+                stock_codes.discard(stock_code)
+        for listener in self.condition_listeners:
+            listener(stock_code, event_type, condition_name)
+
+    def add_condition_listener(self, listener):
+        self.condition_listeners.append(listener)
+
+    def receive_tr_condition(self, screen_number, code_list, condition_name, condition_index, prev_next):
+        # 조건식 등록 시점에 이미 편입된 종목, code_list 는 ';' 로 구분, prev_next 가 '2' 면 다음 응답에 이어서 옴
+        stock_codes = set(stock_code for stock_code in code_list.split(';') if stock_code)
+        with self.condition_lock:
+            if condition_name in self.condition_tr_continued:
+                self.condition_stock_codes.setdefault(condition_name, set()).update(stock_codes)
+            else:
+                self.condition_stock_codes[condition_name] = stock_codes
+            if prev_next == '2':
+                self.condition_tr_continued.add(condition_name)
+            else:
+                self.condition_tr_continued.discard(condition_name)
+
+    @property
+    def is_connected(self):
+        return self.kiwoom_api.is_connected
+
     def register_conditions(self, condition_list):
         self.kiwoom_api.register_condition_list(condition_list)
         self.kiwoom_api.apply_conditions()
 
-    def stop(self):
-        self.stopped.set()
-
-    def run(self):
-        while not self.kiwoom_api.is_connected:
-            time.sleep(0.1)
-
-        while not self.stopped.is_set():
-            try:
-                try:
-                    callback_queue, data = self.command_q.get(True, 30)
-                except:
-                    continue
-                ret = str()
-                if data['command'] == Commands.REGISTER_CONDITION:
-                    self.register_conditions(data['condition_list'])
-
-                elif data['command'] == Commands.REGISTER_REAL_CURRENT_PRICE:
-                    self.kiwoom_api.registry_real_current_price_data(data['stock_code_list'])
-
-                elif data['command'] == Commands.GET_CONDITIONS:
-                    ret = self.kiwoom_api.get_conditions()
-
-                elif data['command'] == Commands.GET_CURRENT_PRICE:
-                    ret = self.kiwoom_api.get_current_price(data['stock_code'])
-
-                elif data['command'] == Commands.GET_REAL_CURRENT_PRICE:
-                    ret = self.kiwoom_api.get_current_price_set(data['stock_code'])
-
-                elif data['command'] == Commands.GET_ORDER_HISTORY:
-                    ret = self.kiwoom_api.get_order_history(data['order_number'])
-
-                elif data['command'] == Commands.BUY:
-                    ret = self.kiwoom_api.buy_stock(data['account_num'],
-                                                    data['stock_code'],
-                                                    data['qty'],
-                                                    trade_type=MARKET_PRICE
-                                                    )
-
-                elif data['command'] == Commands.SELL:
-                    ret = self.kiwoom_api.sell_stock(data['account_num'],
-                                                     data['stock_code'],
-                                                     data['qty'],
-                                                     trade_type=MARKET_PRICE
-                                                     )
-                callback_queue.put(ret)
-            except Exception as e:
-                self.debugger.exception(e)
-                callback_queue.put('')
-
-
-class KiwoomCheckRealCurrentPrice(threading.Thread):
-    """
-    1. DB에 있는 매수 체결된 종목들 실시간 현재가 이벤트 받기 등록
-    2. 실시간 현재가와 매수체결가격 비교하면서 수익상한과 수익하한 범위 밖이면 매도 및 DB에서 해당 종목코드 삭제
-    """
-
-    def __init__(self, command_q, database, debugger):
-        super().__init__()
+    def register_real_current_price(self, stock_code_list, screen_number):
+        # FID 10 : 현재가, 등록타입 '1' : 같은 화면의 기존 등록 종목을 유지하고 추가
+        self.kiwoom.dynamicCall("SetRealReg(QString, QString, QString, QString)",
+                                screen_number, ';'.join(stock_code_list), '10', '1')
+
+    def unregister_real_current_price(self, stock_code_list, screen_number):
+        for stock_code in stock_code_list:
+            self.kiwoom.dynamicCall("SetRealRemove(QString, QString)", screen_number, stock_code)
+
+    def get_conditions(self, condition_list=None):
+        if condition_list is None:
+            return self.kiwoom_api.get_conditions()
+        with self.condition_lock:
+            return list(set().union(*[self.condition_stock_codes.get(condition_name, set())
+                                      for condition_name in condition_list]))
+
+    def get_current_price(self, stock_code):
+        return self.kiwoom_api.get_current_price(stock_code)
+
+    def get_current_prices(self, stock_code_list):
+        """관심종목정보요청(CommKwRqData, OPTKWFID) 으로 최대 CURRENT_PRICES_PER_REQUEST 종목씩 TR 한번에 현재가 조회"""
+        current_prices = dict()
+        stock_codes = list(dict.fromkeys(stock_code_list))
+        for i in range(0, len(stock_codes), CURRENT_PRICES_PER_REQUEST):
+            request_stock_codes = stock_codes[i:i + CURRENT_PRICES_PER_REQUEST]
+            self.current_prices_received.clear()
+            self.kiwoom.dynamicCall("CommKwRqData(QString, bool, int, int, QString, QString)",
+                                    ';'.join(request_stock_codes), False, len(request_stock_codes), 0,
+                                    CURRENT_PRICES_RQ_NAME, CURRENT_PRICES_SCREEN_NUMBER)
+            if not self.current_prices_received.wait(5):
+                break
+            current_prices.update(self.current_prices)
+        return current_prices
+
+    def receive_current_prices(self, screen_number, rq_name, tr_code, *args):
+        if rq_name != CURRENT_PRICES_RQ_NAME:
+            return
+
+        current_prices = dict()
+        for i in range(self.kiwoom.dynamicCall("GetRepeatCnt(QString, QString)", tr_code, rq_name)):
+            def get_comm_data(item_name):
+                return self.kiwoom.dynamicCall("GetCommData(QString, QString, int, QString)",
+                                               tr_code, rq_name, i, item_name).strip()
+
+            # 현재가는 전일 대비 하락이면 '-' 부호가 붙어서 옴
+            current_price = abs(int(get_comm_data("현재가") or 0))
+            if current_price:
+                current_prices[get_comm_data("종목코드")] = current_price
+        self.current_prices = current_prices
+        self.current_prices_received.set()
+
+    def get_real_current_price(self, stock_code):
+        return self.kiwoom_api.get_current_price_set(stock_code)
+
+    def request_account_tr(self, rq_name, tr_code, inputs):
+        """계좌 TR 을 연속조회까지 모두 받아서 ACCOUNT_TR_ITEMS 의 항목 dict list 로 돌려줌"""
+        rows = list()
+        prev_next = 0
+        while True:
+            for key, value in inputs:
+                self.kiwoom.dynamicCall("SetInputValue(QString, QString)", key, value)
+            self.account_tr_received.clear()
+            self.kiwoom.dynamicCall("CommRqData(QString, QString, int, QString)",
+                                    rq_name, tr_code, prev_next, ACCOUNT_SCREEN_NUMBER)
+            if not self.account_tr_received.wait(5):
+                raise TimeoutError('{} : 응답을 받지 못했습니다'.format(rq_name))
+            rows.extend(self.account_tr_rows)
+            if self.account_tr_prev_next != '2':
+                return rows
+            prev_next = 2
+
+    def receive_account_tr(self, screen_number, rq_name, tr_code, record_name, prev_next, *args):
+        items = ACCOUNT_TR_ITEMS.get(rq_name)
+        if items is None:
+            return
+
+        rows = list()
+        for i in range(self.kiwoom.dynamicCall("GetRepeatCnt(QString, QString)", tr_code, rq_name)):
+            rows.append({item_name: self.kiwoom.dynamicCall("GetCommData(QString, QString, int, QString)",
+                                                            tr_code, rq_name, i, item_name).strip()
+                         for item_name in items})
+        self.account_tr_rows = rows
+        self.account_tr_prev_next = prev_next
+        self.account_tr_received.set()
+
+    def get_open_orders(self, account_num):
+        # 전체종목구분 '0' : 전체, 매매구분 '0' : 전체, 체결구분 '1' : 미체결
+        rows = self.request_account_tr(OPEN_ORDERS_RQ_NAME, 'opt10075',
+                                       [('계좌번호', account_num), ('전체종목구분', '0'), ('매매구분', '0'),
+                                        ('종목코드', ''), ('체결구분', '1')])
+        return [row['주문번호'] for row in rows if int(row['미체결수량'] or 0) > 0]
+
+    def get_holdings(self, account_num):
+        # 조회구분 '2' : 개별, 종목번호는 'A' 접두어가 붙어서 옴
+        rows = self.request_account_tr(HOLDINGS_RQ_NAME, 'opw00018',
+                                       [('계좌번호', account_num), ('비밀번호', ''), ('비밀번호입력매체구분', '00'),
+                                        ('조회구분', '2')])
+        holdings = dict()
+        for row in rows:
+            amount = int(row['보유수량'] or 0)
+            if amount > 0:
+                holdings[row['종목번호'].lstrip('A')] = amount
+        return holdings
+
+    def get_order_history(self, order_number):
+        return self.kiwoom_api.get_order_history(order_number)
+
+    def buy_stock(self, account_num, stock_code, qty, trade_type):
+        return self.kiwoom_api.buy_stock(account_num, stock_code, qty, trade_type=trade_type)
+
+    def sell_stock(self, account_num, stock_code, qty, trade_type):
+        return self.kiwoom_api.sell_stock(account_num, stock_code, qty, trade_type=trade_type)
+
+
+class KiwoomCommunicateThread(CommandDispatcher, QtCore.QThread):
+    def __init__(self, command_q, debugger, broker=None):
+        super(KiwoomCommunicateThread, self).__init__()
         self.command_q = command_q
-        self.database = database
         self.debugger = debugger
 
-        self.stopped = threading.Event()
-
-        self.stock_real_price_register_history = dict()
-        self.pending_sell_order_number_list = list()
-
-    def stop(self):
-        self.stopped.set()
-
-    def is_sell_timing(self, stock_code, current_price, price):
-        try:
-            earning_rate = ((current_price / price) - 1) * 100
-        except ZeroDivisionError:
-            self.debugger.debug('{} : price is zero'.format(stock_code))
-            return False
-
-        if LOSS_LIMIT < earning_rate < PROFIT_LIMIT:
-            return False
-        elif earning_rate < LOSS_LIMIT:
-            self.debugger.info('{} : 손익율 {}%, 손실하한 미만으로 매도합니다'.format(stock_code, earning_rate))
-        elif earning_rate > PROFIT_LIMIT:
-            self.debugger.info('{} : 손익율 {}%, 수익상한 초과로 매도합니다'.format(stock_code, earning_rate))
-        return True
-
-    def run(self):
-        while not self.stopped.wait(1):
-            # db에 매수 체결된 종목들 실시간 현재가 이벤트 받기 등록
-            # db에서 이미 실시간 현재가 이벤트 등록이 되어있으면 pass 함
-            all_stock_order_history = self.database.get_all_stock_order_history()
-
-            # loop 마다 DB 주문기록 업데이트
-            stock_order_history = dict()
-            for order_history in all_stock_order_history:
-                buy_order_number, stock_code, amount, price, sell_order_number = order_history
-                stock_order_history.setdefault(buy_order_number,
-                                               dict(
-                                                   order_number=buy_order_number,
-                                                   stock_code=stock_code,
-                                                   amount=amount,
-                                                   price=price,
-                                                   sell_order_number=sell_order_number)
-                                               )
-
-            # DB 종목별 실시간 real 이벤트 등록 기록
-            for order_history in all_stock_order_history:
-                _, stock_code, _, _, _ = order_history
-                self.stock_real_price_register_history.setdefault(stock_code, dict(registered=False))
-
-            # 실시간 현재가 등록할 종목코드 찾기
-            if self.stock_real_price_register_history:
-                stock_codes_to_register = list()
-
-                for buy_order_number in stock_order_history.keys():
-                    stock_code = stock_order_history[buy_order_number]['stock_code']
-
-                    # 종목 하나라도 register 되지 않았다면 모두 등록하고 registered True로 바꾸기
-                    if not self.stock_real_price_register_history[stock_code]['registered']:
-                        for stock_code in self.stock_real_price_register_history:
-                            stock_codes_to_register.append(stock_code)
-                            self.stock_real_price_register_history[stock_code]['registered'] = True
-                        break
-
-                if stock_codes_to_register:
-                    register_real_current_price_callback_queue = queue.Queue()
-                    data = dict(command=Commands.REGISTER_REAL_CURRENT_PRICE,
-                                stock_code_list=stock_codes_to_register
-                                )
-                    self.debugger.info('{} : 해당종목을 실시간 가격 이벤트에 등록합니다'.format(stock_codes_to_register))
-                    self.command_q.put((register_real_current_price_callback_queue, data))
-
-            # DB에서 종목별 매수가와 실시간으로 받아온 현재가 비교로직
-            for buy_order_number in stock_order_history.keys():
-                stock_code = stock_order_history[buy_order_number]['stock_code']
-
-                get_real_current_price_callback_queue = queue.Queue()
-                data = dict(command=Commands.GET_REAL_CURRENT_PRICE,
-                            stock_code=stock_code
-                            )
-                self.command_q.put((get_real_current_price_callback_queue, data))
-                try:
-                    current_price = get_real_current_price_callback_queue.get(timeout=20)
-                except:
-                    current_price = None
-
-                if not current_price:
-                    self.debugger.debug('{} : failed to get real current price'.format(stock_code))
-                    continue
-
-                # 현재가와 매수가격 비교 뒤 수익률이 LOSS_LIMIT 과 PROFIT_LIMIT 영역 밖이면 매도
-                # 매도성공시 리턴값으로 주문번호(order_number) 받음
-                buy_price = stock_order_history[buy_order_number]['price']
-
-                # 매도주문체결 완료되지 않은 종목 손익률 비교 하지 않음
-                if stock_order_history[buy_order_number]['sell_order_number']:
-                    continue
-
-                # 손익률 비교
-                if self.is_sell_timing(stock_code, current_price, buy_price):
-                    order_amount = stock_order_history[buy_order_number]['amount']
-
-                    sell_callback_queue = queue.Queue()
-                    data = dict(command=Commands.SELL,
-                                account_num=ACCOUNT_NUM,
-                                stock_code=stock_code,
-                                qty=order_amount
-                                )
-                    self.debugger.info('{} : 해당 종목을 {} 개만큼 매도합니다'.format(stock_code, order_amount))
-
-                    self.command_q.put((sell_callback_queue, data))
-                    try:
-                        sell_order_number = sell_callback_queue.get(timeout=20)
-                    except:
-                        sell_order_number = None
-
-                    # 매도주문번호 리턴값이 에러코드면 주문 실패
-                    if re.compile('[^0-9]').match(sell_order_number) or not sell_order_number:
-                        self.debugger.debug('{} : sell order failed, error code {}'.format(stock_code, sell_order_number))
-                        continue
-
-                    # 매도 후 주문번호를 정상적으로 리턴했으면 매도주문에 성공, db에서 해당종목 삭제
-                    self.debugger.info('{} : 주문번호 - {}, 매도주문에 성공했습니다'.format(stock_code, sell_order_number))
-
-                    # 매도주문번호 매수주문번호 row 에 DB에 저장, 기억하고 있다가 나중에 매도체결 완료되면 매도주문번호로 DB 에서 삭제
-                    try:
-                        self.database.add_sell_order_history(buy_order_number, sell_order_number)
-                        self.debugger.info('매도주문번호 - {}, DB에 저장하였습니다'.format(sell_order_number))
-
-                        self.pending_sell_order_number_list.append(sell_order_number)
-                    except Exception as e:
-                        self.debugger.exception('매도주문번호 저장 실패, error - {}'.format(e))
-
-            # 주문체결번호 리스트 돌면서 전량 매도된 주문 DB에서 삭제
-            for sell_order_number in self.pending_sell_order_number_list:
-                time.sleep(1)
-                get_order_history_callback_queue = queue.Queue()
-                data = dict(command=Commands.GET_ORDER_HISTORY,
-                            order_number=sell_order_number,
-                            )
-                self.debugger.debug('order number {} : started getting order history'.format(data['order_number']))
-                self.command_q.put((get_order_history_callback_queue, data))
-
-                try:
-                    order_history = get_order_history_callback_queue.get(timeout=20)
-                except:
-                    order_history = None
-
-                if not order_history:
-                    continue
-
-                stock_code = order_history['stock_code']
-                order_amount = order_history['amount']
-                filled = order_history['filled']
-                filled_price = order_history['filled_price']
-
-                # 주문량과 체결량이 같을 때 DB에서 삭제
-                if order_amount == filled:
-                    try:
-                        self.database.remove_stock_order_history(sell_order_number)
-                        self.debugger.info(
-                            '{} : 주문번호 - {} DB 삭제 성공, {} 에 {} 개만큼 매도했습니다'.format(stock_code, sell_order_number,
-                                                                                    filled_price, filled))
-                    except Exception as e:
-                        self.debugger.exception(
-                            '{} : 주문번호 - {} DB 에서 삭제하는데 실패했습니다, error - {}'.format(stock_code, sell_order_number, e))
-
-                    self.pending_sell_order_number_list.remove(sell_order_number)
-
-
-class KiwoomCatchConditionOrder(threading.Thread):
-    def __init__(self, command_q, database, debugger):
-        super().__init__()
-        self.command_q = command_q
-        self.database = database
-        self.debugger = debugger
+        # QAxWidget 은 메인 스레드에서 만들어야 하므로 broker 를 주지 않으면 여기서 생성
+        self.broker = broker if broker is not None else KiwoomBroker()
 
         self.stopped = threading.Event()
 
-        self.meet_real_conditions_history = list()
-        self.pending_buy_order_number_list = list()
-
     def stop(self):
         self.stopped.set()
 
     def run(self):
-        while not self.stopped.wait(1):
-            # 콜백 큐 만들고 command_q에 추가, 조건식 이벤트로 나온 종목들이 있는지 수시로 체크
-            get_condition_callback_queue = queue.Queue()
-            data = dict(command=Commands.GET_CONDITIONS)
-
-            self.command_q.put((get_condition_callback_queue, data))
-            try:
-                condition_stock_codes = get_condition_callback_queue.get(timeout=20)
-            except:
-                condition_stock_codes = list()
-
-            # 조건식 이벤트 받았다고 가정하는 테스트 코드 -->
-            # condition_stock_codes = ['005935']
-
-            # 매수기록과 새로 받아온 조건식 매치 종목들 비교
-            # 조건식 매치 종목이 매수기록에 없으면 이탈했다는 뜻, 해당 종목 매수기록에서 삭제
-            for stock_code in self.meet_real_conditions_history:
-                if stock_code not in condition_stock_codes:
-                    self.meet_real_conditions_history.remove(stock_code)
-                    self.debugger.info('{} : 해당 종목이 조건식에서 이탈했습니다'.format(stock_code))
-
-            # 조건식 이벤트 발생시 나온 종목들이 있는경우, 해당 종목들 시장가로 차례로 주문
-            if condition_stock_codes:
-                for stock_code in condition_stock_codes:
-                    # 매수기록에 조건식 매치 종목이 있으면 이미 매수 했다는 뜻
-                    if stock_code in self.meet_real_conditions_history:
-                        continue
-                    self.debugger.info('조건식에 맞는 종목을 캐치했습니다 - {}'.format(stock_code))
-
-                    # 몇 주 주문할지 계산하기 위해 현재가 가져오기
-                    get_current_price_callback_queue = queue.Queue()
-                    data = dict(command=Commands.GET_CURRENT_PRICE,
-                                stock_code=stock_code)
-
-                    self.command_q.put((get_current_price_callback_queue, data))
-                    try:
-                        current_price = get_current_price_callback_queue.get(timeout=20)
-                    except:
-                        current_price = None
-
-                    # 현재가 가져오는데 실패하면 다음 iteration 에 다시시도
-                    if not current_price:
-                        self.debugger.debug('{} : failed to get current price'.format(stock_code))
-                        continue
-
-                    # 매수금액(BUY_PRICE)을 1주당 현재가로 나눈 가격만큼 매수 주문
-                    order_amount = int(BUY_PRICE // current_price)
-                    self.debugger.info('{} : 주문 수량 - {}'.format(stock_code, order_amount))
-
-                    if order_amount == 0:
-                        self.debugger.info('{} : 주가가 매매금액을 초과하여 주문을 체결하지 않습니다'.format(stock_code))
-                        self.meet_real_conditions_history.append(stock_code)
-                        continue
-
-                    buy_callback_queue = queue.Queue()
-                    data = dict(command=Commands.BUY,
-                                account_num=ACCOUNT_NUM,
-                                stock_code=stock_code,
-                                qty=order_amount
-                                )
-                    self.debugger.info('{} : 해당 종목을 {} 개만큼 매수합니다'.format(stock_code, order_amount))
-
-                    self.command_q.put((buy_callback_queue, data))
-                    try:
-                        order_number = buy_callback_queue.get(timeout=20)
-                    except:
-                        order_number = None
-
-                    # 매수 후 주문번호 리턴값이 에러코드면 주문 실패, 다음 iteration 에 시도
-                    # 다음 종목코드로 넘어감
-                    if re.compile('[^0-9]').match(order_number) or not order_number:
-                        self.debugger.info('{} : 매수 주문 실패 {}'.format(stock_code, order_number))
-                        continue
-
-                    self.debugger.info('{} : 매수 주문 성공, 주문번호 - {}'.format(stock_code, order_number))
-                    self.pending_buy_order_number_list.append(order_number)
-
-                    # 매수 후 해당 종목 _meet_real_condition_history 에 기록해서 이탈 전 재구매 방지
-                    self.meet_real_conditions_history.append(stock_code)
-
-            # 주문체결번호 리스트 돌면서 체결된 주문 DB에 저장
-            for order_number in self.pending_buy_order_number_list:
-                time.sleep(2)
-                get_order_history_callback_queue = queue.Queue()
-                data = dict(command=Commands.GET_ORDER_HISTORY,
-                            order_number=order_number,
-                            )
-                self.debugger.debug('order number {} : started getting order history'.format(order_number))
-
-                self.command_q.put((get_order_history_callback_queue, data))
-                try:
-                    order_history = get_order_history_callback_queue.get(timeout=20)
-                except:
-                    continue
-
-                stock_code = order_history['stock_code']
-                order_amount = order_history['amount']
-                filled = order_history['filled']
-                filled_price = order_history['filled_price']
-
-                # 주문량과 체결량이 같을 때 DB 저장
-                if order_amount == filled:
-                    try:
-                        self.database.add_stock_order_history(order_number, stock_code, order_amount, filled_price)
-                        self.debugger.info(
-                            '{} : 주문번호 - {} DB 저장 성공, 해당 종목 {} 주를 {} 에 매수했습니다'.format(stock_code, order_number,
-                                                                                        order_amount, filled_price))
-
-                        self.pending_buy_order_number_list.remove(order_number)
-                    except Exception as e:
-                        self.debugger.exception(
-                            '{} : 주문번호 - {} 해당 종목을 DB에 저장하는데 실패했습니다, error - {}'.format(stock_code, order_number, e))
+        self.serve_commands()
 
 
 if __name__ == '__main__':
     try:
+        configure_debugger(json_log=LOG_JSON, levels=LOG_LEVELS)
         app = QtWidgets.QApplication([])
-        command_q = queue.Queue()
         stock_database = StockDatabase()
-        KiwoomConditionTrader()
+        # [샤드] 설정이 있으면 이 프로세스는 키움 게이트웨이만 맡고 매매는 샤드별 worker 프로세스가 함
+        trader = KiwoomShardGateway(SHARDS, stock_database.path) if SHARDS else KiwoomConditionTrader()
         app.exec_()
     except:
         debugger.exception("FATAL")
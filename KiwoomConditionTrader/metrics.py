@@ -0,0 +1,247 @@
+import bisect
+import os
+import threading
+import time
+
+# 지연시간 histogram 의 기본 bucket 경계(초), 0.1ms 부터 20초까지
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+# 한번에 처리한 개수 histogram 의 bucket 경계
+BURST_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class Counter(object):
+    __slots__ = ('lock', 'value')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Histogram(object):
+    """
+    고정 bucket histogram, observe() 는 bucket 위치를 찾아 count 만 올리므로 값 개수와 관계없이 메모리가 일정함
+    quantile() 은 해당 bucket 의 상한값(기록된 최대값을 넘지 않음)을 돌려주는 근사값
+    """
+
+    __slots__ = ('lock', 'buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        # 마지막 칸은 가장 큰 bucket 보다 큰 값(+Inf)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.count, self.sum, self.max
+
+    def quantile(self, q):
+        counts, count, _, maximum = self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return min(self.buckets[index], maximum) if index < len(self.buckets) else maximum
+        return maximum
+
+
+class MetricsRegistry(object):
+    """
+    이름과 label 별 Counter/Histogram/gauge 모음, 처음 쓰일 때 만들어짐, gauge 는 set_gauge 로 넣은 마지막 값
+    render_prometheus() 로 Prometheus text 형식, summary() 로 debugger 에 남길 한 줄 요약을 만듦
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict()
+        self.histograms = dict()
+        self.gauges = dict()
+        self.descriptions = dict()
+
+    def describe(self, name, description):
+        self.descriptions[name] = description
+
+    def counter(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        counter = self.counters.get(key)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(key, Counter())
+        return counter
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def inc(self, name, amount=1, **labels):
+        self.counter(name, **labels).inc(amount)
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        self.histogram(name, buckets, **labels).observe(value)
+
+    def set_gauge(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe_since(self, name, started_at, **labels):
+        """started_at(time.monotonic) 부터 지금까지 걸린 시간을 기록"""
+        self.histogram(name, **labels).observe(time.monotonic() - started_at)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.gauges.clear()
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        labels = list(labels) + list(extra)
+        if not labels:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels) + '}'
+
+    def render_prometheus(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+            gauges = sorted(self.gauges.items())
+
+        lines = list()
+        last_name = None
+        for (name, labels), counter in counters:
+            if name != last_name:
+                if name in self.descriptions:
+                    lines.append('# HELP {} {}'.format(name, self.descriptions[name]))
+                lines.append('# TYPE {} counter'.format(name))
+                last_name = name
+            lines.append('{}{} {}'.format(name, self.format_labels(labels), counter.value))
+
+        for (name, labels), histogram in histograms:
+            if name != last_name:
+                if name in self.descriptions:
+                    lines.append('# HELP {} {}'.format(name, self.descriptions[name]))
+                lines.append('# TYPE {} histogram'.format(name))
+                last_name = name
+            counts, count, total, _ = histogram.snapshot()
+            cumulative = 0
+            for bucket, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(name, self.format_labels(labels, [('le', bucket)]), cumulative))
+            lines.append('{}_bucket{} {}'.format(name, self.format_labels(labels, [('le', '+Inf')]), count))
+            lines.append('{}_sum{} {}'.format(name, self.format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(name, self.format_labels(labels), count))
+
+        for (name, labels), value in gauges:
+            if name != last_name:
+                if name in self.descriptions:
+                    lines.append('# HELP {} {}'.format(name, self.descriptions[name]))
+                lines.append('# TYPE {} gauge'.format(name))
+                last_name = name
+            lines.append('{}{} {}'.format(name, self.format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """histogram 별 count/p50/p99/max 와 gauge 값 한 줄 요약(_seconds 는 ms 로 표시), 기록이 없는 histogram 은 제외"""
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            gauges = sorted(self.gauges.items())
+
+        parts = list()
+        for (name, labels), histogram in histograms:
+            if not histogram.count:
+                continue
+            scale, unit = (1000, 'ms') if name.endswith('_seconds') else (1, '')
+            parts.append('{}{} n={} p50={:.1f}{unit} p99={:.1f}{unit} max={:.1f}{unit}'.format(
+                name, self.format_labels(labels), histogram.count, histogram.quantile(0.5) * scale,
+                histogram.quantile(0.99) * scale, histogram.max * scale, unit=unit))
+        for (name, labels), value in gauges:
+            parts.append('{}{} {}'.format(name, self.format_labels(labels), value))
+        return ' | '.join(parts)
+
+
+class MetricsReporter(threading.Thread):
+    """
+    interval 초마다 debugger 에 요약 한 줄을 남기고, export_path 가 있으면 Prometheus text 파일로 내보냄
+    (node_exporter textfile collector 등에서 읽어갈 수 있도록 임시 파일에 쓴 뒤 교체)
+    command_q(PriorityCommandQueue) 를 주면 남길 때마다 분류별 대기 요청 수를 trader_command_queue_depth 로 기록
+    """
+
+    def __init__(self, registry, debugger, interval=60, export_path=None, command_q=None):
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.debugger = debugger
+        self.interval = interval
+        self.export_path = export_path
+        self.command_q = command_q
+
+        self.stopped = threading.Event()
+
+    def stop(self, timeout=5):
+        """마지막 요약과 내보내기가 끝날 때까지 timeout 초 기다림, daemon 스레드라 기다리지 않으면 쓰던 임시 파일이 남을 수 있음"""
+        self.stopped.set()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(timeout)
+
+    def report(self):
+        if self.command_q is not None:
+            for command_class, depth in self.command_q.qsize_by_class().items():
+                self.registry.set_gauge('trader_command_queue_depth', depth, **{'class': command_class})
+
+        summary = self.registry.summary()
+        if summary:
+            self.debugger.info('metrics : {}', summary)
+
+        if self.export_path:
+            tmp_path = self.export_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.registry.render_prometheus())
+            os.replace(tmp_path, self.export_path)
+
+    def run(self):
+        # 멈출 때도 마지막으로 한번 더 남김
+        while True:
+            stopped = self.stopped.wait(self.interval)
+            try:
+                self.report()
+            except Exception as e:
+                self.debugger.exception('metrics 내보내기 실패, error - {}', e)
+            if stopped:
+                break
+
+
+metrics = MetricsRegistry()
+metrics.describe('trader_commands_total', 'command_q 에서 꺼낸 요청 수')
+metrics.describe('trader_command_errors_total', '실패한 요청 수')
+metrics.describe('trader_command_timeouts_total', 'command_q 에서 기다리다 timeout 된 요청 수')
+metrics.describe('trader_command_cancelled_total', '처리 전에 취소된 요청 수')
+metrics.describe('trader_command_queue_depth', 'command_q 에서 처리를 기다리는 분류별 요청 수')
+metrics.describe('trader_command_queue_wait_seconds', 'command_q 에 들어가서 꺼내질 때까지 걸린 시간')
+metrics.describe('trader_command_duration_seconds', 'broker(KiwoomAPIModule) 호출에 걸린 시간')
+metrics.describe('trader_condition_to_buy_order_seconds', '조건식 편입 종목 확인부터 매수주문번호 수신까지 걸린 시간')
+metrics.describe('trader_tick_to_sell_order_seconds', '실시간 체결가 수신부터 매도주문번호 수신까지 걸린 시간')
+metrics.describe('trader_condition_burst_size', '매수 스레드가 한번에 처리한 조건식 편입 종목 수')
+metrics.describe('trader_condition_hits_dropped_total', '편입 대기열이 가득 차서 버린 조건식 편입 수')
+metrics.describe('trader_db_commit_seconds', 'StockDatabase writer 스레드의 batch commit 시간')
+metrics.describe('trader_price_cache_requests_total', 'PriceCache 현재가 요청 종목 수 (hit, 조회 중인 요청에 합류 coalesced, 새로 조회 miss)')
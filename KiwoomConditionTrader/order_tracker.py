@@ -0,0 +1,139 @@
+import threading
+import time
+
+from concurrent.futures import Future
+
+
+class OrderState(object):
+    """주문 하나의 체결 상태, filled 는 누적 체결량, filled_cost 는 체결가 * 체결량의 누적"""
+
+    __slots__ = ('order_number', 'stock_code', 'amount', 'filled', 'filled_cost', 'future', 'tracked',
+                 'updated_at')
+
+    def __init__(self, order_number, now):
+        self.order_number = order_number
+        self.stock_code = None
+        self.amount = None
+        self.filled = 0
+        self.filled_cost = 0.0
+        self.future = Future()
+        self.tracked = False
+        self.updated_at = now
+
+    @property
+    def filled_price(self):
+        return self.filled_cost / self.filled if self.filled else 0
+
+    def order_history(self):
+        return dict(order_number=self.order_number,
+                    stock_code=self.stock_code,
+                    amount=self.amount,
+                    filled=self.filled,
+                    filled_price=self.filled_price)
+
+
+class OrderTracker(object):
+    """
+    체결(OnReceiveChejanData) 이벤트로 주문별 체결 상태를 추적하고, 전량 체결되면 주문번호별 Future 를 완료시킴
+    1. track() 은 주문번호의 Future 를 돌려주고, Future 결과는 GET_ORDER_HISTORY 와 같은 dict (filled_price 는 평균 체결가)
+    2. 체결 이벤트는 주문번호를 받기 전에 먼저 올 수도 있으므로 track() 전에 받은 이벤트도 기록해 둠
+    3. silent_seconds 동안 이벤트가 없는 주문만 silent_order_numbers() 로 골라 TR 조회(update_from_history)로 보완
+    """
+
+    def __init__(self, silent_seconds=5, untracked_expire_seconds=60, clock=time.monotonic):
+        self.silent_seconds = silent_seconds
+        self.untracked_expire_seconds = untracked_expire_seconds
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self.orders = dict()
+
+    def get_state(self, order_number):
+        state = self.orders.get(order_number)
+        if state is None:
+            state = self.orders[order_number] = OrderState(order_number, self.clock())
+        return state
+
+    def track(self, order_number, stock_code=None, amount=None):
+        with self.lock:
+            state = self.get_state(order_number)
+            state.tracked = True
+            state.updated_at = self.clock()
+            if state.stock_code is None:
+                state.stock_code = stock_code
+            if state.amount is None:
+                state.amount = amount
+            future = state.future
+            done = self.is_filled(state)
+        if done:
+            self.resolve(state)
+        return future
+
+    def on_chejan(self, order_number, stock_code, amount, filled, filled_price):
+        """
+        체결 이벤트 listener, filled 는 누적 체결량, filled_price 는 이번 체결의 체결가
+        누적 체결량이 늘어난 만큼만 체결가를 곱해서 평균 체결가를 계산함
+        """
+        with self.lock:
+            state = self.get_state(order_number)
+            state.updated_at = self.clock()
+            state.stock_code = stock_code or state.stock_code
+            state.amount = amount or state.amount
+            if filled > state.filled:
+                state.filled_cost += (filled - state.filled) * filled_price
+                state.filled = filled
+            done = state.tracked and self.is_filled(state)
+        if done:
+            self.resolve(state)
+
+    def update_from_history(self, order_number, order_history):
+        """TR 로 조회한 주문내역(GET_ORDER_HISTORY)으로 체결 상태를 보완, filled_price 는 평균 체결가로 취급"""
+        with self.lock:
+            state = self.get_state(order_number)
+            state.updated_at = self.clock()
+            state.stock_code = order_history['stock_code'] or state.stock_code
+            state.amount = order_history['amount'] or state.amount
+            if order_history['filled'] > state.filled:
+                state.filled = order_history['filled']
+                state.filled_cost = order_history['filled'] * order_history['filled_price']
+            done = state.tracked and self.is_filled(state)
+        if done:
+            self.resolve(state)
+
+    def is_filled(self, state):
+        return bool(state.amount) and state.filled >= state.amount
+
+    def resolve(self, state):
+        # 여러 스레드에서 동시에 전량 체결을 확인해도 장부에서 먼저 뺀 쪽만 Future 를 완료시킴
+        with self.lock:
+            if self.orders.get(state.order_number) is not state:
+                return
+            del self.orders[state.order_number]
+        state.future.set_result(state.order_history())
+
+    def untrack(self, order_number):
+        with self.lock:
+            state = self.orders.pop(order_number, None)
+        if state is not None:
+            state.future.cancel()
+
+    def silent_order_numbers(self, order_numbers):
+        """order_numbers 중 체결되지 않았고 silent_seconds 동안 이벤트가 없었던 주문번호"""
+        now = self.clock()
+        with self.lock:
+            # 추적하지 않는 주문(HTS 에서 직접 낸 주문 등)의 이벤트 기록은 오래되면 정리
+            for order_number in [order_number for order_number, state in self.orders.items()
+                                 if not state.tracked and now - state.updated_at > self.untracked_expire_seconds]:
+                del self.orders[order_number]
+
+            silent = list()
+            for order_number in order_numbers:
+                state = self.orders.get(order_number)
+                if state is not None and now - state.updated_at >= self.silent_seconds:
+                    silent.append(order_number)
+            return silent
+
+    def order_state(self, order_number):
+        with self.lock:
+            state = self.orders.get(order_number)
+            return state.order_history() if state is not None else None
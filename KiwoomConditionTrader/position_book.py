@@ -0,0 +1,239 @@
+import threading
+import time
+
+
+class Position(object):
+    """
+    매수 체결된 주문 하나, condition_stocks 테이블의 row 와 같은 값, bought_at 은 매수 체결 시각(time.time)
+    sell_amount 는 매도주문의 주문 수량, 보유 수량(amount)의 일부만 매도하는 주문도 있으므로 따로 기록
+    bought_amount 는 매수 체결 수량, 분할익절로 amount 가 줄어도 바뀌지 않으므로 재시작 후 분할익절 단계를 이어서 계산함
+    """
+
+    __slots__ = ('buy_order_number', 'stock_code', 'amount', 'price', 'sell_order_number', 'condition_name',
+                 'bought_at', 'sell_amount', 'bought_amount')
+
+    def __init__(self, buy_order_number, stock_code, amount, price, sell_order_number=None, condition_name=None,
+                 bought_at=None, sell_amount=None, bought_amount=None):
+        self.buy_order_number = buy_order_number
+        self.stock_code = stock_code
+        self.amount = amount
+        self.price = price
+        self.sell_order_number = sell_order_number
+        self.condition_name = condition_name
+        self.bought_at = bought_at
+        self.sell_amount = sell_amount
+        # 이전 버전 DB 의 주문은 매수 수량이 없으므로 지금 수량을 매수 수량으로 봄
+        self.bought_amount = bought_amount if bought_amount is not None else amount
+
+    def __repr__(self):
+        return 'Position({!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r})'.format(
+            self.buy_order_number, self.stock_code, self.amount, self.price, self.sell_order_number,
+            self.condition_name, self.bought_at, self.sell_amount, self.bought_amount)
+
+
+class PendingBuyOrder(object):
+    """주문번호를 받았지만 아직 전량 체결되지 않은 매수주문, pending_buy_orders 테이블의 row 와 같은 값"""
+
+    __slots__ = ('order_number', 'stock_code', 'amount', 'condition_name')
+
+    def __init__(self, order_number, stock_code, amount, condition_name=None):
+        self.order_number = order_number
+        self.stock_code = stock_code
+        self.amount = amount
+        self.condition_name = condition_name
+
+    def __repr__(self):
+        return 'PendingBuyOrder({!r}, {!r}, {!r}, {!r})'.format(self.order_number, self.stock_code, self.amount,
+                                                               self.condition_name)
+
+
+class PositionBook(object):
+    """
+    실행 중 보유 주문의 기준이 되는 메모리 장부, 시작할 때 DB 에서 한번만 읽어옴
+    1. 매수주문번호, 종목코드, 매도주문번호로 조회할 수 있도록 인덱스를 유지
+    2. 변경은 DB 쓰기 큐에 넣은 뒤(write-through) 메모리에 반영, commit 은 StockDatabase 의 writer 스레드가 모아서 함
+    3. 변경될 때마다 version 이 올라가므로 읽는 쪽에서 변경이 있을 때만 다시 계산할 수 있음
+    4. add_listener 로 등록한 listener 는 position_added / position_updated / position_removed 로 변경을 바로 받음
+    5. 체결 전 매수주문(PendingBuyOrder)도 함께 DB 에 남겨서 재시작할 때 복원할 수 있게 함, 장부 version 과는 무관함
+    6. condition_names 를 주면 그 조건식으로 매수한 주문만 읽어옴, 여러 worker 프로세스가 같은 DB 를 조건식별로 나눠 쓸 때 사용
+       조건식 이름 없이 저장된 주문을 읽으려면 condition_names 에 None 을 넣음
+    """
+
+    def __init__(self, database, condition_names=None):
+        self.database = database
+        self.condition_names = set(condition_names) if condition_names is not None else None
+
+        self.lock = threading.RLock()
+        self.positions = dict()
+        self.positions_by_stock_code = dict()
+        self.buy_order_numbers_by_sell_order_number = dict()
+        self.pending_buy_orders = dict()
+        self.version = 0
+        self.listeners = list()
+
+        self.load()
+
+    def add_listener(self, listener):
+        """listener 를 등록하고 지금 장부에 있는 주문들을 position_added 로 먼저 넘겨줌"""
+        with self.lock:
+            self.listeners.append(listener)
+            for position in self.positions.values():
+                listener.position_added(position)
+
+    def load(self):
+        with self.lock:
+            self.positions.clear()
+            self.positions_by_stock_code.clear()
+            self.buy_order_numbers_by_sell_order_number.clear()
+            for order_history in self.database.get_all_stock_order_history():
+                position = Position(*order_history)
+                if self.is_mine(position.condition_name):
+                    self.index(position)
+            self.pending_buy_orders.clear()
+            for pending_buy_order in self.database.get_all_pending_buy_orders():
+                pending_buy_order = PendingBuyOrder(*pending_buy_order)
+                if self.is_mine(pending_buy_order.condition_name):
+                    self.pending_buy_orders[pending_buy_order.order_number] = pending_buy_order
+            self.version += 1
+
+    def is_mine(self, condition_name):
+        return self.condition_names is None or condition_name in self.condition_names
+
+    def index(self, position):
+        self.positions[position.buy_order_number] = position
+        self.positions_by_stock_code.setdefault(position.stock_code, dict())[position.buy_order_number] = position
+        if position.sell_order_number:
+            self.buy_order_numbers_by_sell_order_number[position.sell_order_number] = position.buy_order_number
+
+    def unindex(self, position):
+        del self.positions[position.buy_order_number]
+        positions = self.positions_by_stock_code[position.stock_code]
+        del positions[position.buy_order_number]
+        if not positions:
+            del self.positions_by_stock_code[position.stock_code]
+        if position.sell_order_number:
+            self.buy_order_numbers_by_sell_order_number.pop(position.sell_order_number, None)
+
+    def add_pending_buy_order(self, order_number, stock_code, amount, condition_name=None):
+        with self.lock:
+            self.database.add_pending_buy_order(order_number, stock_code, amount, condition_name)
+            pending_buy_order = PendingBuyOrder(order_number, stock_code, amount, condition_name)
+            self.pending_buy_orders[order_number] = pending_buy_order
+            return pending_buy_order
+
+    def remove_pending_buy_order(self, order_number):
+        with self.lock:
+            self.database.remove_pending_buy_order(order_number)
+            return self.pending_buy_orders.pop(order_number, None)
+
+    def get_pending_buy_orders(self):
+        with self.lock:
+            return list(self.pending_buy_orders.values())
+
+    def add(self, buy_order_number, stock_code, amount, price, condition_name=None, bought_at=None):
+        """매수 체결된 주문을 장부에 추가하고, 체결 전 매수주문으로 남아있으면 함께 지움, bought_at 을 주지 않으면 지금 시각"""
+        if bought_at is None:
+            bought_at = time.time()
+        with self.lock:
+            self.database.add_stock_order_history(buy_order_number, stock_code, amount, price, condition_name,
+                                                  bought_at)
+            if self.pending_buy_orders.pop(buy_order_number, None) is not None:
+                self.database.remove_pending_buy_order(buy_order_number)
+            position = Position(buy_order_number, stock_code, amount, price, condition_name=condition_name,
+                                bought_at=bought_at)
+            self.index(position)
+            self.version += 1
+            for listener in self.listeners:
+                listener.position_added(position)
+            return position
+
+    def set_sell_order_number(self, buy_order_number, sell_order_number, sell_amount=None):
+        """sell_amount 를 주지 않으면 보유 수량 전량을 매도하는 주문"""
+        with self.lock:
+            position = self.positions[buy_order_number]
+            if sell_amount is None:
+                sell_amount = position.amount
+            self.database.add_sell_order_history(buy_order_number, sell_order_number, sell_amount)
+            if position.sell_order_number:
+                self.buy_order_numbers_by_sell_order_number.pop(position.sell_order_number, None)
+            position.sell_order_number = sell_order_number
+            position.sell_amount = sell_amount
+            self.buy_order_numbers_by_sell_order_number[sell_order_number] = buy_order_number
+            self.version += 1
+            for listener in self.listeners:
+                listener.position_updated(position)
+            return position
+
+    def remove_by_sell_order_number(self, sell_order_number):
+        with self.lock:
+            self.database.remove_stock_order_history(sell_order_number)
+            buy_order_number = self.buy_order_numbers_by_sell_order_number.get(sell_order_number)
+            if buy_order_number is None:
+                return None
+            position = self.positions[buy_order_number]
+            self.unindex(position)
+            self.version += 1
+            for listener in self.listeners:
+                listener.position_removed(position)
+            return position
+
+    def record_closed_trade(self, position, sell_order_number, amount, exit_price, sold_at=None):
+        """position 을 exit_price 에 amount 개 매도 체결한 거래를 ledger 에 기록, 장부는 바꾸지 않음"""
+        if sold_at is None:
+            sold_at = time.time()
+        return self.database.add_closed_trade(sell_order_number, position.buy_order_number, position.stock_code,
+                                              position.condition_name, amount, position.price, exit_price,
+                                              position.bought_at, sold_at)
+
+    def reopen(self, buy_order_number, amount):
+        """매도주문이 체결되지 않고 끝났을 때 매도주문번호를 지우고 남은 수량(amount)으로 다시 매도 대상이 되게 함"""
+        with self.lock:
+            self.database.reopen_stock_order_history(buy_order_number, amount)
+            position = self.positions[buy_order_number]
+            if position.sell_order_number:
+                self.buy_order_numbers_by_sell_order_number.pop(position.sell_order_number, None)
+            position.sell_order_number = None
+            position.sell_amount = None
+            position.amount = amount
+            self.version += 1
+            for listener in self.listeners:
+                listener.position_updated(position)
+            return position
+
+    def remove(self, buy_order_number):
+        """증권사 잔고에 없는 주문처럼 매도주문 없이 장부에서 빼야 하는 주문을 삭제"""
+        with self.lock:
+            self.database.remove_stock_order_history_by_buy_order_number(buy_order_number)
+            position = self.positions.get(buy_order_number)
+            if position is None:
+                return None
+            self.unindex(position)
+            self.version += 1
+            for listener in self.listeners:
+                listener.position_removed(position)
+            return position
+
+    def get(self, buy_order_number):
+        with self.lock:
+            return self.positions.get(buy_order_number)
+
+    def get_by_stock_code(self, stock_code):
+        with self.lock:
+            return list(self.positions_by_stock_code.get(stock_code, dict()).values())
+
+    def get_by_sell_order_number(self, sell_order_number):
+        with self.lock:
+            buy_order_number = self.buy_order_numbers_by_sell_order_number.get(sell_order_number)
+            return self.positions.get(buy_order_number) if buy_order_number is not None else None
+
+    def stock_codes(self):
+        with self.lock:
+            return list(self.positions_by_stock_code)
+
+    def all(self):
+        with self.lock:
+            return list(self.positions.values())
+
+    def __len__(self):
+        with self.lock:
+            return len(self.positions)
@@ -0,0 +1,112 @@
+import collections
+import threading
+import time
+
+from KiwoomConditionTrader.metrics import metrics
+
+
+class PriceCache(object):
+    """
+    종목별 최근 현재가 cache, 매수 수량 계산과 손익률 비교가 command_q 를 거치지 않고 현재가를 받을 수 있게 함
+    1. 실시간 체결가 이벤트(on_real_price, broker real price listener)와 조회 결과로 갱신하고, ttl 초가 지나면 사용하지 않음
+    2. cache 에 없는 종목은 get_prices 에 넘긴 request 로 한번에 조회함
+       같은 종목을 이미 다른 스레드가 조회 중이면 새로 요청하지 않고 그 요청의 결과를 함께 기다림 (single-flight)
+    3. max_size 종목을 넘으면 가장 오래 사용하지 않은 종목부터 버림 (LRU)
+    """
+
+    def __init__(self, command_client, ttl=1.0, max_size=1000, clock=time.monotonic):
+        self.command_client = command_client
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        # {종목코드: (현재가, 갱신 시각)}, 최근에 사용한 종목이 뒤쪽
+        self.entries = collections.OrderedDict()
+        # {종목코드: 조회 중인 요청 Future}
+        self.in_flight = dict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def on_real_price(self, stock_code, current_price):
+        """broker real price listener, 이벤트 스레드에서 불리므로 갱신만 함"""
+        if current_price:
+            with self.lock:
+                self.put(stock_code, current_price, self.clock())
+
+    def put(self, stock_code, current_price, updated_at):
+        # lock 을 잡은 상태에서 부름
+        self.entries[stock_code] = (current_price, updated_at)
+        self.entries.move_to_end(stock_code)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get_fresh(self, stock_code, now):
+        # lock 을 잡은 상태에서 부름
+        entry = self.entries.get(stock_code)
+        if entry is None or now - entry[1] > self.ttl:
+            return None
+        self.entries.move_to_end(stock_code)
+        return entry[0]
+
+    def get_prices(self, stock_code_list, request):
+        """
+        여러 종목의 현재가를 {종목코드: 현재가} 로 돌려줌, 현재가를 받지 못한 종목은 결과에 포함하지 않음
+        request(stock_code_list) 는 cache 에 없는 종목들을 한번에 조회하는 요청 Future({종목코드: 현재가}) 를 돌려줌
+        """
+        current_prices = dict()
+        # {종목코드: 다른 스레드가 먼저 보낸 요청 Future}
+        coalesced = dict()
+        stock_codes_to_request = list()
+        future = None
+
+        with self.lock:
+            now = self.clock()
+            for stock_code in dict.fromkeys(stock_code_list):
+                current_price = self.get_fresh(stock_code, now)
+                if current_price is not None:
+                    current_prices[stock_code] = current_price
+                elif stock_code in self.in_flight:
+                    coalesced[stock_code] = self.in_flight[stock_code]
+                else:
+                    stock_codes_to_request.append(stock_code)
+
+            # 요청과 조회 중 표시를 같은 lock 안에서 해야 다른 스레드가 같은 종목을 중복 요청하지 않음
+            if stock_codes_to_request:
+                future = request(stock_codes_to_request)
+                for stock_code in stock_codes_to_request:
+                    self.in_flight[stock_code] = future
+
+        metrics.inc('trader_price_cache_requests_total', len(current_prices), result='hit')
+        metrics.inc('trader_price_cache_requests_total', len(coalesced), result='coalesced')
+        metrics.inc('trader_price_cache_requests_total', len(stock_codes_to_request), result='miss')
+
+        if future is not None:
+            # 이미 끝난 Future 면 callback 이 바로 불리므로 lock 밖에서 등록
+            future.add_done_callback(lambda done: self.on_requested(stock_codes_to_request, done))
+            current_prices.update(self.command_client.result(future, default=None) or dict())
+
+        for stock_code, future in coalesced.items():
+            current_price = (self.command_client.result(future, default=None) or dict()).get(stock_code)
+            if current_price:
+                current_prices[stock_code] = current_price
+
+        return current_prices
+
+    def on_requested(self, stock_codes, future):
+        """조회 요청이 끝나면(성공, 실패, 취소) 결과를 cache 에 넣고 조회 중 표시를 지움"""
+        current_prices = dict()
+        if not future.cancelled() and future.exception() is None:
+            current_prices = future.result() or dict()
+
+        with self.lock:
+            now = self.clock()
+            for stock_code in stock_codes:
+                if self.in_flight.get(stock_code) is future:
+                    del self.in_flight[stock_code]
+                current_price = current_prices.get(stock_code)
+                # 조회하는 동안 실시간 체결가가 들어왔으면 그 값이 더 최신이므로 덮어쓰지 않음
+                entry = self.entries.get(stock_code)
+                if current_price and (entry is None or now - entry[1] > self.ttl):
+                    self.put(stock_code, current_price, now)
@@ -0,0 +1,56 @@
+from KiwoomConditionTrader.broker import REAL_STOCK_CODES_PER_SCREEN
+
+
+class RealRegistrationManager(object):
+    """
+    실시간 현재가 등록 종목을 화면번호별로 나누어 관리
+    1. 키움은 화면번호 하나에 최대 per_screen 종목까지 실시간 등록할 수 있으므로 빈 자리가 있는 앞쪽 화면번호부터 채움
+    2. sync() 에 지금 필요한 종목을 넘기면 새로 등록할 종목과 해지할 종목만 계산해서 돌려줌 (전체 재등록 없음)
+    3. 해지된 자리는 다음 등록 때 다시 사용
+    """
+
+    def __init__(self, first_screen_number=5000, screen_count=100, per_screen=REAL_STOCK_CODES_PER_SCREEN):
+        self.screen_numbers = [str(first_screen_number + i) for i in range(screen_count)]
+        self.per_screen = per_screen
+
+        # {종목코드: 화면번호}, {화면번호: 등록 종목 set}
+        self.stock_code_screens = dict()
+        self.screen_stock_codes = {screen_number: set() for screen_number in self.screen_numbers}
+
+    def __contains__(self, stock_code):
+        return stock_code in self.stock_code_screens
+
+    def __len__(self):
+        return len(self.stock_code_screens)
+
+    def allocate(self, stock_code):
+        for screen_number in self.screen_numbers:
+            stock_codes = self.screen_stock_codes[screen_number]
+            if len(stock_codes) < self.per_screen:
+                stock_codes.add(stock_code)
+                self.stock_code_screens[stock_code] = screen_number
+                return screen_number
+        raise ValueError('{} : 실시간 등록할 수 있는 화면번호가 남아있지 않습니다'.format(stock_code))
+
+    def release(self, stock_code):
+        screen_number = self.stock_code_screens.pop(stock_code)
+        self.screen_stock_codes[screen_number].discard(stock_code)
+        return screen_number
+
+    def sync(self, stock_codes):
+        """
+        stock_codes 만 등록된 상태가 되도록 변경
+        return : ({화면번호: 새로 등록할 종목 리스트}, {화면번호: 해지할 종목 리스트})
+        """
+        stock_codes = set(stock_codes)
+
+        unregister = dict()
+        for stock_code in [stock_code for stock_code in self.stock_code_screens if stock_code not in stock_codes]:
+            unregister.setdefault(self.release(stock_code), list()).append(stock_code)
+
+        register = dict()
+        for stock_code in sorted(stock_codes):
+            if stock_code not in self.stock_code_screens:
+                register.setdefault(self.allocate(stock_code), list()).append(stock_code)
+
+        return register, unregister
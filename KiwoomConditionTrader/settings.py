@@ -0,0 +1,119 @@
+import os
+import configparser
+
+from Util.debugger import *
+
+# Settings.ini 는 cp949 로 저장되어 있으므로 윈도우가 아닌 환경(헤드리스 시뮬레이션)에서도 읽을 수 있도록 인코딩을 지정
+# 모듈 옆의 Settings.ini 를 먼저 읽고, 실행 위치에 Settings.ini 가 있으면 그 값으로 덮어씀
+cfg = configparser.ConfigParser()
+# 조건식 이름을 키로 쓰는 섹션이 있으므로 대소문자를 그대로 유지
+cfg.optionxform = str
+cfg.read([os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Settings.ini'), 'Settings.ini'],
+         encoding='cp949')
+
+CONDITION_LIST = [x.strip() for x in cfg['조건식이름']['목록'].split(',')]
+ACCOUNT_NUM = cfg['계좌번호']['번호']
+BUY_PRICE = float(cfg['매매금액']['금액'])
+PROFIT_LIMIT = float(cfg['수익상한']['비율'])
+LOSS_LIMIT = -(float(cfg['손실하한']['비율']))
+
+if LOSS_LIMIT > 0:
+    debugger.exception('손실하한 비율은 음수가 될 수 없습니다')
+    raise Exception('손실하한 비율은 음수가 될 수 없습니다')
+
+# 조건식별 수익상한/손실하한, [조건식별손익률] 섹션에 "조건식이름 = 수익상한, 손실하한" 으로 설정
+# 설정하지 않은 조건식은 [수익상한], [손실하한] 값을 사용
+CONDITION_EXIT_LIMITS = dict()
+if cfg.has_section('조건식별손익률'):
+    for condition_name, limits in cfg.items('조건식별손익률'):
+        profit_limit, loss_limit = [float(x.strip()) for x in limits.split(',')]
+        if loss_limit < 0:
+            debugger.exception('{} : 손실하한 비율은 음수가 될 수 없습니다', condition_name)
+            raise Exception('손실하한 비율은 음수가 될 수 없습니다')
+        CONDITION_EXIT_LIMITS[condition_name] = (profit_limit, -loss_limit)
+
+
+def get_exit_limits(condition_name=None):
+    return CONDITION_EXIT_LIMITS.get(condition_name, (PROFIT_LIMIT, LOSS_LIMIT))
+
+
+# [청산규칙] 섹션으로 수익상한/손실하한 외의 청산 규칙을 추가, 0 이나 빈 값이면 사용하지 않음
+# 추적손절 = 고점 대비 하락률(%), 추적시작 = 고점이 매수가 대비 이 수익률(%) 이상일 때부터 추적손절 사용
+# 보유시간초 = 매수 체결 후 이 시간(초)이 지나면 매도
+# 분할익절 = "수익률:매도비율" 을 쉼표로 구분, 예) 1.0:0.5, 2.0:0.5 는 1% 에서 절반, 2% 에서 나머지를 매도
+#           분할익절을 설정하면 수익상한 대신 분할익절로 익절함
+TRAILING_STOP_PERCENT = cfg.getfloat('청산규칙', '추적손절', fallback=0)
+TRAILING_STOP_ACTIVATION_PERCENT = cfg.getfloat('청산규칙', '추적시작', fallback=0)
+TIME_STOP_SECONDS = cfg.getfloat('청산규칙', '보유시간초', fallback=0)
+TAKE_PROFIT_TIERS = list()
+for tier in cfg.get('청산규칙', '분할익절', fallback='').split(','):
+    if tier.strip():
+        rate, fraction = [float(x.strip()) for x in tier.split(':')]
+        if rate <= 0 or not 0 < fraction <= 1:
+            debugger.exception('{} : 분할익절 수익률은 양수, 매도비율은 0 초과 1 이하여야 합니다', tier.strip())
+            raise Exception('분할익절 수익률은 양수, 매도비율은 0 초과 1 이하여야 합니다')
+        TAKE_PROFIT_TIERS.append((rate, fraction))
+
+if TRAILING_STOP_PERCENT < 0 or TIME_STOP_SECONDS < 0:
+    debugger.exception('추적손절 비율과 보유시간은 음수가 될 수 없습니다')
+    raise Exception('추적손절 비율과 보유시간은 음수가 될 수 없습니다')
+
+# 주문마다 고점, 보유시간, 분할익절 단계 같은 상태가 필요한 규칙을 쓰는지 여부
+STATEFUL_EXIT_RULES = bool(TRAILING_STOP_PERCENT or TIME_STOP_SECONDS or TAKE_PROFIT_TIERS)
+
+
+# 구매 시 시장가 변수
+MARKET_PRICE = '03'
+
+# 실시간 체결가 이벤트로 바로 매도할지 여부, False 면 1초마다 현재가를 polling 해서 비교
+# 이벤트 방식이어도 REAL_PRICE_STALE_SECONDS 동안 체결가 이벤트가 없는 종목은 polling 으로 비교함
+REAL_PRICE_EVENT_DRIVEN = cfg.getboolean('실시간현재가', '이벤트방식', fallback=True)
+REAL_PRICE_STALE_SECONDS = cfg.getfloat('실시간현재가', 'polling기준초', fallback=10)
+
+# 체결 이벤트가 이 시간(초) 동안 오지 않은 주문만 TR 로 주문내역을 조회해서 체결 여부 확인
+ORDER_SILENT_SECONDS = cfg.getfloat('체결확인', '조회기준초', fallback=3)
+
+# 키움 초당 요청 제한, command_q 의 TokenBucket 으로 TR 조회와 주문을 각각 제한함
+TR_PER_SECOND = cfg.getfloat('요청제한', 'TR초당', fallback=5)
+ORDER_PER_SECOND = cfg.getfloat('요청제한', '주문초당', fallback=5)
+
+# 지연시간/요청수 metrics 요약을 debugger 에 남기는 주기(초)와 Prometheus text 형식으로 내보낼 파일(예: metrics.prom)
+# 내보내기파일을 설정하지 않으면 내보내지 않음
+METRICS_SUMMARY_SECONDS = cfg.getfloat('메트릭', '요약주기초', fallback=60)
+METRICS_EXPORT_PATH = cfg.get('메트릭', '내보내기파일', fallback='') or None
+
+# 실시간 체결가/조건식 편입이탈 이벤트를 날짜별 binary 파일로 기록할지 여부와 기록할 폴더
+TICK_RECORDING = cfg.getboolean('기록', '사용', fallback=False)
+TICK_RECORDING_DIRECTORY = cfg.get('기록', '폴더', fallback='recordings')
+
+# 조건식 편입은 이벤트로 받고, 이벤트로 받지 못한 편입 종목은 이 주기(초)마다 조건식 조회로 보완
+CONDITION_SYNC_SECONDS = cfg.getfloat('조건식', '조회주기초', fallback=60)
+# 매수 스레드가 처리하지 못한 편입 종목을 쌓아두는 최대 개수
+CONDITION_HIT_QUEUE_SIZE = cfg.getint('조건식', '편입대기열크기', fallback=1000)
+
+# 실시간 체결가나 조회로 받은 현재가를 이 시간(초) 동안 다시 조회하지 않고 사용, cache 에 남겨둘 최대 종목 수
+PRICE_CACHE_TTL_SECONDS = cfg.getfloat('현재가캐시', '유효초', fallback=1)
+PRICE_CACHE_SIZE = cfg.getint('현재가캐시', '최대종목수', fallback=1000)
+
+# 로그를 Debugger.jsonl 에 JSON lines 로도 남길지 여부
+# [로그레벨] 섹션에 "컴포넌트 = 레벨" 로 컴포넌트(buy, sell, command, condition, metrics)별 로그 레벨 설정
+LOG_JSON = cfg.getboolean('로그', 'JSON기록', fallback=False)
+LOG_LEVELS = dict(cfg.items('로그레벨')) if cfg.has_section('로그레벨') else dict()
+
+# [샤드] 섹션에 "샤드이름 = 계좌번호 / 조건식1, 조건식2" 로 설정하면 키움은 게이트웨이 프로세스 하나가 맡고,
+# 샤드마다 worker 프로세스를 띄워서 해당 계좌로 해당 조건식만 매매함, 계좌번호를 비우면 [계좌번호] 사용
+# 조건식 하나는 샤드 하나에만 넣을 수 있음
+SHARDS = dict()
+if cfg.has_section('샤드'):
+    sharded_condition_names = set()
+    for shard_name, shard in cfg.items('샤드'):
+        account_num, condition_names = shard.split('/', 1)
+        condition_list = [x.strip() for x in condition_names.split(',') if x.strip()]
+        if sharded_condition_names.intersection(condition_list):
+            debugger.exception('{} : 조건식 하나는 샤드 하나에만 넣을 수 있습니다', shard_name)
+            raise Exception('조건식 하나는 샤드 하나에만 넣을 수 있습니다')
+        sharded_condition_names.update(condition_list)
+        SHARDS[shard_name] = (account_num.strip() or ACCOUNT_NUM, condition_list)
+
+# worker 프로세스가 게이트웨이에 연결하는 localhost 포트, 0 이면 비어있는 포트를 사용
+GATEWAY_PORT = cfg.getint('게이트웨이', '포트', fallback=0)
@@ -0,0 +1,319 @@
+import argparse
+import collections
+import os
+import random
+import tempfile
+import threading
+import time
+
+from KiwoomConditionTrader.broker import Broker, CURRENT_PRICES_PER_REQUEST, REAL_STOCK_CODES_PER_SCREEN
+from KiwoomConditionTrader.database_connection import StockDatabase
+from KiwoomConditionTrader.settings import LOG_JSON, LOG_LEVELS
+from KiwoomConditionTrader.trader_threads import HeadlessConditionTrader
+from Util.debugger import *
+
+
+class SimulatedExchange(Broker):
+    """
+    키움 OCX 없이 매수/매도/Communicate Thread 전체를 돌려보기 위한 모의 거래소
+    1. 조건식 편입/이탈, 실시간 체결가(tick) 를 seed 기반 난수로 만들어 같은 seed 면 같은 순서의 이벤트를 재현
+    2. 주문은 fill_latency 간격으로 partial_fill_steps 번에 나누어 체결되고, 체결될 때마다 체결 이벤트를 보냄
+       chejan_drop_rate 확률로 체결 이벤트를 빠뜨려서 TR 조회로 보완하는 경로도 재현할 수 있음
+    3. start() 하면 백그라운드 스레드가 ticks_per_second 속도로 tick 을 만들고, step() 으로 직접 tick 을 만들 수도 있음
+    """
+
+    def __init__(self, stock_codes=None, seed=0, ticks_per_second=1000, condition_hit_rate=0.001,
+                 fill_latency=0.05, partial_fill_steps=1, tr_latency=0.0, order_latency=0.0,
+                 initial_price=10000, volatility=0.002, chejan_drop_rate=0.0):
+        self.stock_codes = stock_codes or ['{:06d}'.format(x) for x in range(1, 101)]
+        self.random = random.Random(seed)
+        self.ticks_per_second = ticks_per_second
+        self.condition_hit_rate = condition_hit_rate
+        self.fill_latency = fill_latency
+        self.partial_fill_steps = max(1, partial_fill_steps)
+        self.tr_latency = tr_latency
+        self.order_latency = order_latency
+        self.volatility = volatility
+        self.chejan_drop_rate = chejan_drop_rate
+        # 체결 이벤트 누락은 tick 순서에 영향을 주지 않도록 별도 난수 사용
+        self.chejan_random = random.Random(seed + 1)
+
+        self.prices = {stock_code: int(initial_price * self.random.uniform(0.5, 1.5))
+                       for stock_code in self.stock_codes}
+        self.condition_list = list()
+        # {종목코드: 편입된 조건식 이름}, 편입 순서를 유지하기 위해 dict 사용
+        self.condition_stock_codes = dict()
+        self.real_registered_stock_codes = set()
+        # {화면번호: 실시간 등록 종목 set}, 키움과 같이 화면번호 하나에 REAL_STOCK_CODES_PER_SCREEN 종목까지만 허용
+        self.real_screen_stock_codes = dict()
+        self.real_price_listeners = list()
+        self.orders = dict()
+        self.open_order_numbers = dict()
+        self.chejan_listeners = list()
+        self.condition_listeners = list()
+        self.last_order_number = 0
+        self.tick_count = 0
+        self.call_counts = collections.Counter()
+
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.tick_thread = None
+
+    @property
+    def is_connected(self):
+        return True
+
+    def start(self):
+        self.tick_thread = threading.Thread(target=self.run_ticks, daemon=True)
+        self.tick_thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run_ticks(self):
+        started_at = time.monotonic()
+        while not self.stopped.wait(0.01):
+            due = int((time.monotonic() - started_at) * self.ticks_per_second) - self.tick_count
+            if due > 0:
+                self.step(due)
+            self.emit_fills()
+
+    def step(self, tick_count=1):
+        real_prices = list()
+        condition_events = list()
+        with self.lock:
+            for _ in range(tick_count):
+                stock_code = self.random.choice(self.stock_codes)
+                price = self.prices[stock_code] * (1 + self.random.gauss(0, self.volatility))
+                self.prices[stock_code] = max(1, int(round(price)))
+                if stock_code in self.real_registered_stock_codes:
+                    real_prices.append((stock_code, self.prices[stock_code]))
+
+                # 조건식이 등록된 뒤에만 편입/이탈 이벤트 발생
+                if self.condition_list and self.random.random() < self.condition_hit_rate:
+                    stock_code = self.random.choice(self.stock_codes)
+                    if stock_code in self.condition_stock_codes:
+                        condition_events.append((stock_code, 'D', self.condition_stock_codes.pop(stock_code)))
+                    else:
+                        condition_name = self.random.choice(self.condition_list)
+                        self.condition_stock_codes[stock_code] = condition_name
+                        condition_events.append((stock_code, 'I', condition_name))
+            self.tick_count += tick_count
+
+        for listener in self.real_price_listeners:
+            for stock_code, price in real_prices:
+                listener(stock_code, price)
+
+        for listener in self.condition_listeners:
+            for condition_event in condition_events:
+                listener(*condition_event)
+
+    def register_conditions(self, condition_list):
+        self.call_counts['register_conditions'] += 1
+        with self.lock:
+            self.condition_list = list(condition_list)
+
+    def register_real_current_price(self, stock_code_list, screen_number):
+        self.call_counts['register_real_current_price'] += 1
+        with self.lock:
+            stock_codes = self.real_screen_stock_codes.setdefault(screen_number, set())
+            if len(stock_codes | set(stock_code_list)) > REAL_STOCK_CODES_PER_SCREEN:
+                raise ValueError('{} : 화면번호 하나에 실시간 등록할 수 있는 종목 수({})를 넘었습니다'.format(
+                    screen_number, REAL_STOCK_CODES_PER_SCREEN))
+            stock_codes.update(stock_code_list)
+            self.real_registered_stock_codes.update(stock_code_list)
+
+    def unregister_real_current_price(self, stock_code_list, screen_number):
+        self.call_counts['unregister_real_current_price'] += 1
+        with self.lock:
+            stock_codes = self.real_screen_stock_codes.get(screen_number, set())
+            stock_codes.difference_update(stock_code_list)
+            # 다른 화면에 남아있는 종목은 계속 실시간 체결가를 받음
+            still_registered = set().union(*self.real_screen_stock_codes.values())
+            self.real_registered_stock_codes.difference_update(
+                [stock_code for stock_code in stock_code_list if stock_code not in still_registered])
+
+    def add_real_price_listener(self, listener):
+        self.real_price_listeners.append(listener)
+
+    def add_chejan_listener(self, listener):
+        self.chejan_listeners.append(listener)
+
+    def add_condition_listener(self, listener):
+        self.condition_listeners.append(listener)
+
+    def filled_amount(self, order, now):
+        if self.fill_latency > 0:
+            filled_steps = min(self.partial_fill_steps, int((now - order['ordered_at']) / self.fill_latency))
+        else:
+            filled_steps = self.partial_fill_steps
+        return order['amount'] * filled_steps // self.partial_fill_steps
+
+    def emit_fills(self):
+        """지난 호출 이후 체결량이 늘어난 주문마다 체결 이벤트를 보냄"""
+        now = time.monotonic()
+        chejan_events = list()
+        with self.lock:
+            for order_number in list(self.open_order_numbers):
+                order = self.orders[order_number]
+                filled = self.filled_amount(order, now)
+                if filled <= order['reported_filled']:
+                    continue
+
+                order['reported_filled'] = filled
+                if filled >= order['amount']:
+                    del self.open_order_numbers[order_number]
+                if self.chejan_random.random() < self.chejan_drop_rate:
+                    continue
+                chejan_events.append((order_number, order['stock_code'], order['amount'], filled, order['price']))
+
+        for listener in self.chejan_listeners:
+            for chejan_event in chejan_events:
+                listener(*chejan_event)
+
+    def get_conditions(self, condition_list=None):
+        self.call_counts['get_conditions'] += 1
+        self.wait_tr()
+        with self.lock:
+            if condition_list is None:
+                return list(self.condition_stock_codes)
+            return [stock_code for stock_code, condition_name in self.condition_stock_codes.items()
+                    if condition_name in condition_list]
+
+    def get_current_price(self, stock_code):
+        self.call_counts['get_current_price'] += 1
+        self.wait_tr()
+        with self.lock:
+            return self.prices.get(stock_code)
+
+    def get_current_prices(self, stock_code_list):
+        # 관심종목정보요청과 같이 CURRENT_PRICES_PER_REQUEST 종목마다 TR 한번의 지연만 발생
+        stock_codes = list(dict.fromkeys(stock_code_list))
+        for _ in range(0, len(stock_codes), CURRENT_PRICES_PER_REQUEST):
+            self.call_counts['get_current_prices'] += 1
+            self.wait_tr()
+        with self.lock:
+            return {stock_code: self.prices[stock_code] for stock_code in stock_codes if stock_code in self.prices}
+
+    def get_real_current_price(self, stock_code):
+        self.call_counts['get_real_current_price'] += 1
+        with self.lock:
+            # 실시간 등록되지 않은 종목은 키움과 같이 현재가를 받을 수 없음
+            if stock_code not in self.real_registered_stock_codes:
+                return ''
+            return self.prices.get(stock_code)
+
+    def get_real_current_prices(self, stock_code_list):
+        self.call_counts['get_real_current_prices'] += 1
+        with self.lock:
+            return {stock_code: self.prices[stock_code] for stock_code in dict.fromkeys(stock_code_list)
+                    if stock_code in self.real_registered_stock_codes and stock_code in self.prices}
+
+    def get_order_history(self, order_number):
+        self.call_counts['get_order_history'] += 1
+        self.wait_tr()
+        with self.lock:
+            order = self.orders.get(order_number)
+            if order is None:
+                return None
+
+            return dict(stock_code=order['stock_code'],
+                        amount=order['amount'],
+                        filled=self.filled_amount(order, time.monotonic()),
+                        filled_price=order['price'])
+
+    def get_open_orders(self, account_num):
+        self.call_counts['get_open_orders'] += 1
+        self.wait_tr()
+        now = time.monotonic()
+        with self.lock:
+            return [order_number for order_number, order in self.orders.items()
+                    if self.filled_amount(order, now) < order['amount']]
+
+    def get_holdings(self, account_num):
+        self.call_counts['get_holdings'] += 1
+        self.wait_tr()
+        now = time.monotonic()
+        holdings = collections.Counter()
+        with self.lock:
+            for order in self.orders.values():
+                filled = self.filled_amount(order, now)
+                holdings[order['stock_code']] += filled if order['order_type'] == 'buy' else -filled
+        return {stock_code: amount for stock_code, amount in holdings.items() if amount > 0}
+
+    def buy_stock(self, account_num, stock_code, qty, trade_type):
+        self.call_counts['buy_stock'] += 1
+        return self.send_order('buy', stock_code, qty)
+
+    def sell_stock(self, account_num, stock_code, qty, trade_type):
+        self.call_counts['sell_stock'] += 1
+        return self.send_order('sell', stock_code, qty)
+
+    def send_order(self, order_type, stock_code, qty):
+        if self.order_latency:
+            time.sleep(self.order_latency)
+        with self.lock:
+            self.last_order_number += 1
+            order_number = '{:07d}'.format(self.last_order_number)
+            # 시장가 주문이므로 주문 시점의 현재가로 체결
+            self.orders[order_number] = dict(order_type=order_type,
+                                             stock_code=stock_code,
+                                             amount=qty,
+                                             price=self.prices[stock_code],
+                                             ordered_at=time.monotonic(),
+                                             reported_filled=0)
+            self.open_order_numbers[order_number] = True
+        return order_number
+
+    def wait_tr(self):
+        if self.tr_latency:
+            time.sleep(self.tr_latency)
+
+
+def run_simulation(seconds, exchange, database_path, recording_directory=None):
+    trader = HeadlessConditionTrader(exchange, StockDatabase(database_path), debugger,
+                                     recording_directory=recording_directory)
+    exchange.start()
+    trader.start()
+    time.sleep(seconds)
+    trader.stop()
+    exchange.stop()
+
+    debugger.info('시뮬레이션 {}초, tick {}개 ({:.0f} ticks/sec)', seconds, exchange.tick_count,
+                  exchange.tick_count / seconds)
+    for name, count in sorted(exchange.call_counts.items()):
+        debugger.info('{} : {}회 ({:.1f}/sec)', name, count, count / seconds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='키움 OCX 없이 모의 거래소로 매매 파이프라인 실행')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--symbols', type=int, default=100)
+    parser.add_argument('--ticks-per-second', type=int, default=5000)
+    parser.add_argument('--condition-hit-rate', type=float, default=0.001)
+    parser.add_argument('--fill-latency', type=float, default=0.05)
+    parser.add_argument('--partial-fill-steps', type=int, default=1)
+    parser.add_argument('--tr-latency', type=float, default=0.0)
+    parser.add_argument('--order-latency', type=float, default=0.0)
+    parser.add_argument('--chejan-drop-rate', type=float, default=0.0)
+    parser.add_argument('--record', help='실시간 체결가/조건식 이벤트를 기록할 폴더')
+    parser.add_argument('--database', help='장부/거래 기록 DB 파일, 없으면 임시 파일을 쓰고 지움')
+    args = parser.parse_args()
+    configure_debugger(json_log=LOG_JSON, levels=LOG_LEVELS)
+
+    simulated_exchange = SimulatedExchange(stock_codes=['{:06d}'.format(x) for x in range(1, args.symbols + 1)],
+                                           seed=args.seed,
+                                           ticks_per_second=args.ticks_per_second,
+                                           condition_hit_rate=args.condition_hit_rate,
+                                           fill_latency=args.fill_latency,
+                                           partial_fill_steps=args.partial_fill_steps,
+                                           tr_latency=args.tr_latency,
+                                           order_latency=args.order_latency,
+                                           chejan_drop_rate=args.chejan_drop_rate)
+    if args.database:
+        run_simulation(args.seconds, simulated_exchange, args.database, recording_directory=args.record)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run_simulation(args.seconds, simulated_exchange, os.path.join(tmp_dir, 'simulation.db'),
+                           recording_directory=args.record)
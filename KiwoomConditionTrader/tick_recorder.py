@@ -0,0 +1,224 @@
+import argparse
+import atexit
+import datetime
+import os
+import queue
+import struct
+import threading
+import time
+
+from Util.debugger import *
+
+# numpy 가 없어도 기록은 할 수 있고, 읽기(TickRecordingReader)에만 필요함
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EVENT_TICK = 0
+EVENT_CONDITION_INSERT = 1
+EVENT_CONDITION_DELETE = 2
+
+# 파일 앞의 header : magic, 버전, record 크기
+FILE_HEADER = struct.Struct('<4sHH')
+FILE_MAGIC = b'KCTR'
+FILE_VERSION = 1
+
+# record 하나 21 bytes : 수신 시각(epoch 초), 이벤트 종류, 종목코드(6자리), 조건식 id(tick 은 -1), 체결가(조건식 이벤트는 0)
+RECORD = struct.Struct('<dB6shi')
+if np is not None:
+    RECORD_DTYPE = np.dtype([('timestamp', '<f8'),
+                             ('kind', 'u1'),
+                             ('stock_code', 'S6'),
+                             ('condition_id', '<i2'),
+                             ('price', '<i4')])
+    assert RECORD_DTYPE.itemsize == RECORD.size
+
+
+def recording_paths(directory, date):
+    """날짜별 기록 파일과 조건식 이름 파일(한 줄에 하나, 줄 번호가 condition_id) 경로"""
+    name = date.strftime('%Y%m%d')
+    return os.path.join(directory, name + '.ticks'), os.path.join(directory, name + '.conditions')
+
+
+class TickRecorder(threading.Thread):
+    """
+    실시간 체결가와 조건식 편입/이탈 이벤트를 고정 길이 binary record 로 날짜별 파일에 이어서 기록
+    1. record_tick / record_condition 은 broker listener 로 등록되어 이벤트 스레드에서 불리므로 큐에 넣기만 함
+    2. 기록 스레드가 큐에 쌓인 이벤트를 모아서 한번에 struct 로 packing 해서 씀, 날짜가 바뀌면 새 파일로 넘어감
+    3. 조건식 이름은 같은 날짜의 .conditions 파일에 처음 나올 때 한 줄씩 추가하고 record 에는 번호만 기록
+    """
+
+    def __init__(self, directory='recordings', max_batch=4096, clock=time.time):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.max_batch = max_batch
+        self.clock = clock
+
+        self.event_q = queue.SimpleQueue()
+        self.date = None
+        self.file = None
+        self.conditions_file = None
+        self.condition_ids = dict()
+        self.record_count = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        atexit.register(self.stop)
+
+    def record_tick(self, stock_code, current_price):
+        self.event_q.put((self.clock(), EVENT_TICK, stock_code, current_price, None))
+
+    def record_condition(self, stock_code, event_type, condition_name):
+        kind = EVENT_CONDITION_INSERT if event_type == 'I' else EVENT_CONDITION_DELETE
+        self.event_q.put((self.clock(), kind, stock_code, 0, condition_name))
+
+    def stop(self):
+        if self.is_alive():
+            self.event_q.put(None)
+            self.join()
+
+    def open(self, date):
+        self.close()
+        path, conditions_path = recording_paths(self.directory, date)
+
+        # 같은 날 다시 시작한 경우 기존 파일 뒤에 이어서 기록
+        self.condition_ids = dict()
+        if os.path.exists(conditions_path):
+            with open(conditions_path, encoding='utf-8') as f:
+                for condition_name in f.read().splitlines():
+                    self.condition_ids[condition_name] = len(self.condition_ids)
+
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < FILE_HEADER.size:
+            self.file = open(path, 'wb')
+            self.file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, RECORD.size))
+        else:
+            # 기록 중 종료되어 잘린 record 가 있으면 잘라내고 record 경계부터 이어 씀
+            self.file = open(path, 'r+b')
+            self.file.truncate(size - (size - FILE_HEADER.size) % RECORD.size)
+            self.file.seek(0, os.SEEK_END)
+        self.conditions_file = open(conditions_path, 'a', encoding='utf-8')
+        self.date = date
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.conditions_file.close()
+            self.file = None
+            self.conditions_file = None
+
+    def condition_id(self, condition_name):
+        condition_id = self.condition_ids.get(condition_name)
+        if condition_id is None:
+            condition_id = self.condition_ids[condition_name] = len(self.condition_ids)
+            self.conditions_file.write(condition_name + '\n')
+            self.conditions_file.flush()
+        return condition_id
+
+    def write_batch(self, batch):
+        buffer = bytearray(RECORD.size * len(batch))
+        offset = 0
+        for timestamp, kind, stock_code, price, condition_name in batch:
+            date = datetime.date.fromtimestamp(timestamp)
+            if date != self.date:
+                if self.file is not None:
+                    self.file.write(buffer[:offset])
+                offset = 0
+                self.open(date)
+
+            condition_id = self.condition_id(condition_name) if condition_name else -1
+            RECORD.pack_into(buffer, offset, timestamp, kind, stock_code.encode('ascii'), condition_id, int(price))
+            offset += RECORD.size
+        self.file.write(buffer[:offset])
+        self.file.flush()
+        self.record_count += len(batch)
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            item = self.event_q.get()
+            batch = list()
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self.event_q.get_nowait()
+                except queue.Empty:
+                    break
+            stopped = item is None
+
+            if batch:
+                try:
+                    self.write_batch(batch)
+                except Exception as e:
+                    debugger.exception('tick 기록 실패, error - {}', e)
+        self.close()
+
+
+class TickRecordingReader(object):
+    """
+    TickRecorder 가 남긴 파일 하나를 mmap 으로 열어 column 을 numpy 배열(복사 없는 view)로 제공
+    기록 중인 파일도 열 수 있고, 마지막의 잘린 record 는 제외함
+    """
+
+    def __init__(self, path):
+        if np is None:
+            raise ImportError('TickRecordingReader 를 사용하려면 numpy 가 필요합니다')
+
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, record_size = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+        if magic != FILE_MAGIC or record_size != RECORD.size:
+            raise ValueError('{} : tick 기록 파일이 아닙니다'.format(path))
+
+        count = (os.path.getsize(path) - FILE_HEADER.size) // RECORD.size
+        if count:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=FILE_HEADER.size, shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+
+        conditions_path = os.path.splitext(path)[0] + '.conditions'
+        self.condition_names = list()
+        if os.path.exists(conditions_path):
+            with open(conditions_path, encoding='utf-8') as f:
+                self.condition_names = f.read().splitlines()
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def timestamps(self):
+        return self.records['timestamp']
+
+    @property
+    def kinds(self):
+        return self.records['kind']
+
+    @property
+    def stock_codes(self):
+        """종목코드 column, bytes(S6) 배열"""
+        return self.records['stock_code']
+
+    @property
+    def condition_ids(self):
+        return self.records['condition_id']
+
+    @property
+    def prices(self):
+        return self.records['price']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='tick 기록 파일 요약')
+    parser.add_argument('paths', nargs='+')
+    args = parser.parse_args()
+
+    for recording_path in args.paths:
+        reader = TickRecordingReader(recording_path)
+        ticks = reader.kinds == EVENT_TICK
+        debugger.info('{} : {} bytes, record {}개 (tick {}개, 조건식 이벤트 {}개), 종목 {}개, {} ~ {}',
+                      recording_path, os.path.getsize(recording_path), len(reader), int(ticks.sum()),
+                      int((~ticks).sum()), len(np.unique(reader.stock_codes)),
+                      datetime.datetime.fromtimestamp(reader.timestamps[0]) if len(reader) else '-',
+                      datetime.datetime.fromtimestamp(reader.timestamps[-1]) if len(reader) else '-')
@@ -0,0 +1,172 @@
+import argparse
+import csv
+import datetime
+import time
+
+from KiwoomConditionTrader.database_connection import CLOSED_TRADE_COLUMNS, StockDatabase
+from Util.debugger import *
+
+# parquet 으로 내보낼 때만 필요하고, 없으면 csv 로만 내보낼 수 있음
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+LEDGER_FIELDS = [column.strip() for column in CLOSED_TRADE_COLUMNS.split(',')]
+
+
+def parse_date(value):
+    """'2024-01-31' 또는 '20240131' 을 YYYYMMDD 정수로, 없으면 None"""
+    if not value:
+        return None
+    return int(value.replace('-', ''))
+
+
+def split_by_trade_date(batches):
+    """iter_closed_trades 의 batch 를 trade_date 별 (trade_date, rows) 로 나눔, row 는 trade_date 순서로 들어옴"""
+    for rows in batches:
+        start = 0
+        for i in range(1, len(rows) + 1):
+            if i == len(rows) or rows[i][0] != rows[start][0]:
+                yield rows[start][0], rows[start:i]
+                start = i
+
+
+class CsvLedgerWriter(object):
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(LEDGER_FIELDS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetLedgerWriter(object):
+    """batch 하나를 row group 하나로 씀"""
+
+    def __init__(self, path):
+        if pq is None:
+            raise ImportError('parquet 으로 내보내려면 pyarrow 가 필요합니다')
+        self.schema = pa.schema([
+            ('trade_date', pa.int32()), ('sell_order_number', pa.string()), ('buy_order_number', pa.string()),
+            ('stock_code', pa.string()), ('condition_name', pa.string()), ('amount', pa.int64()),
+            ('entry_price', pa.float64()), ('exit_price', pa.float64()), ('bought_at', pa.float64()),
+            ('sold_at', pa.float64()), ('realized_pnl', pa.float64())])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, self.schema)], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+LEDGER_WRITERS = {'csv': CsvLedgerWriter, 'parquet': ParquetLedgerWriter}
+
+
+def export_ledger(database, path, file_format='csv', start_date=None, end_date=None, by_date=False,
+                  batch_size=10000):
+    """
+    closed_trades 를 batch_size 개씩 읽어서 바로 파일에 쓰므로 ledger 크기와 상관없이 메모리는 batch 하나 만큼만 사용
+    by_date 면 path 를 폴더로 보고 trade_date=YYYYMMDD/trades.<format> 로 날짜별 파일에 나누어 씀
+    return : 내보낸 거래 수
+    """
+    writer_class = LEDGER_WRITERS[file_format]
+    batches = database.iter_closed_trades(start_date, end_date, batch_size)
+    count = 0
+
+    if not by_date:
+        writer = writer_class(path)
+        try:
+            for rows in batches:
+                writer.write(rows)
+                count += len(rows)
+        finally:
+            writer.close()
+        return count
+
+    writer = None
+    current_date = None
+    try:
+        for trade_date, rows in split_by_trade_date(batches):
+            if trade_date != current_date:
+                if writer is not None:
+                    writer.close()
+                directory = os.path.join(path, 'trade_date={}'.format(trade_date))
+                os.makedirs(directory, exist_ok=True)
+                writer = writer_class(os.path.join(directory, 'trades.{}'.format(file_format)))
+                current_date = trade_date
+            writer.write(rows)
+            count += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def log_daily_pnl(daily_pnl):
+    total_trades = total_wins = 0
+    total_pnl = 0.0
+    for trade_date, condition_name, trades, wins, pnl in daily_pnl:
+        debugger.info('{} {:<20} 거래 {:>6} 승률 {:>6.1%} 실현손익 {:>14,.0f}', trade_date, condition_name or '',
+                      trades, wins / trades, pnl)
+        total_trades += trades
+        total_wins += wins
+        total_pnl += pnl
+    if total_trades:
+        debugger.info('합계 {:<20} 거래 {:>6} 승률 {:>6.1%} 실현손익 {:>14,.0f}', '', total_trades,
+                      total_wins / total_trades, total_pnl)
+
+
+def log_closed_trades(closed_trades):
+    for row in closed_trades:
+        trade = dict(zip(LEDGER_FIELDS, row))
+        debugger.info('{} {} : {} 주 {} -> {}, 실현손익 {:,.0f}, 보유 {}', trade['trade_date'], trade['stock_code'],
+                      trade['amount'], trade['entry_price'], trade['exit_price'], trade['realized_pnl'],
+                      datetime.timedelta(seconds=round(trade['sold_at'] - trade['bought_at']))
+                      if trade['bought_at'] else '-')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='매도 체결 ledger(closed_trades) 조회와 내보내기')
+    parser.add_argument('--database', default='stock_order_history.db')
+    parser.add_argument('--from', dest='start_date', help='시작일(포함), 2024-01-31 또는 20240131')
+    parser.add_argument('--to', dest='end_date', help='종료일(포함)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    daily_parser = subparsers.add_parser('daily', help='일별 실현손익')
+    daily_parser.add_argument('--by-condition', action='store_true', help='조건식별로 나누어 집계')
+
+    symbol_parser = subparsers.add_parser('symbol', help='종목의 거래 내역')
+    symbol_parser.add_argument('stock_code')
+
+    export_parser = subparsers.add_parser('export', help='csv/parquet 로 내보내기')
+    export_parser.add_argument('output')
+    export_parser.add_argument('--format', choices=sorted(LEDGER_WRITERS), default='csv')
+    export_parser.add_argument('--by-date', action='store_true', help='output 폴더에 날짜별 파일로 나누어 씀')
+    export_parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+    if args.command == 'export' and args.format == 'parquet' and pq is None:
+        parser.error('parquet 으로 내보내려면 pyarrow 가 필요합니다')
+
+    stock_database = StockDatabase(args.database)
+    start_date, end_date = parse_date(args.start_date), parse_date(args.end_date)
+
+    started_at = time.perf_counter()
+    if args.command == 'daily':
+        log_daily_pnl(stock_database.get_daily_pnl(start_date, end_date, by_condition=args.by_condition))
+    elif args.command == 'symbol':
+        log_closed_trades(stock_database.get_closed_trades_by_stock_code(args.stock_code, start_date, end_date))
+    else:
+        exported = export_ledger(stock_database, args.output, args.format, start_date, end_date, args.by_date,
+                                 args.batch_size)
+        debugger.info('{} 건을 {} 로 내보냈습니다', exported, args.output)
+    debugger.info('{:.3f}초', time.perf_counter() - started_at)
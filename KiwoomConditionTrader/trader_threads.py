@@ -0,0 +1,1022 @@
+import threading
+import queue
+import re
+import time
+
+from enum import Enum
+from KiwoomConditionTrader.broker import CURRENT_PRICES_PER_REQUEST
+from KiwoomConditionTrader.command_client import CommandClient
+from KiwoomConditionTrader.command_scheduler import PriorityCommandQueue, TokenBucket
+from KiwoomConditionTrader.condition_tracker import ConditionTracker
+from KiwoomConditionTrader.exit_rules import BandExit, ExitRuleEngine, TieredTakeProfit, TimeStop, TrailingStop
+from KiwoomConditionTrader.metrics import BURST_SIZE_BUCKETS, MetricsReporter, metrics
+from KiwoomConditionTrader.order_tracker import OrderTracker
+from KiwoomConditionTrader.position_book import PositionBook
+from KiwoomConditionTrader.price_cache import PriceCache
+from KiwoomConditionTrader.real_registration import RealRegistrationManager
+from KiwoomConditionTrader.tick_recorder import TickRecorder
+from KiwoomConditionTrader.settings import *
+
+# numpy 가 없으면 ExitEvaluator 없이 종목별로 손익률을 비교함
+try:
+    from KiwoomConditionTrader.exit_evaluator import ExitEvaluator
+except ImportError:
+    ExitEvaluator = None
+
+
+class Commands(Enum):
+    SELL = 'sell'
+    BUY = 'buy'
+    APPLY_CONDITION = 'apply_condition'
+    GET_CURRENT_PRICE = 'get_current_price'
+    GET_CURRENT_PRICES = 'get_current_prices'
+    GET_REAL_CURRENT_PRICE = 'get_real_current_price'
+    GET_REAL_CURRENT_PRICES = 'get_real_current_prices'
+    GET_CONDITIONS = 'get_conditions'
+    GET_ORDER_HISTORY = 'get_order_history'
+    GET_OPEN_ORDERS = 'get_open_orders'
+    GET_HOLDINGS = 'get_holdings'
+    REGISTER_CONDITION = 'register_condition'
+    REGISTER_REAL_CURRENT_PRICE = 'register_real_current_price'
+    UNREGISTER_REAL_CURRENT_PRICE = 'unregister_real_current_price'
+    CANCEL_SELL_STOCK = 'cancel_sell_stock'
+
+
+# command_q 우선순위 분류, 매도 > 보유 종목 실시간 등록 > 매수 > 등록 > 현재가 조회 > 주문내역/조건식 조회 순서로 처리
+# 보유 종목 실시간 등록은 재시작 직후 조건식 등록보다 먼저 처리되어야 매도 감시가 바로 시작됨
+COMMAND_CLASSES = {
+    Commands.SELL: 'sell',
+    Commands.CANCEL_SELL_STOCK: 'sell',
+    Commands.REGISTER_REAL_CURRENT_PRICE: 'protect',
+    Commands.UNREGISTER_REAL_CURRENT_PRICE: 'protect',
+    Commands.BUY: 'buy',
+    Commands.REGISTER_CONDITION: 'register',
+    Commands.APPLY_CONDITION: 'register',
+    Commands.GET_REAL_CURRENT_PRICE: 'price',
+    Commands.GET_REAL_CURRENT_PRICES: 'price',
+    Commands.GET_CURRENT_PRICE: 'price',
+    Commands.GET_CURRENT_PRICES: 'price',
+    Commands.GET_CONDITIONS: 'history',
+    Commands.GET_ORDER_HISTORY: 'history',
+    Commands.GET_OPEN_ORDERS: 'history',
+    Commands.GET_HOLDINGS: 'history',
+}
+COMMAND_CLASS_ORDER = ['sell', 'protect', 'buy', 'register', 'price', 'history']
+
+# 키움 초당 요청 제한을 받는 명령, 주문과 TR 조회는 각각 다른 TokenBucket 을 사용
+# GET_CURRENT_PRICES 는 요청할 때 rate_cost 로 실제 TR 요청 수를 넘김
+COMMAND_RATE_LIMITS = {
+    Commands.SELL: 'order',
+    Commands.CANCEL_SELL_STOCK: 'order',
+    Commands.BUY: 'order',
+    Commands.GET_CURRENT_PRICE: 'tr',
+    Commands.GET_CURRENT_PRICES: 'tr',
+    Commands.GET_ORDER_HISTORY: 'tr',
+    Commands.GET_OPEN_ORDERS: 'tr',
+    Commands.GET_HOLDINGS: 'tr',
+}
+
+
+def create_command_queue():
+    return PriorityCommandQueue(COMMAND_CLASSES,
+                                COMMAND_CLASS_ORDER,
+                                rate_limits=COMMAND_RATE_LIMITS,
+                                buckets=dict(order=TokenBucket(ORDER_PER_SECOND),
+                                             tr=TokenBucket(TR_PER_SECOND)))
+
+
+# Commands 별 처리 함수, CommandDispatcher 메서드에 command_handler 데코레이터로 등록
+COMMAND_HANDLERS = dict()
+
+# 명령별 요청 timeout(초), 지나면 Communicate Thread 가 처리하지 않고 TimeoutError 로 끝냄
+COMMAND_TIMEOUTS = {
+    Commands.REGISTER_CONDITION: None,
+    Commands.REGISTER_REAL_CURRENT_PRICE: None,
+    Commands.UNREGISTER_REAL_CURRENT_PRICE: None,
+    Commands.GET_REAL_CURRENT_PRICE: 5,
+    Commands.GET_REAL_CURRENT_PRICES: 5,
+}
+
+
+def command_handler(command):
+    def register(handler):
+        COMMAND_HANDLERS[command] = handler
+        return handler
+    return register
+
+
+def create_command_client(command_q):
+    return CommandClient(command_q, timeouts=COMMAND_TIMEOUTS, default_timeout=20)
+
+
+# 매수 수량, 손익률 계산은 실매매 스레드와 backtest 가 같은 함수를 사용
+def calculate_order_amount(buy_price, current_price):
+    """매수금액을 1주당 현재가로 나눈 주문 수량"""
+    return int(buy_price // current_price)
+
+
+def calculate_earning_rate(current_price, price):
+    """매수가 대비 현재가 손익률(%), 매수가가 0 이면 ZeroDivisionError"""
+    return ((current_price / price) - 1) * 100
+
+
+def is_out_of_limits(earning_rate, profit_limit, loss_limit):
+    """손익률이 손실하한과 수익상한 사이를 벗어났으면 매도"""
+    return not (loss_limit < earning_rate < profit_limit)
+
+
+def build_exit_rules(profit_limit, loss_limit, trailing_stop_percent=TRAILING_STOP_PERCENT,
+                     trailing_stop_activation_percent=TRAILING_STOP_ACTIVATION_PERCENT,
+                     time_stop_seconds=TIME_STOP_SECONDS, take_profit_tiers=TAKE_PROFIT_TIERS):
+    """주문 하나에 적용할 청산 규칙 list, 앞쪽 규칙부터 비교, backtest 는 [청산규칙] 대신 sweep 파라미터를 넘김"""
+    rules = [BandExit(profit_limit, loss_limit, take_profit=not take_profit_tiers)]
+    if trailing_stop_percent:
+        rules.append(TrailingStop(trailing_stop_percent, trailing_stop_activation_percent))
+    if time_stop_seconds:
+        rules.append(TimeStop(time_stop_seconds))
+    if take_profit_tiers:
+        rules.append(TieredTakeProfit(take_profit_tiers))
+    return rules
+
+
+def create_exit_rules(condition_name=None):
+    """조건식별 수익상한/손실하한과 [청산규칙] 설정으로 주문 하나에 적용할 청산 규칙 list"""
+    return build_exit_rules(*get_exit_limits(condition_name))
+
+
+class CommandDispatcher(object):
+    """
+    command_q 에서 (Future, data) 를 꺼내 COMMAND_HANDLERS 에 등록된 처리 함수로 broker 에 요청하고 결과를 Future 에 담아 돌려주는 루프
+    키움 OCX 를 쓰는 KiwoomCommunicateThread(QThread) 와 헤드리스 CommunicateThread 가 함께 사용함
+    """
+
+    def dispatch(self, data):
+        handler = COMMAND_HANDLERS.get(data['command'])
+        if handler is None:
+            raise ValueError('{} : 처리할 수 없는 명령입니다'.format(data['command']))
+        return handler(self, data)
+
+    @command_handler(Commands.REGISTER_CONDITION)
+    def handle_register_condition(self, data):
+        self.broker.register_conditions(data['condition_list'])
+
+    @command_handler(Commands.REGISTER_REAL_CURRENT_PRICE)
+    def handle_register_real_current_price(self, data):
+        self.broker.register_real_current_price(data['stock_code_list'], data['screen_number'])
+
+    @command_handler(Commands.UNREGISTER_REAL_CURRENT_PRICE)
+    def handle_unregister_real_current_price(self, data):
+        self.broker.unregister_real_current_price(data['stock_code_list'], data['screen_number'])
+
+    @command_handler(Commands.GET_CONDITIONS)
+    def handle_get_conditions(self, data):
+        return self.broker.get_conditions(data.get('condition_list'))
+
+    @command_handler(Commands.GET_CURRENT_PRICE)
+    def handle_get_current_price(self, data):
+        return self.broker.get_current_price(data['stock_code'])
+
+    @command_handler(Commands.GET_CURRENT_PRICES)
+    def handle_get_current_prices(self, data):
+        return self.broker.get_current_prices(data['stock_code_list'])
+
+    @command_handler(Commands.GET_REAL_CURRENT_PRICE)
+    def handle_get_real_current_price(self, data):
+        return self.broker.get_real_current_price(data['stock_code'])
+
+    @command_handler(Commands.GET_REAL_CURRENT_PRICES)
+    def handle_get_real_current_prices(self, data):
+        return self.broker.get_real_current_prices(data['stock_code_list'])
+
+    @command_handler(Commands.GET_ORDER_HISTORY)
+    def handle_get_order_history(self, data):
+        return self.broker.get_order_history(data['order_number'])
+
+    @command_handler(Commands.GET_OPEN_ORDERS)
+    def handle_get_open_orders(self, data):
+        return self.broker.get_open_orders(data['account_num'])
+
+    @command_handler(Commands.GET_HOLDINGS)
+    def handle_get_holdings(self, data):
+        return self.broker.get_holdings(data['account_num'])
+
+    @command_handler(Commands.BUY)
+    def handle_buy(self, data):
+        return self.broker.buy_stock(data['account_num'],
+                                     data['stock_code'],
+                                     data['qty'],
+                                     trade_type=MARKET_PRICE
+                                     )
+
+    @command_handler(Commands.SELL)
+    def handle_sell(self, data):
+        return self.broker.sell_stock(data['account_num'],
+                                      data['stock_code'],
+                                      data['qty'],
+                                      trade_type=MARKET_PRICE
+                                      )
+
+    def serve_commands(self):
+        while not self.broker.is_connected:
+            time.sleep(0.1)
+
+        while not self.stopped.is_set():
+            try:
+                future, data = self.command_q.get(True, 30)
+            except queue.Empty:
+                continue
+
+            command = data['command'].value
+            started_at = time.monotonic()
+            metrics.inc('trader_commands_total', command=command)
+            if 'requested_at' in data:
+                metrics.observe('trader_command_queue_wait_seconds', started_at - data['requested_at'],
+                                command=command)
+
+            # 요청한 쪽에서 이미 취소한 요청은 처리하지 않음
+            if not future.set_running_or_notify_cancel():
+                metrics.inc('trader_command_cancelled_total', command=command)
+                continue
+
+            # timeout 이 지난 요청은 broker 에 보내지 않음
+            if data.get('deadline') is not None and started_at > data['deadline']:
+                metrics.inc('trader_command_timeouts_total', command=command)
+                future.set_exception(TimeoutError('request {} : {} timed out in command_q'.format(
+                    data['request_id'], data['command'])))
+                continue
+
+            try:
+                result = self.dispatch(data)
+            except Exception as e:
+                metrics.inc('trader_command_errors_total', command=command)
+                self.debugger.exception('request {} : {} failed, error - {}', data.get('request_id'), data['command'], e,
+                                        extra=dict(command=command, stock_code=data.get('stock_code'),
+                                                   order_number=data.get('order_number')))
+                future.set_exception(e)
+                continue
+            finally:
+                metrics.observe_since('trader_command_duration_seconds', started_at, command=command)
+            future.set_result(result)
+
+
+class CommunicateThread(CommandDispatcher, threading.Thread):
+    """
+    QThread 없이 동작하는 Communicate Thread, SimulatedExchange 와 같은 broker 로 리눅스에서 헤드리스로 실행할 때 사용
+    """
+
+    def __init__(self, command_q, broker, debugger):
+        super().__init__(daemon=True)
+        self.command_q = command_q
+        self.broker = broker
+        self.debugger = debugger
+
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        self.serve_commands()
+
+
+class KiwoomCheckRealCurrentPrice(threading.Thread):
+    """
+    1. 장부(PositionBook)에 있는 매수 체결된 종목들 실시간 현재가 이벤트 받기 등록
+       RealRegistrationManager 로 새로 들어온 종목만 추가 등록하고, 장부에서 빠진 종목은 등록 해지함
+    2. 실시간 현재가로 주문마다 compile 된 청산 규칙(ExitRuleEngine)을 갱신하고, 매도 조건에 맞으면 규칙이 정한 수량만큼 매도
+       수익상한/손실하한 외에 [청산규칙] 의 추적손절, 보유시간, 분할익절을 함께 사용
+       매도주문의 체결은 OrderTracker 의 체결 이벤트로 확인하고, 전량 매도면 장부/DB에서 삭제, 일부 매도면 남은 수량으로 바꿈
+    3. event_driven 이면 손익률 비교는 KiwoomRealPriceSellTrigger 가 실시간 체결가 이벤트마다 하고,
+       real_price_stale_seconds 동안 체결가 이벤트가 오지 않은 종목만 이 루프에서 polling 으로 비교함
+    4. 상태가 필요한 청산 규칙이 없으면 polling 비교는 ExitEvaluator 로 현재가 스냅샷 하나에 대해 모든 주문의 손익률을 한번에 계산함
+       수익상한/손실하한은 주문의 조건식 이름별 설정(get_exit_limits)을 따름
+    5. polling 현재가는 PriceCache 에 최근 현재가가 없는 종목만 GET_REAL_CURRENT_PRICES 로 조회함
+    6. 시작하면 기다리지 않고 장부 종목을 실시간 등록한 뒤, DB 에 남은 매도주문과 장부를 증권사 미체결/잔고와 맞춤
+    7. 매도 주문과 미체결/잔고 조회는 account_num 계좌로 함
+    8. 매도주문이 실패한(주문번호를 받지 못한) 주문은 sell_retry_seconds 동안 다시 매도하지 않음
+       실패하는 종목이 체결가 이벤트마다 매도주문을 보내서 다른 주문의 매도에 쓸 주문 token 을 쓰지 않도록 함
+    """
+
+    def __init__(self, command_client, position_book, order_tracker, debugger, event_driven=False,
+                 real_price_stale_seconds=10, price_cache=None, account_num=ACCOUNT_NUM, sell_retry_seconds=1.0):
+        super().__init__()
+        self.command_client = command_client
+        self.account_num = account_num
+        self.price_cache = price_cache if price_cache is not None else PriceCache(command_client)
+        self.position_book = position_book
+        self.order_tracker = order_tracker
+        self.debugger = debugger
+        self.event_driven = event_driven
+        self.real_price_stale_seconds = real_price_stale_seconds
+        self.sell_retry_seconds = sell_retry_seconds
+
+        self.stopped = threading.Event()
+
+        self.real_registration = RealRegistrationManager()
+        self.position_book_version = None
+        self.pending_sell_order_number_list = list()
+        for position in position_book.all():
+            if position.sell_order_number:
+                self.track_sell_order(position.sell_order_number, position.stock_code,
+                                      position.sell_amount or position.amount)
+
+        # 실시간 체결가 이벤트 스레드와 공유하는 매도주문 중복 방지 기록, lock 으로 보호
+        self.lock = threading.Lock()
+        self.selling_buy_order_numbers = set()
+        self.last_real_price_received_at = dict()
+        # {매수주문번호: 마지막으로 매도주문이 실패한 시각(time.monotonic)}
+        self.sell_failed_at = dict()
+
+        self.exit_rule_engine = ExitRuleEngine(create_exit_rules)
+        self.position_book.add_listener(self.exit_rule_engine)
+
+        # 고점이나 보유시간을 보는 규칙은 체결가마다 상태를 갱신해야 하므로 polling 비교도 ExitRuleEngine 으로 함
+        self.exit_evaluator = None
+        if ExitEvaluator is not None and not STATEFUL_EXIT_RULES:
+            self.exit_evaluator = ExitEvaluator(get_exit_limits)
+            self.position_book.add_listener(self.exit_evaluator)
+
+    def stop(self):
+        self.stopped.set()
+
+    def log_sell_timing(self, stock_code, earning_rate, loss_limit=LOSS_LIMIT):
+        if earning_rate <= loss_limit:
+            self.debugger.info('{} : 손익율 {}%, 손실하한 미만으로 매도합니다', stock_code, earning_rate,
+                               extra=dict(stock_code=stock_code))
+        else:
+            self.debugger.info('{} : 손익율 {}%, 수익상한 초과로 매도합니다', stock_code, earning_rate,
+                               extra=dict(stock_code=stock_code))
+
+    def log_sell_reason(self, position, current_price, reason, amount):
+        earning_rate = calculate_earning_rate(current_price, position.price)
+        self.debugger.info('{} : 손익율 {}%, {} - {} 주 매도합니다', position.stock_code, earning_rate, reason, amount,
+                           extra=dict(stock_code=position.stock_code, order_number=position.buy_order_number))
+
+    def check_sell_timing(self, stock_code, current_price, received_at=None):
+        """
+        해당 종목코드 주문들의 청산 규칙을 현재가로 갱신하고, 매도주문 전인 주문 중 매도 조건에 맞는 주문을 매도
+        received_at 은 체결가 이벤트를 받은 시각(time.monotonic), 매도주문번호를 받기까지 걸린 시간을 기록할 때 사용
+        """
+        sells = self.exit_rule_engine.on_price(stock_code, current_price)
+
+        with self.lock:
+            if received_at is not None:
+                self.last_real_price_received_at[stock_code] = received_at
+
+            positions_to_sell = list()
+            for buy_order_number, reason, amount in sells:
+                # 매도주문체결 완료되지 않은 종목, 매도주문 중인 종목은 매도하지 않음
+                position = self.position_book.get(buy_order_number)
+                if position is None or position.sell_order_number or \
+                        buy_order_number in self.selling_buy_order_numbers or \
+                        self.is_sell_retry_waiting(buy_order_number):
+                    continue
+
+                self.log_sell_reason(position, current_price, reason, amount)
+                self.selling_buy_order_numbers.add(buy_order_number)
+                positions_to_sell.append((position, amount))
+
+        self.sell_positions(positions_to_sell, received_at)
+
+    def check_sell_timing_all(self, current_prices):
+        """
+        현재가 스냅샷({종목코드: 현재가})에 있는 모든 주문의 손익률을 ExitEvaluator 로 한번에 비교 후 매도
+        """
+        buy_order_numbers, earning_rates = self.exit_evaluator.evaluate(current_prices)
+
+        with self.lock:
+            positions_to_sell = list()
+            for buy_order_number, earning_rate in zip(buy_order_numbers, earning_rates):
+                position = self.position_book.get(buy_order_number)
+                if position is None or position.sell_order_number or \
+                        buy_order_number in self.selling_buy_order_numbers or \
+                        self.is_sell_retry_waiting(buy_order_number):
+                    continue
+
+                _, loss_limit = get_exit_limits(position.condition_name)
+                self.log_sell_timing(position.stock_code, float(earning_rate), loss_limit)
+                self.selling_buy_order_numbers.add(buy_order_number)
+                positions_to_sell.append((position, position.amount))
+
+        self.sell_positions(positions_to_sell)
+
+    def is_sell_retry_waiting(self, buy_order_number):
+        # lock 을 잡은 상태에서 부름
+        failed_at = self.sell_failed_at.get(buy_order_number)
+        if failed_at is None:
+            return False
+        if time.monotonic() - failed_at < self.sell_retry_seconds:
+            return True
+        del self.sell_failed_at[buy_order_number]
+        return False
+
+    def sell_positions(self, positions_to_sell, received_at=None):
+        """positions_to_sell 은 (주문, 매도 수량) list"""
+        for position, order_amount in positions_to_sell:
+            ordered = False
+            try:
+                ordered = self.sell(position, received_at, order_amount)
+            finally:
+                with self.lock:
+                    self.selling_buy_order_numbers.discard(position.buy_order_number)
+                    if not ordered:
+                        self.sell_failed_at[position.buy_order_number] = time.monotonic()
+
+    def sell(self, position, received_at=None, order_amount=None):
+        """order_amount 를 주지 않으면 전량 매도, 매도주문번호를 받아서 장부에 저장했으면 True"""
+        buy_order_number = position.buy_order_number
+        stock_code = position.stock_code
+        if order_amount is None or order_amount > position.amount:
+            order_amount = position.amount
+
+        self.debugger.info('{} : 해당 종목을 {} 개만큼 매도합니다', stock_code, order_amount,
+                           extra=dict(stock_code=stock_code, order_number=buy_order_number))
+        sell_order_number = self.command_client.call(Commands.SELL,
+                                                     account_num=self.account_num,
+                                                     stock_code=stock_code,
+                                                     qty=order_amount
+                                                     )
+
+        # 매도주문번호 리턴값이 에러코드면 주문 실패
+        if not sell_order_number or re.compile('[^0-9]').match(sell_order_number):
+            self.debugger.debug('{} : sell order failed, error code {}', stock_code, sell_order_number,
+                                extra=dict(stock_code=stock_code, command=Commands.SELL.value))
+            return False
+
+        # 매도 후 주문번호를 정상적으로 리턴했으면 매도주문에 성공, db에서 해당종목 삭제
+        self.debugger.info('{} : 주문번호 - {}, 매도주문에 성공했습니다', stock_code, sell_order_number,
+                           extra=dict(stock_code=stock_code, order_number=sell_order_number))
+        if received_at is not None:
+            latency = time.monotonic() - received_at
+            metrics.observe('trader_tick_to_sell_order_seconds', latency)
+            self.debugger.info('{} : 실시간 체결가 수신부터 매도주문번호 수신까지 {:.1f}ms', stock_code, latency * 1000,
+                               extra=dict(stock_code=stock_code, order_number=sell_order_number, latency=latency))
+
+        # 매도주문번호 매수주문번호 row 에 장부/DB에 저장, 기억하고 있다가 나중에 매도체결 완료되면 매도주문번호로 삭제
+        try:
+            self.position_book.set_sell_order_number(buy_order_number, sell_order_number, order_amount)
+            self.debugger.info('매도주문번호 - {}, DB에 저장하였습니다', sell_order_number)
+
+        except Exception as e:
+            self.debugger.exception('매도주문번호 저장 실패, error - {}', e)
+            return False
+
+        self.track_sell_order(sell_order_number, stock_code, order_amount)
+        return True
+
+    def track_sell_order(self, sell_order_number, stock_code, order_amount):
+        self.pending_sell_order_number_list.append(sell_order_number)
+        future = self.order_tracker.track(sell_order_number, stock_code, order_amount)
+        future.add_done_callback(self.on_sell_filled)
+
+    def reconcile_positions(self):
+        """
+        재시작 직후 한번, 장부를 증권사 미체결 주문과 잔고에 맞춤
+        1. 미체결 목록에 없는 매도주문은 주문내역으로 확인해서 주문 수량만큼 체결됐으면 on_sell_filled 로 처리하고,
+           주문 수량보다 적게 체결되고 끝났으면(취소/거부) 체결된 수량은 closed_trades 에 기록하고
+           매도주문번호를 지우고 남은 수량으로 다시 매도 대상에 넣음
+        2. 매도주문이 없는데 잔고에 없는 종목의 주문은 장부에서 삭제, 없는 주식을 매도하지 않도록 함
+        미체결/잔고 조회에 실패하면 해당 단계는 건너뜀
+        """
+        open_order_numbers = self.command_client.call(Commands.GET_OPEN_ORDERS, account_num=self.account_num)
+        holdings = self.command_client.call(Commands.GET_HOLDINGS, account_num=self.account_num)
+        if open_order_numbers is None or holdings is None:
+            self.debugger.warning('미체결/잔고 조회에 실패해서 장부를 증권사 주문과 맞추지 못했습니다')
+        if open_order_numbers is not None:
+            open_order_numbers = set(open_order_numbers)
+
+        for position in self.position_book.all():
+            sell_order_number = position.sell_order_number
+            if not sell_order_number:
+                if holdings is not None and position.stock_code not in holdings:
+                    self.debugger.warning('{} : 주문번호 - {} 잔고에 없는 종목이라 장부에서 삭제합니다',
+                                          position.stock_code, position.buy_order_number,
+                                          extra=dict(stock_code=position.stock_code,
+                                                     order_number=position.buy_order_number))
+                    self.position_book.remove(position.buy_order_number)
+                continue
+
+            # 아직 미체결인 매도주문은 이미 추적 중이므로 체결 이벤트를 기다림
+            if open_order_numbers is None or sell_order_number in open_order_numbers:
+                continue
+
+            order_history = self.command_client.call(Commands.GET_ORDER_HISTORY, order_number=sell_order_number)
+            if not order_history:
+                continue
+
+            # 분할익절 매도주문은 보유 수량의 일부만 주문하므로 주문 수량과 비교
+            filled = order_history['filled']
+            ordered_amount = order_history.get('amount') or position.sell_amount or position.amount
+            if filled >= ordered_amount:
+                # 추적 중인 매도주문이므로 on_sell_filled 에서 closed_trades 기록과 장부/DB 삭제(일부 매도면 남은 수량으로 바꿈)
+                self.order_tracker.update_from_history(sell_order_number, order_history)
+                continue
+
+            self.order_tracker.untrack(sell_order_number)
+            if sell_order_number in self.pending_sell_order_number_list:
+                self.pending_sell_order_number_list.remove(sell_order_number)
+            if filled > 0:
+                self.position_book.record_closed_trade(position, sell_order_number, filled,
+                                                       order_history['filled_price'])
+            remaining = position.amount - filled
+            self.debugger.warning('{} : 매도주문번호 - {} 주문 수량 {} 주 중 {} 주만 체결되고 끝나서 남은 {} 주를 다시 매도 대상에 넣습니다',
+                                  position.stock_code, sell_order_number, ordered_amount, filled, remaining,
+                                  extra=dict(stock_code=position.stock_code, order_number=sell_order_number))
+            self.position_book.reopen(position.buy_order_number, remaining)
+
+    def is_real_price_fresh(self, stock_code):
+        with self.lock:
+            received_at = self.last_real_price_received_at.get(stock_code)
+        return received_at is not None and time.monotonic() - received_at < self.real_price_stale_seconds
+
+    def register_real_current_price(self):
+        # 장부 종목과 실시간 등록 종목의 차이만 화면번호별로 등록/해지
+        register, unregister = self.real_registration.sync(self.position_book.stock_codes())
+
+        for screen_number, stock_codes in unregister.items():
+            self.debugger.info('{} : 장부에서 빠진 종목의 실시간 가격 이벤트 등록을 해지합니다 (화면번호 {})',
+                               stock_codes, screen_number)
+            self.command_client.request(Commands.UNREGISTER_REAL_CURRENT_PRICE,
+                                        stock_code_list=stock_codes,
+                                        screen_number=screen_number
+                                        )
+        if unregister:
+            with self.lock:
+                for stock_codes in unregister.values():
+                    for stock_code in stock_codes:
+                        self.last_real_price_received_at.pop(stock_code, None)
+
+        for screen_number, stock_codes in register.items():
+            self.debugger.info('{} : 해당종목을 실시간 가격 이벤트에 등록합니다 (화면번호 {})',
+                               stock_codes, screen_number)
+            self.command_client.request(Commands.REGISTER_REAL_CURRENT_PRICE,
+                                        stock_code_list=stock_codes,
+                                        screen_number=screen_number
+                                        )
+
+    def request_real_current_prices(self, stock_code_list):
+        return self.command_client.request(Commands.GET_REAL_CURRENT_PRICES,
+                                           stock_code_list=stock_code_list
+                                           )
+
+    def run(self):
+        # 재시작 직후 복원된 장부 종목을 바로 감시하도록 첫 확인은 기다리지 않음
+        wait_seconds = 0
+        reconciled = False
+        while not self.stopped.wait(wait_seconds):
+            wait_seconds = 1
+
+            # 장부에 매수 체결된 종목들 실시간 현재가 이벤트 받기 등록
+            # 장부가 바뀌었을 때만 새로 등록하거나 해지할 종목이 있는지 확인함
+            position_book_version = self.position_book.version
+            if position_book_version != self.position_book_version:
+                self.position_book_version = position_book_version
+                self.register_real_current_price()
+
+            # 실시간 등록을 먼저 요청한 뒤 장부를 증권사 미체결/잔고와 맞춤
+            if not reconciled:
+                reconciled = True
+                self.reconcile_positions()
+
+            # 장부에서 종목별 매수가와 실시간으로 받아온 현재가 비교로직
+            # 이벤트 방식이면 최근에 실시간 체결가 이벤트를 받은 종목은 KiwoomRealPriceSellTrigger 가 처리함
+            stock_codes_to_check = [stock_code for stock_code in self.position_book.stock_codes()
+                                    if not (self.event_driven and self.is_real_price_fresh(stock_code))]
+
+            # 비교할 종목들의 현재가를 한번에 받아옴, cache 에 최근 현재가가 없는 종목만 조회
+            current_prices = dict()
+            if stock_codes_to_check:
+                current_prices = self.price_cache.get_prices(stock_codes_to_check, self.request_real_current_prices)
+
+            for stock_code in stock_codes_to_check:
+                if not current_prices.get(stock_code):
+                    self.debugger.debug('{} : failed to get real current price', stock_code)
+
+            # 현재가와 매수가격 비교 뒤 수익률이 LOSS_LIMIT 과 PROFIT_LIMIT 영역 밖이면 매도
+            # 매도성공시 리턴값으로 주문번호(order_number) 받음
+            if self.exit_evaluator is not None:
+                self.check_sell_timing_all(current_prices)
+            else:
+                for stock_code, current_price in current_prices.items():
+                    self.check_sell_timing(stock_code, current_price)
+
+            # 체결 이벤트가 오지 않는 매도주문만 주문내역을 조회해서 체결 상태 보완, 전량 매도되면 on_sell_filled 에서 삭제
+            # 주문내역 조회는 한꺼번에 요청하고 함께 기다림
+            silent_sell_order_numbers = self.order_tracker.silent_order_numbers(self.pending_sell_order_number_list)
+            order_history_futures = list()
+            for sell_order_number in silent_sell_order_numbers:
+                self.debugger.debug('order number {} : started getting order history', sell_order_number)
+                order_history_futures.append(self.command_client.request(Commands.GET_ORDER_HISTORY,
+                                                                         order_number=sell_order_number))
+
+            for sell_order_number, order_history in zip(silent_sell_order_numbers,
+                                                        self.command_client.wait_all(order_history_futures)):
+                if not order_history:
+                    continue
+
+                self.order_tracker.update_from_history(sell_order_number, order_history)
+
+    def on_sell_filled(self, future):
+        """
+        매도주문이 전량 체결되면 OrderTracker 가 부르는 콜백, 체결을 closed_trades ledger 에 기록하고 장부/DB 에서 해당 주문 삭제
+        분할익절처럼 보유 수량의 일부만 매도한 주문이면 남은 수량으로 다시 매도 대상에 넣음
+        """
+        if future.cancelled():
+            return
+        order_history = future.result()
+
+        sell_order_number = order_history['order_number']
+        stock_code = order_history['stock_code']
+        filled = order_history['filled']
+        filled_price = order_history['filled_price']
+
+        try:
+            position = self.position_book.get_by_sell_order_number(sell_order_number)
+            if position is not None:
+                self.position_book.record_closed_trade(position, sell_order_number, filled, filled_price)
+            if position is not None and filled < position.amount:
+                remaining_amount = position.amount - filled
+                self.position_book.reopen(position.buy_order_number, remaining_amount)
+                self.debugger.info('{} : 주문번호 - {} {} 에 {} 개만큼 매도했습니다, 남은 수량 {}',
+                                   stock_code, sell_order_number, filled_price, filled, remaining_amount,
+                                   extra=dict(stock_code=stock_code, order_number=sell_order_number))
+            else:
+                self.remove_sold_position(sell_order_number, stock_code, filled, filled_price)
+        except Exception as e:
+            self.debugger.exception('{} : 주문번호 - {} DB 에서 삭제하는데 실패했습니다, error - {}',
+                                    stock_code, sell_order_number, e,
+                                    extra=dict(stock_code=stock_code, order_number=sell_order_number))
+
+        if sell_order_number in self.pending_sell_order_number_list:
+            self.pending_sell_order_number_list.remove(sell_order_number)
+
+    def remove_sold_position(self, sell_order_number, stock_code, filled, filled_price):
+        self.position_book.remove_by_sell_order_number(sell_order_number)
+        self.debugger.info('{} : 주문번호 - {} DB 삭제 성공, {} 에 {} 개만큼 매도했습니다',
+                           stock_code, sell_order_number, filled_price, filled,
+                           extra=dict(stock_code=stock_code, order_number=sell_order_number))
+
+
+class KiwoomRealPriceSellTrigger(threading.Thread):
+    """
+    broker 의 실시간 체결가 listener 로 등록되어, 체결가 이벤트가 들어온 종목의 보유 주문만 즉시 손익률 비교 후 매도
+    on_real_price 는 키움 이벤트 스레드에서 불리므로 큐에 넣기만 하고, 매도 주문은 이 스레드에서 처리함
+    """
+
+    def __init__(self, price_checker, debugger):
+        super().__init__()
+        self.price_checker = price_checker
+        self.debugger = debugger
+
+        self.stopped = threading.Event()
+        self.real_price_q = queue.Queue()
+
+    def stop(self):
+        self.stopped.set()
+
+    def on_real_price(self, stock_code, current_price):
+        self.real_price_q.put((time.monotonic(), stock_code, current_price))
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                received_at, stock_code, current_price = self.real_price_q.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            try:
+                self.price_checker.check_sell_timing(stock_code, current_price, received_at)
+            except Exception as e:
+                self.debugger.exception(e)
+
+
+class KiwoomCatchConditionOrder(threading.Thread):
+    """
+    ConditionTracker 가 넘겨주는 조건식 편입 종목(ConditionHit)을 시장가로 매수
+    1. 편입 이벤트가 들어오면 그때 쌓여있는 편입 종목(최대 max_burst 개)을 한꺼번에 처리
+       현재가는 PriceCache 에 최근 현재가가 없는 종목만 GET_CURRENT_PRICES 한번으로 조회하고,
+       수량을 모두 계산한 뒤 매수 주문을 연달아 넣고 주문번호를 함께 기다림
+       주문 간격은 command_q 의 주문 TokenBucket 이 맞춤
+    2. 현재가 조회나 매수 주문에 실패한 종목은 1초 뒤 아직 편입 상태일 때 다시 시도
+    3. 등록 시점에 이미 편입된 종목처럼 이벤트로 받지 못한 종목은 condition_sync_seconds 마다 GET_CONDITIONS 로 보완
+    4. 매수주문의 전량 체결은 OrderTracker 의 체결 이벤트로 확인하고 장부/DB에 조건식 이름과 함께 저장
+       체결 전 매수주문은 DB 에도 남겨두고, 재시작하면 증권사 미체결/주문내역과 맞춰서 추적을 이어가거나 장부에 반영함
+    5. 매수 주문과 미체결 조회는 account_num 계좌로 함
+    """
+
+    def __init__(self, command_client, position_book, order_tracker, condition_tracker, debugger,
+                 condition_sync_seconds=60, retry_seconds=1, max_burst=100, price_cache=None, account_num=ACCOUNT_NUM):
+        super().__init__()
+        self.command_client = command_client
+        self.account_num = account_num
+        self.price_cache = price_cache if price_cache is not None else PriceCache(command_client)
+        self.position_book = position_book
+        self.order_tracker = order_tracker
+        self.condition_tracker = condition_tracker
+        self.debugger = debugger
+        self.condition_sync_seconds = condition_sync_seconds
+        self.retry_seconds = retry_seconds
+        self.max_burst = max_burst
+
+        self.stopped = threading.Event()
+
+        self.pending_buy_order_number_list = list()
+        # {매수주문번호: 조건식 이름}, 체결되면 장부에 함께 저장
+        self.buy_order_condition_names = dict()
+        # 실패해서 다시 시도할 (시도할 시각, ConditionHit)
+        self.retry_hits = list()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        self.restore_pending_buy_orders()
+
+        # 시작하자마자 한번 GET_CONDITIONS 로 이미 편입된 종목을 가져옴
+        next_sync_at = time.monotonic()
+        next_poll_at = time.monotonic() + 1
+
+        while not self.stopped.is_set():
+            now = time.monotonic()
+            if now >= next_sync_at:
+                next_sync_at = now + self.condition_sync_seconds
+                self.sync_conditions()
+
+            # 다음 할 일(재시도, 동기화, 주문내역 조회)까지 편입 이벤트를 기다림
+            wait_until = min([next_sync_at, next_poll_at] + [retry_at for retry_at, _ in self.retry_hits])
+            hit = self.condition_tracker.get_hit(timeout=max(0, wait_until - time.monotonic()))
+            if hit is not None:
+                self.buy_hits([hit] + self.condition_tracker.get_hits_nowait(self.max_burst - 1))
+
+            self.retry_due_hits()
+
+            if time.monotonic() >= next_poll_at:
+                next_poll_at = time.monotonic() + 1
+                self.poll_silent_orders()
+
+    def sync_conditions(self):
+        condition_stock_codes = self.command_client.call(Commands.GET_CONDITIONS, default=list())
+        for stock_code in self.condition_tracker.sync(condition_stock_codes or list()):
+            self.debugger.debug('{} : 조건식 조회로 편입 종목을 추가했습니다', stock_code)
+
+    def retry_due_hits(self):
+        now = time.monotonic()
+        due_hits = [hit for retry_at, hit in self.retry_hits if retry_at <= now]
+        if not due_hits:
+            return
+        self.retry_hits = [(retry_at, hit) for retry_at, hit in self.retry_hits if retry_at > now]
+
+        # 그 사이 조건식에서 이탈했으면 매수하지 않음
+        hits = [hit for hit in due_hits if self.condition_tracker.is_in_condition(hit.stock_code)]
+        if hits:
+            self.buy_hits(hits)
+
+    def retry_later(self, hit):
+        self.retry_hits.append((time.monotonic() + self.retry_seconds, hit))
+
+    def buy_hits(self, hits):
+        metrics.observe('trader_condition_burst_size', len(hits), buckets=BURST_SIZE_BUCKETS)
+        for hit in hits:
+            self.debugger.info('조건식에 맞는 종목을 캐치했습니다 - {} ({})', hit.stock_code, hit.condition_name)
+
+        # 몇 주 주문할지 계산하기 위해 현재가를 한번에 가져오기
+        current_prices = self.price_cache.get_prices([hit.stock_code for hit in hits], self.request_current_prices)
+
+        # 모든 종목의 수량을 먼저 계산하고 매수 주문을 연달아 넣음, {Future: (ConditionHit, 주문 수량)}
+        orders = dict()
+        for hit in hits:
+            stock_code = hit.stock_code
+            current_price = current_prices.get(stock_code)
+
+            # 현재가 가져오는데 실패하면 잠시 뒤 다시시도
+            if not current_price:
+                self.debugger.debug('{} : failed to get current price', stock_code)
+                self.retry_later(hit)
+                continue
+
+            # 매수금액(BUY_PRICE)을 1주당 현재가로 나눈 가격만큼 매수 주문
+            order_amount = calculate_order_amount(BUY_PRICE, current_price)
+            self.debugger.info('{} : 주문 수량 - {}', stock_code, order_amount)
+
+            if order_amount == 0:
+                self.debugger.info('{} : 주가가 매매금액을 초과하여 주문을 체결하지 않습니다', stock_code)
+                continue
+
+            self.debugger.info('{} : 해당 종목을 {} 개만큼 매수합니다', stock_code, order_amount,
+                               extra=dict(stock_code=stock_code))
+            future = self.command_client.request(Commands.BUY,
+                                                 account_num=self.account_num,
+                                                 stock_code=stock_code,
+                                                 qty=order_amount
+                                                 )
+            orders[future] = (hit, order_amount)
+
+        # 주문번호를 받는 순서대로 체결 추적 시작
+        for future, order_number in self.command_client.iter_completed(orders):
+            hit, order_amount = orders[future]
+            self.on_buy_ordered(hit, order_amount, order_number)
+
+    def request_current_prices(self, stock_code_list):
+        # 실제 TR 요청 수만큼 rate_cost 를 씀
+        return self.command_client.request(Commands.GET_CURRENT_PRICES,
+                                           stock_code_list=stock_code_list,
+                                           rate_cost=-(-len(stock_code_list) // CURRENT_PRICES_PER_REQUEST)
+                                           )
+
+    def on_buy_ordered(self, hit, order_amount, order_number):
+        stock_code = hit.stock_code
+
+        # 매수 후 주문번호 리턴값이 에러코드면 주문 실패, 잠시 뒤 다시 시도
+        if not order_number or re.compile('[^0-9]').match(order_number):
+            self.debugger.info('{} : 매수 주문 실패 {}', stock_code, order_number,
+                               extra=dict(stock_code=stock_code, command=Commands.BUY.value))
+            self.retry_later(hit)
+            return
+
+        latency = time.monotonic() - hit.received_at
+        metrics.observe('trader_condition_to_buy_order_seconds', latency)
+        self.debugger.info('{} : 매수 주문 성공, 주문번호 - {}', stock_code, order_number,
+                           extra=dict(stock_code=stock_code, order_number=order_number, latency=latency))
+        # 체결 전에 종료되어도 재시작할 때 복원할 수 있도록 DB 에 남김
+        self.position_book.add_pending_buy_order(order_number, stock_code, order_amount, hit.condition_name)
+        self.track_buy_order(order_number, stock_code, order_amount, hit.condition_name)
+
+    def track_buy_order(self, order_number, stock_code, order_amount, condition_name):
+        self.pending_buy_order_number_list.append(order_number)
+        self.buy_order_condition_names[order_number] = condition_name
+        future = self.order_tracker.track(order_number, stock_code, order_amount)
+        future.add_done_callback(self.on_buy_filled)
+
+    def restore_pending_buy_orders(self):
+        """
+        재시작 직후 한번, DB 에 남은 체결 전 매수주문을 증권사 미체결 주문과 맞춤
+        아직 미체결이면 추적을 이어가고, 끝난 주문은 주문내역의 체결량만큼 장부에 넣거나(체결량 0 이면 삭제) 정리함
+        """
+        pending_buy_orders = self.position_book.get_pending_buy_orders()
+        if not pending_buy_orders:
+            return
+
+        open_order_numbers = self.command_client.call(Commands.GET_OPEN_ORDERS, account_num=self.account_num)
+        if open_order_numbers is not None:
+            open_order_numbers = set(open_order_numbers)
+
+        for pending_buy_order in pending_buy_orders:
+            order_number = pending_buy_order.order_number
+            stock_code = pending_buy_order.stock_code
+
+            # 장부에 저장한 뒤 체결 전 매수주문을 지우기 전에 종료된 경우
+            if self.position_book.get(order_number) is not None:
+                self.position_book.remove_pending_buy_order(order_number)
+                continue
+
+            if open_order_numbers is not None and order_number not in open_order_numbers:
+                order_history = self.command_client.call(Commands.GET_ORDER_HISTORY, order_number=order_number)
+                if order_history:
+                    if order_history['filled']:
+                        self.position_book.add(order_number, stock_code, order_history['filled'],
+                                               order_history['filled_price'], pending_buy_order.condition_name)
+                        self.debugger.info('{} : 주문번호 - {} 종료 중 체결된 {} 주를 장부에 복원했습니다',
+                                           stock_code, order_number, order_history['filled'],
+                                           extra=dict(stock_code=stock_code, order_number=order_number))
+                    else:
+                        self.position_book.remove_pending_buy_order(order_number)
+                        self.debugger.info('{} : 주문번호 - {} 체결되지 않고 끝난 매수주문을 삭제합니다',
+                                           stock_code, order_number,
+                                           extra=dict(stock_code=stock_code, order_number=order_number))
+                    continue
+
+            # 아직 미체결이거나 확인하지 못한 주문은 체결 이벤트와 주문내역 조회로 계속 추적
+            self.debugger.info('{} : 주문번호 - {} 체결 전 매수주문 추적을 이어갑니다', stock_code, order_number,
+                               extra=dict(stock_code=stock_code, order_number=order_number))
+            self.track_buy_order(order_number, stock_code, pending_buy_order.amount, pending_buy_order.condition_name)
+
+    def poll_silent_orders(self):
+        # 체결 이벤트가 오지 않는 매수주문만 주문내역을 조회해서 체결 상태 보완, 전량 체결되면 on_buy_filled 에서 저장
+        # 주문내역 조회는 한꺼번에 요청하고 함께 기다림
+        silent_order_numbers = self.order_tracker.silent_order_numbers(self.pending_buy_order_number_list)
+        order_history_futures = list()
+        for order_number in silent_order_numbers:
+            self.debugger.debug('order number {} : started getting order history', order_number)
+            order_history_futures.append(self.command_client.request(Commands.GET_ORDER_HISTORY,
+                                                                     order_number=order_number))
+
+        for order_number, order_history in zip(silent_order_numbers,
+                                               self.command_client.wait_all(order_history_futures)):
+            if not order_history:
+                continue
+
+            self.order_tracker.update_from_history(order_number, order_history)
+
+    def on_buy_filled(self, future):
+        """매수주문이 전량 체결되면 OrderTracker 가 부르는 콜백, 장부/DB 에 저장"""
+        if future.cancelled():
+            return
+        order_history = future.result()
+
+        order_number = order_history['order_number']
+        stock_code = order_history['stock_code']
+        order_amount = order_history['amount']
+        filled_price = order_history['filled_price']
+        condition_name = self.buy_order_condition_names.pop(order_number, None)
+
+        try:
+            self.position_book.add(order_number, stock_code, order_amount, filled_price, condition_name)
+            self.debugger.info('{} : 주문번호 - {} DB 저장 성공, 해당 종목 {} 주를 {} 에 매수했습니다',
+                               stock_code, order_number, order_amount, filled_price,
+                               extra=dict(stock_code=stock_code, order_number=order_number))
+        except Exception as e:
+            self.debugger.exception('{} : 주문번호 - {} 해당 종목을 DB에 저장하는데 실패했습니다, error - {}',
+                                    stock_code, order_number, e,
+                                    extra=dict(stock_code=stock_code, order_number=order_number))
+
+        if order_number in self.pending_buy_order_number_list:
+            self.pending_buy_order_number_list.remove(order_number)
+
+
+class HeadlessConditionTrader(object):
+    """
+    KiwoomConditionTrader 와 같은 매수/매도/Communicate Thread 구성을 Qt 없이 주어진 broker 로 실행
+    recording_directory 를 주면 실시간 체결가와 조건식 편입/이탈 이벤트를 TickRecorder 로 기록
+    command_q 를 주면 Communicate Thread 를 만들지 않고 그 command_q 로 요청을 보냄 (게이트웨이에 연결된 worker 프로세스)
+    이때 broker 는 이벤트 listener 등록에만 사용하고, account_num 계좌로 condition_list 조건식만 매매함
+    position_condition_names 를 주면 그 조건식으로 매수한 주문만 장부에 읽어옴
+    """
+
+    def __init__(self, broker, database, debugger, recording_directory=None, command_q=None, account_num=ACCOUNT_NUM,
+                 condition_list=CONDITION_LIST, position_condition_names=None,
+                 metrics_export_path=METRICS_EXPORT_PATH):
+        self.command_q = command_q if command_q is not None else create_command_queue()
+        self.command_client = create_command_client(self.command_q)
+        self.condition_list = condition_list
+        self.database = database
+        self.position_book = PositionBook(self.database, condition_names=position_condition_names)
+        self.order_tracker = OrderTracker(silent_seconds=ORDER_SILENT_SECONDS)
+        broker.add_chejan_listener(self.order_tracker.on_chejan)
+        self.condition_tracker = ConditionTracker(debugger.getChild('condition'), max_hits=CONDITION_HIT_QUEUE_SIZE)
+        broker.add_condition_listener(self.condition_tracker.on_condition)
+
+        self.price_cache = PriceCache(self.command_client, ttl=PRICE_CACHE_TTL_SECONDS, max_size=PRICE_CACHE_SIZE)
+        broker.add_real_price_listener(self.price_cache.on_real_price)
+
+        self.communicate_thread = None
+        if command_q is None:
+            self.communicate_thread = CommunicateThread(self.command_q, broker, debugger.getChild('command'))
+        self.kiwoom_catch_condition_order = KiwoomCatchConditionOrder(
+            self.command_client, self.position_book, self.order_tracker, self.condition_tracker,
+            debugger.getChild('buy'), condition_sync_seconds=CONDITION_SYNC_SECONDS, price_cache=self.price_cache,
+            account_num=account_num)
+        self.kiwoom_check_real_current_price = KiwoomCheckRealCurrentPrice(
+            self.command_client, self.position_book, self.order_tracker, debugger.getChild('sell'),
+            event_driven=REAL_PRICE_EVENT_DRIVEN,
+            real_price_stale_seconds=REAL_PRICE_STALE_SECONDS,
+            price_cache=self.price_cache,
+            account_num=account_num)
+
+        self.kiwoom_real_price_sell_trigger = None
+        if REAL_PRICE_EVENT_DRIVEN:
+            self.kiwoom_real_price_sell_trigger = KiwoomRealPriceSellTrigger(self.kiwoom_check_real_current_price,
+                                                                             debugger.getChild('sell'))
+            broker.add_real_price_listener(self.kiwoom_real_price_sell_trigger.on_real_price)
+
+        self.tick_recorder = None
+        if recording_directory:
+            self.tick_recorder = TickRecorder(recording_directory)
+            broker.add_real_price_listener(self.tick_recorder.record_tick)
+            broker.add_condition_listener(self.tick_recorder.record_condition)
+
+        # 게이트웨이 worker 의 command_q 는 게이트웨이 프로세스에 있으므로 게이트웨이가 기록함
+        self.metrics_reporter = MetricsReporter(metrics, debugger.getChild('metrics'), interval=METRICS_SUMMARY_SECONDS,
+                                                export_path=metrics_export_path,
+                                                command_q=self.command_q if command_q is None else None)
+
+    def start(self):
+        if self.tick_recorder:
+            self.tick_recorder.start()
+        if self.communicate_thread:
+            self.communicate_thread.start()
+        self.metrics_reporter.start()
+        # 복원된 장부의 매도 감시를 매수/조건식 등록과 함께 바로 시작
+        self.kiwoom_check_real_current_price.daemon = True
+        self.kiwoom_check_real_current_price.start()
+        self.kiwoom_catch_condition_order.daemon = True
+        self.kiwoom_catch_condition_order.start()
+        if self.kiwoom_real_price_sell_trigger:
+            self.kiwoom_real_price_sell_trigger.daemon = True
+            self.kiwoom_real_price_sell_trigger.start()
+        self.register_conditions()
+
+    def register_conditions(self):
+        self.command_client.request(Commands.REGISTER_CONDITION,
+                                    condition_list=self.condition_list)
+
+    def stop(self):
+        self.kiwoom_catch_condition_order.stop()
+        self.kiwoom_check_real_current_price.stop()
+        if self.kiwoom_real_price_sell_trigger:
+            self.kiwoom_real_price_sell_trigger.stop()
+        if self.communicate_thread:
+            self.communicate_thread.stop()
+        self.command_client.cancel_all()
+        self.metrics_reporter.stop()
+        if self.tick_recorder:
+            self.tick_recorder.stop()
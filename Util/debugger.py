@@ -1,33 +1,101 @@
 import os
 import sys
+import json
+import queue
+import atexit
 import logging
 import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+# JSON lines 로그에 항상 남기는 필드, 로그를 남길 때 extra=dict(stock_code=..., order_number=...) 로 넘김
+JSON_LOG_FIELDS = ('stock_code', 'order_number', 'command', 'latency')
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    record 를 그대로 큐에 넣기만 하는 QueueHandler
+    기본 QueueHandler 는 호출한 스레드에서 메시지를 만들기 때문에, 메시지 formatting 도 기록 스레드(DebuggerListener)로 미룸
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class DebuggerListener(QueueListener):
+    """
+    큐에 쌓인 record 를 백그라운드 스레드에서 파일/콘솔 handler 로 씀
+    debugger.info('{} : 주문 수량 - {}', stock_code, order_amount) 처럼 인자를 따로 넘기면 여기서 str.format 으로 메시지를 만듦
+    인자 없이 넘긴 메시지는 그대로 사용하고, '%s' 형식의 메시지는 logging 기본 방식으로 만듦
+    """
+
+    def prepare(self, record):
+        if record.args and '{' in str(record.msg):
+            args = record.args if isinstance(record.args, tuple) else (record.args,)
+            record.msg = str(record.msg).format(*args)
+            record.args = None
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """record 하나를 JSON 한 줄로 만듦, JSON_LOG_FIELDS 는 넘기지 않으면 null"""
+
+    def format(self, record):
+        line = dict(time=datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                    level=record.levelname,
+                    component=record.name,
+                    message=record.getMessage())
+        for field in JSON_LOG_FIELDS:
+            line[field] = getattr(record, field, None)
+        if record.exc_info:
+            line['exception'] = self.formatException(record.exc_info)
+        return json.dumps(line, ensure_ascii=False, default=str)
+
 
 debugger = logging.getLogger('Debugger')
 debugger.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(lineno)d - %(message)s")
+formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(lineno)d - %(message)s")
 
 try:
     now = str(datetime.datetime.now()).replace(':','')
     if not os.path.isdir('./logs'):
         os.mkdir('./logs')
     os.mkdir('./logs/log-{}'.format(now))
-    f_hdlr = RotatingFileHandler('./logs/log-{}/Debugger.log'.format(now), encoding='UTF-8', maxBytes=10 * 1024 * 1024, backupCount=50)
+    log_directory = './logs/log-{}'.format(now)
 except:
-    f_hdlr = RotatingFileHandler('Debugger.log', encoding='UTF-8', maxBytes=10 * 1024 * 1024, backupCount=50)
+    log_directory = '.'
+f_hdlr = RotatingFileHandler(os.path.join(log_directory, 'Debugger.log'), encoding='UTF-8', maxBytes=10 * 1024 * 1024, backupCount=50)
 f_hdlr.setFormatter(formatter)
 f_hdlr.setLevel(logging.DEBUG)
 
-debugger.addHandler(f_hdlr)
-
 formatter = logging.Formatter("[%(asctime)s] %(message)s")
 s_hdlr = logging.StreamHandler()
 s_hdlr.setFormatter(formatter)
 
-debugger.addHandler(s_hdlr)
+# 매수/매도 스레드는 큐에 넣기만 하고, 파일/콘솔 쓰기는 debugger_listener 스레드가 함
+debugger_q = queue.SimpleQueue()
+debugger.addHandler(DeferredQueueHandler(debugger_q))
+debugger_listener = DebuggerListener(debugger_q, f_hdlr, s_hdlr, respect_handler_level=True)
+debugger_listener.start()
+# 종료할 때 큐에 남은 로그를 모두 쓰고 끝냄
+atexit.register(debugger_listener.stop)
+
+
+def configure_debugger(json_log=False, levels=None):
+    """
+    json_log 면 같은 로그 폴더의 Debugger.jsonl 에 JSON lines 로도 기록
+    levels 는 {컴포넌트 이름: 레벨} 로, debugger.getChild(컴포넌트 이름) 로그의 레벨을 따로 정함
+    """
+    if json_log:
+        j_hdlr = RotatingFileHandler(os.path.join(log_directory, 'Debugger.jsonl'), encoding='UTF-8', maxBytes=10 * 1024 * 1024, backupCount=50)
+        j_hdlr.setFormatter(JsonLinesFormatter())
+        j_hdlr.setLevel(logging.DEBUG)
+        debugger_listener.handlers = debugger_listener.handlers + (j_hdlr,)
+
+    for component, level in (levels or dict()).items():
+        debugger.getChild(component).setLevel(level.upper() if isinstance(level, str) else level)
+
 
 def unhandled_exception(exctype, value, tb):
-    debugger.exception("FATAL")
+    debugger.error("FATAL", exc_info=(exctype, value, tb))
 
 sys.excepthook = unhandled_exception